@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+from .builtins import BUILTINS
+from .bytecode import compile_bytecode
+from .optimizer import optimize as optimize_ast
+from .parser import parse, unparse
+from .types import AsyncBuiltin, Environment, LispError
+from .vm import Machine, PAUSED
+
+"""
+Running Lisp inside an asyncio event loop, for Python 3 only.
+
+    value = await interpret_async("(fib 25)", env, timeout=1.0)
+
+The program runs on the virtual machine, which stops every `budget` calls to
+give the event loop a turn, so a long computation does not hold up the other
+tasks. Since it awaits, a running program can be cancelled like any other
+task, and given a timeout, which raises `asyncio.TimeoutError`.
+
+Lisp code can call Python coroutine functions registered as builtins with
+`async_builtin`, which the machine awaits before going on:
+
+    @async_builtin("fetch", 1)
+    async def fetch(url):
+        ...
+
+    (define fetch (builtin fetch (lambda (url) '())))
+
+Builtins calling back into Lisp, such as `map` with the function given to it,
+run without stopping, and count as a single call.
+"""
+
+# The number of calls made between turns of the event loop.
+DEFAULT_BUDGET = 1000
+
+
+def async_builtin(name, min_args, max_args=None):
+    """
+    Decorator registering a Python coroutine function as the builtin name in BUILTINS.
+    """
+    def register(function):
+        BUILTINS[name] = AsyncBuiltin(name, function, min_args, max_args)
+        return function
+
+    return register
+
+
+async def interpret_async(source, env=None, budget=DEFAULT_BUDGET, timeout=None, optimize=False):
+    """
+    Interpret a lisp program statement, giving the event loop a turn every budget calls
+
+    Like `interpret` with the "vm" engine. With a timeout, in seconds, the program is
+    cancelled and `asyncio.TimeoutError` raised once it has run that long.
+    """
+    if env is None:
+        env = Environment()
+
+    ast = parse(source)
+
+    if optimize:
+        ast = optimize_ast(ast)
+
+    run = execute_async(compile_bytecode(ast), env, budget)
+
+    if timeout is not None:
+        run = asyncio.wait_for(run, timeout)
+
+    return unparse(await run)
+
+
+async def execute_async(code, env, budget=DEFAULT_BUDGET):
+    """
+    Execute top level code in env on an asynchronous Machine.
+    :param code:   Code
+    :param env:    Environment
+    :param budget: the number of calls between turns of the event loop
+    :return:       the value of the code
+    """
+    if type(budget) is not int or budget < 1:
+        raise LispError("The budget must be a positive number of calls, not {}.".format(budget))
+
+    machine = Machine(code, env, asynchronous=True)
+    value = machine.run(budget)
+
+    while value is PAUSED:
+        if machine.awaiting is not None:
+            machine.resume(await machine.awaiting)
+        else:
+            await asyncio.sleep(0)
+
+        value = machine.run(budget)
+
+    return value
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-from .types import Closure, String
+from .types import Builtin, Closure, ConsList, String
 
 """
 This module contains a few simple helper functions for
@@ -20,6 +20,10 @@ def is_list(x):
     return isinstance(x, list)
 
 
+def is_cons_list(x):
+    return isinstance(x, ConsList)
+
+
 def is_boolean(x):
     return isinstance(x, bool)
 
@@ -32,9 +36,14 @@ def is_closure(x):
     return isinstance(x, Closure)
 
 
+def is_builtin(x):
+    return isinstance(x, Builtin)
+
+
 def is_atom(x):
     return (is_symbol(x) or
         is_integer(x) or
         is_string(x) or
         is_boolean(x) or
-        is_closure(x))
+        is_closure(x) or
+        is_builtin(x))
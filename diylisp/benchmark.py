@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import atexit
+import gc
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from os.path import abspath, dirname, join
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2 has no tracemalloc. Only times are measured there.
+    tracemalloc = None
+
+from .interpreter import interpret, interpret_batch, interpret_file
+from .parser import parse_multiple
+from .profiler import clock
+from .types import Environment
+
+"""
+The benchmark suite. It times a set of representative workloads, and can save
+the results as JSON and compare them with an earlier run.
+
+    $ python -m diylisp.benchmark --output results.json
+    $ python -m diylisp.benchmark --baseline results.json --threshold 0.2
+
+Each workload is measured `repeat` times, and the best time kept. Where
+tracemalloc is available, one more run measures the memory the workload
+retains, still held at its end while its result is kept, and the peak during it, also given per operation
+for workloads doing a known number of them. Comparing against a
+baseline reports every workload more than `threshold` slower than before,
+and exits with status 1 if there is any.
+"""
+
+ROOT = dirname(dirname(abspath(__file__)))
+STDLIB = join(ROOT, "stdlib.diy")
+REPL = join(ROOT, "repl")
+
+LIST_SIZES = [100, 1000, 5000]
+
+# Pairs of workload name and setup function. The setup function takes the
+# name of the engine, and returns the function to measure.
+BENCHMARKS = []
+
+# The number of operations of the workloads measuring the memory per operation.
+OPERATIONS = {}
+
+
+def benchmark(name, operations=None):
+    """
+    Decorator registering a setup function as the workload name. For a workload doing
+    a known number of operations, the peak memory per operation is reported as well.
+    """
+    def register(setup):
+        BENCHMARKS.append((name, setup))
+
+        if operations is not None:
+            OPERATIONS[name] = operations
+
+        return setup
+
+    return register
+
+
+def stdlib_environment(engine):
+    env = Environment()
+    interpret_file(STDLIB, env, engine, cache=False)
+    return env
+
+
+@benchmark("fact")
+def fact(engine):
+    env = Environment()
+    interpret("(define fact (lambda (n) (if (eq n 0) 1 (* n (fact (- n 1))))))", env, engine)
+    return lambda: interpret("(fact 100)", env, engine)
+
+
+@benchmark("fib")
+def fib(engine):
+    env = Environment()
+    interpret("(define fib (lambda (n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2))))))", env, engine)
+    return lambda: interpret("(fib 18)", env, engine)
+
+
+def list_benchmark(name, source):
+    """
+    Register the workload source as name-SIZE, for each of the LIST_SIZES. The source
+    may refer to `xs`, a list of SIZE numbers in no particular order.
+    """
+    def register(size):
+        @benchmark("%s-%d" % (name, size))
+        def setup(engine):
+            env = stdlib_environment(engine)
+            interpret("(define xs (map (lambda (x) (mod (* x 7919) %d)) (range 1 %d)))" % (size, size),
+                      env, engine)
+            return lambda: interpret(source, env, engine)
+
+    for size in LIST_SIZES:
+        register(size)
+
+
+list_benchmark("sort", "(sort xs)")
+list_benchmark("map", "(map (lambda (x) (* x 2)) xs)")
+list_benchmark("reduce", "(reduce (lambda (acc x) (+ acc x)) 0 xs)")
+
+
+@benchmark("let-nesting")
+def let_nesting(engine):
+    depth = 200
+    source = "x%d" % (depth - 1)
+    for level in reversed(range(depth)):
+        previous = "x%d" % (level - 1) if level else "0"
+        source = "(let ((x%d (+ %s 1))) %s)" % (level, previous, source)
+
+    env = Environment()
+    return lambda: interpret(source, env, engine)
+
+
+@benchmark("closure-calls", operations=100)
+def closure_calls(engine):
+    """
+    Calls that are not tail calls, so that all 100 of them are in progress at the peak.
+    Every other call is to a new closure.
+    """
+    env = Environment()
+    interpret("(define depth (lambda (n) (if (eq n 0) 0 (+ 1 ((lambda (m) (depth (- m 1))) n)))))", env, engine)
+    return lambda: interpret("(depth 50)", env, engine)
+
+
+@benchmark("string-ops", operations=200)
+def string_ops(engine):
+    """Taking the head and tail of each character of a 100 character string."""
+    env = Environment()
+    interpret("(define explode (lambda (s) (if (empty s) '() (cons (head s) (explode (tail s))))))", env, engine)
+    return lambda: interpret("(explode \"%s\")" % ("abcdefghij" * 10), env, engine)
+
+
+@benchmark("batch", operations=1000)
+def batch(engine):
+    """1000 small expressions, 50 different ones, each run apart from the others."""
+    env = stdlib_environment(engine)
+    sources = ["(sum (map (lambda (x) (* x %d)) '(1 2 3 4 5)))" % (n % 50) for n in range(1000)]
+    return lambda: interpret_batch(sources, env, engine)
+
+
+@benchmark("parse")
+def parse_large_source(engine):
+    source = "\n".join("(define f%d (lambda (a b) (if (< a b) '(a \"b\" c) (+ a (* b %d))))) ; %d" % (n, n, n)
+                       for n in range(2000))
+    return lambda: parse_multiple(source)
+
+
+@benchmark("repl-startup")
+def repl_startup(engine):
+    """The time to start the repl script in a new process, and run an empty program."""
+    handle, program = tempfile.mkstemp(suffix=".diy")
+    os.write(handle, b"#t")
+    os.close(handle)
+    atexit.register(os.remove, program)
+
+    def start():
+        with open(os.devnull, "w") as devnull:
+            subprocess.check_call([sys.executable, REPL, "--no-cache", program], stdout=devnull)
+
+    return start
+
+
+def measure(function, repeat):
+    """
+    Run function repeat times, and measure the best time. With tracemalloc, run it once
+    more to measure the memory still held at its end, net of what it freed, and its
+    peak memory use, in bytes.
+    :return: dict with the keys "time", "retained" and "peak"
+    """
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = clock()
+        function()
+        times.append(clock() - start)
+
+    result = {"time": min(times), "retained": None, "peak": None}
+
+    if tracemalloc is not None:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            value = function()
+            current, peak = tracemalloc.get_traced_memory()
+            del value
+        finally:
+            tracemalloc.stop()
+
+        result["retained"] = current - before
+        result["peak"] = peak - before
+
+    return result
+
+
+def run(names=None, engine="compiler", repeat=3, report=None):
+    """
+    Run the workloads in BENCHMARKS, or only those named in names.
+    :param names:  list of workload names, or None for all of them
+    :param engine: the name of the engine running the workloads
+    :param repeat: number of timed runs of each workload
+    :param report: function called with the name and result of each workload as it finishes
+    :return:       dict from workload name to the result of `measure`
+    """
+    results = {}
+
+    for name, setup in BENCHMARKS:
+
+        if names and name not in names:
+            continue
+
+        results[name] = measure(setup(engine), repeat)
+
+        if name in OPERATIONS and results[name]["peak"] is not None:
+            results[name]["peak_per_operation"] = results[name]["peak"] // OPERATIONS[name]
+
+        if report is not None:
+            report(name, results[name])
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Find the workloads which got slower than in baseline by more than threshold.
+    E.g.: threshold 0.1 allows a workload to be 10% slower.
+    :param results:   dict from workload name to result, as returned by `run`
+    :param baseline:  dict from workload name to result, from an earlier run
+    :param threshold: allowed slowdown, as a fraction of the baseline time
+    :return:          list of (name, baseline time, time) tuples
+    """
+    regressions = []
+
+    for name in sorted(results):
+
+        if name not in baseline:
+            continue
+
+        old = baseline[name]["time"]
+        new = results[name]["time"]
+
+        if new > old * (1 + threshold):
+            regressions.append((name, old, new))
+
+    return regressions
+
+
+def format_result(name, result):
+    line = "%-16s %9.4f s" % (name, result["time"])
+
+    if result["peak"] is not None:
+        line += "  %10d B retained  %10d B peak" % (result["retained"], result["peak"])
+
+    if result.get("peak_per_operation") is not None:
+        line += "  %7d B/op" % result["peak_per_operation"]
+
+    return line
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m diylisp.benchmark", description="Benchmark the interpreter.")
+    parser.add_argument("names", nargs="*", help="workloads to run (default: all)")
+    parser.add_argument("--engine", default="compiler", help="engine running the workloads (default: compiler)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per workload (default: 3)")
+    parser.add_argument("--output", help="save the results as JSON to this file")
+    parser.add_argument("--baseline", help="compare the results with this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="allowed slowdown compared to the baseline (default: 0.1, for 10%%)")
+    parser.add_argument("--list", action="store_true", help="list the workloads and exit")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, setup in BENCHMARKS:
+            print(name)
+
+        return 0
+
+    results = run(args.names, args.engine, args.repeat, lambda name, result: print_line(format_result(name, result)))
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"python": sys.version.split()[0], "engine": args.engine, "results": results},
+                      output, indent=2, sort_keys=True)
+
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline) as baseline:
+        regressions = compare(results, json.load(baseline)["results"], args.threshold)
+
+    for name, old, new in regressions:
+        print_line("REGRESSION %-16s %.4f s -> %.4f s (%+.0f%%)" % (name, old, new, (new / old - 1) * 100))
+
+    if not regressions:
+        print_line("No regressions above %.0f%%." % (args.threshold * 100))
+
+    return 1 if regressions else 0
+
+
+def print_line(line):
+    sys.stdout.write(line + "\n")
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+
+import atexit
+import multiprocessing
+import threading
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from .types import LispError, Builtin, ConsList, String
+from .ast import is_list, is_cons_list, is_string
+from .evaluator import cons, empty, eq, math_operation, NUMBER_TYPES
+from .compiler import call_procedure
+from .parser import unparse
+
+"""
+This module holds the builtins: procedures implemented in Python instead of
+in Lisp. They take already evaluated arguments, and are called just like
+closures. Those taking a function as argument accept both closures and other
+builtins.
+
+`pmap` is `map` spread over a pool of worker processes. The function is pickled
+together with the environment it closes over, like in a snapshot, and sent
+along with every chunk of the list. Each worker works on its own copy, so any
+memo caches filled in there are not seen by the calling process.
+
+The standard library binds its list functions to the builtins with the
+`builtin` special form, as in `(define length (builtin length (lambda ...)))`.
+The Lisp definition is the reference implementation, and is used instead
+when there is no builtin registered under that name. The builtins give the
+same results and errors: like `head` and `tail`, they take a String as a list
+of its characters, and they leave checking their arguments to the primitives
+the Lisp definitions use, such as `empty` and the math operators.
+"""
+
+BUILTINS = {}
+
+
+def builtin(name, min_args, max_args=None):
+    """
+    Decorator registering a Python function as the builtin name in BUILTINS.
+    """
+    def register(function):
+        BUILTINS[name] = Builtin(name, function, min_args, max_args)
+        return function
+
+    return register
+
+
+def items(lst):
+    """
+    Consume a list value and return its elements as a Python list. The elements of a
+    String are its characters, as Strings.
+    :param lst: ConsList, list or String
+    :return:    list
+    """
+    if is_cons_list(lst):
+        return list(lst)
+
+    if is_list(lst):
+        return lst
+
+    if is_string(lst):
+        return [String(char) for char in lst.val]
+
+    # Raises the error the Lisp definitions give, as they all start with `empty`.
+    empty(lst)
+
+
+def rebuild(values, lst):
+    """
+    Produce what the Lisp definitions give by consing values onto the empty end of lst:
+    a ConsList for a list, and a String for a String.
+    """
+    if not is_string(lst):
+        return ConsList.from_list(values)
+
+    result = String("")
+    for value in reversed(values):
+        result = cons(value, result)
+
+    return result
+
+
+@builtin("length", 1)
+def length(lst):
+    if is_string(lst):
+        return len(lst)
+
+    if is_cons_list(lst):
+        return lst.length
+
+    return len(items(lst))
+
+
+@builtin("sum", 1)
+def sum_list(lst):
+    # The Lisp definition adds the last element first, so a non-number is reported
+    # from the end of the list.
+    return math_operation("+", items(lst)[::-1] + [0])
+
+
+@builtin("range", 2)
+def range_list(a, b):
+    math_operation("<=", [a, b])
+    return ConsList.from_list(list(range(a, b + 1)))
+
+
+@builtin("append", 2)
+def append(lst1, lst2):
+    if is_string(lst1) and is_string(lst2):
+        return lst1 + lst2
+
+    result = lst2
+    for value in reversed(items(lst1)):
+        result = cons(value, result)
+
+    return result
+
+
+@builtin("reverse", 1)
+def reverse(lst):
+    return ConsList.from_list(items(lst)[::-1])
+
+
+@builtin("map", 2)
+def map_list(fn, lst):
+    return rebuild([call_procedure(fn, [item]) for item in items(lst)], lst)
+
+
+@builtin("pmap", 2, 4)
+def pmap(fn, lst, chunk_size=None, workers=None):
+    """
+    Like map, but calling fn on chunks of chunk_size elements of lst in a pool of
+    workers processes. The results are in the same order as the elements.
+    By default there is one worker per CPU, each getting four chunks.
+    """
+    values = items(lst)
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    if chunk_size is None:
+        chunk_size = max(1, -(-len(values) // (workers * 4)))
+
+    for value in [chunk_size, workers]:
+
+        if type(value) not in NUMBER_TYPES or value < 1:
+            raise LispError("pmap expects a positive chunk size and number of workers, not {}".format(unparse(value)))
+
+    if workers == 1 or len(values) <= chunk_size or in_worker:
+        return map_list(fn, lst)
+
+    payload = pickle.dumps(fn, 2)
+    chunks = [(payload, values[i:i + chunk_size]) for i in range(0, len(values), chunk_size)]
+    results = []
+
+    for chunk in worker_pool(workers).map(map_chunk, chunks):
+        results.extend(chunk)
+
+    return rebuild(results, lst)
+
+
+# Pools by number of workers, started by the first pmap needing one, and
+# closed when the interpreter exits.
+pools = {}
+pools_lock = threading.Lock()
+
+# Set in the worker processes, where pmap runs sequentially instead.
+in_worker = False
+
+
+def worker_pool(workers):
+    with pools_lock:
+        if workers not in pools:
+            pool = multiprocessing.Pool(workers, initializer=start_worker)
+            atexit.register(close_pool, pool)
+            pools[workers] = pool
+
+        return pools[workers]
+
+
+def close_pool(pool):
+    pool.close()
+    pool.join()
+
+
+def start_worker():
+    global in_worker
+    in_worker = True
+
+
+def map_chunk(chunk):
+    """
+    Run in a worker process: unpickle the function and call it on every element of the chunk.
+    """
+    payload, values = chunk
+    fn = pickle.loads(payload)
+    return [call_procedure(fn, [value]) for value in values]
+
+
+@builtin("filter", 2)
+def filter_list(fn, lst):
+    return rebuild([item for item in items(lst) if call_procedure(fn, [item])], lst)
+
+
+@builtin("reduce", 3)
+def reduce_list(fn, acc, lst):
+    for item in items(lst):
+        acc = call_procedure(fn, [acc, item])
+
+    return acc
+
+
+@builtin("slice", 3)
+def slice_list(lst, p, q):
+    """
+    The elements from index p to q, both included. Like the Lisp definition, a negative
+    p counts as 0, and a q below -1 means the rest of the list.
+    """
+    values = items(lst)
+
+    if type(p) in NUMBER_TYPES and type(q) in NUMBER_TYPES:
+        start = max(p, 0)
+        return ConsList.from_list(values[start:] if q < -1 else values[start:q + 1])
+
+    # Step through the list like the Lisp definition, for the same error.
+    sliced = []
+    for value in values:
+
+        if eq(q, -1):
+            break
+
+        if math_operation(">", [p, 0]):
+            p = math_operation("-", [p, 1])
+        else:
+            sliced.append(value)
+
+        q = math_operation("-", [q, 1])
+
+    return ConsList.from_list(sliced)
+
+
+@builtin("merge", 2)
+def merge(lst1, lst2):
+    """
+    Merge two sorted lists. On ties the element of lst1 goes first.
+    """
+    if empty(lst1):
+        return lst2
+
+    if empty(lst2):
+        return lst1
+
+    return ConsList.from_list(merge_values(items(lst1), items(lst2)))
+
+
+def merge_values(values1, values2):
+    merged = []
+    i = j = 0
+
+    while i < len(values1) and j < len(values2):
+
+        if math_operation(">", [values1[i], values2[j]]):
+            merged.append(values2[j])
+            j += 1
+
+        else:
+            merged.append(values1[i])
+            i += 1
+
+    return merged + values1[i:] + values2[j:]
+
+
+@builtin("sort", 1)
+def sort(lst):
+    """
+    A stable sort, in ascending order of `>`.
+    """
+    values = items(lst)
+
+    if len(values) <= 1:
+        return lst
+
+    for value in values:
+
+        if type(value) not in NUMBER_TYPES:
+            # Sort like the Lisp definition, to fail on the same comparison.
+            return ConsList.from_list(merge_sort(values))
+
+    return ConsList.from_list(sorted(values))
+
+
+def merge_sort(values):
+    if len(values) <= 1:
+        return values
+
+    middle = len(values) // 2
+    return merge_values(merge_sort(values[:middle]), merge_sort(values[middle:]))
+
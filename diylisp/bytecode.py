@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+
+from array import array
+
+from .types import LispError, ConsList, intern_keys
+from .ast import is_symbol, is_list
+from .evaluator import expression_type, check_arguments, check_bindings, check_clauses, MATH_OPERATORS
+from .compiler import Scope, definitions, shares_frame
+from .memo import MEMO_FORMS, expand_defmemo
+
+"""
+This is the Bytecode module. It compiles an AST into a Code object: a flat
+sequence of instructions for the virtual machine in `vm.py` to execute.
+
+Every instruction is an opcode followed by a single integer argument, both
+stored in an `array`. Depending on the opcode, the argument is a slot in the
+current frame, a jump target or an index into the constants of the Code
+object, which hold anything that does not fit in an integer.
+
+Variables are resolved at compile time just like in `compiler.py`, using the
+same Scope, so a function runs in a Frame where each local variable has a
+fixed slot. Errors found while compiling turn into a RAISE instruction, and
+are raised when (and if) the offending expression is evaluated.
+"""
+
+(CONST,           # push constants[arg]
+ LOAD_LOCAL,      # push the value in slot arg of the current frame
+ LOAD_OUTER,      # push the value at the (depth, slot, name) in constants[arg]
+ LOAD_GLOBAL,     # push the value of the global variable (name, depth, cache) in constants[arg]
+ DEFINE_GLOBAL,   # pop a value and bind it to the name in constants[arg]; push the name
+ DEFINE_LOCAL,    # pop a value into the unbound slot arg of the current frame; push its name
+ STORE_LOCAL,     # pop a value into slot arg of the current frame
+ ENTER_LET,       # enter a new frame with the slot names in constants[arg]
+ LEAVE_LET,       # go back to the frame enclosing the current one
+ JUMP,            # continue at instruction arg
+ JUMP_IF_FALSE,   # pop a value, and continue at instruction arg if it is false
+ MAKE_CLOSURE,    # push a closure over the current frame, running the Code in constants[arg]
+ CALL,            # pop arg arguments and a function, and push the result of calling it
+ TAIL_CALL,       # like CALL, but the call replaces the running function
+ RETURN,          # return the value on top of the stack to the caller
+ BINARY,          # pop two numbers and push the result of the (name, function) in constants[arg]
+ MATH,            # pop the operands of the (name, count) in constants[arg] and push the result
+ ATOM,            # replace the value on top of the stack with whether it is an atom
+ EQ,              # pop two values and push whether they are the same atom
+ CONS,            # pop a list and an item, and push the list with the item prepended
+ EMPTY,           # replace the list on top of the stack with whether it is empty
+ HEAD,            # replace the list on top of the stack with its first element
+ TAIL,            # replace the list on top of the stack with all but its first element
+ RAISE,           # raise the LispError in constants[arg]
+ ) = range(24)
+
+OPCODE_NAMES = ["CONST", "LOAD_LOCAL", "LOAD_OUTER", "LOAD_GLOBAL", "DEFINE_GLOBAL", "DEFINE_LOCAL",
+                "STORE_LOCAL", "ENTER_LET", "LEAVE_LET", "JUMP", "JUMP_IF_FALSE", "MAKE_CLOSURE",
+                "CALL", "TAIL_CALL", "RETURN", "BINARY", "MATH", "ATOM", "EQ", "CONS", "EMPTY",
+                "HEAD", "TAIL", "RAISE"]
+
+
+class Code(object):
+    """
+    A compiled function, or a compiled top level expression.
+
+    `names` are the slots of the frame the code runs in, and `param_slots` the slots
+    the arguments go into, or None when the arguments fill the first slots in order.
+    The top level code runs in the environment it is given, and has no names.
+    """
+    __slots__ = ('instructions', 'constants', 'names', 'params', 'param_slots', 'body')
+
+    def __init__(self, names=(), params=(), body=None):
+        self.instructions = array('i')
+        self.constants = []
+        self.names = names
+        self.params = params
+        self.param_slots = None
+        self.body = body
+
+    def emit(self, opcode, arg=0):
+        """Append an instruction, and return the position of its argument."""
+        self.instructions.append(opcode)
+        self.instructions.append(arg)
+        return len(self.instructions) - 1
+
+    def constant(self, value):
+        """Add value to the constants, and return its index."""
+        self.constants.append(value)
+        return len(self.constants) - 1
+
+    def label(self):
+        """The position of the next instruction, as a jump target."""
+        return len(self.instructions)
+
+    def patch(self, position, target):
+        """Set the argument at position, as returned by `emit`, to target."""
+        self.instructions[position] = target
+
+    def disassemble(self):
+        """
+        A readable listing of the instructions, one per line.
+        E.g.: "0 LOAD_LOCAL 0\\n2 CONST 0\\n4 BINARY 1\\n6 RETURN 0"
+        """
+        lines = []
+        for pc in range(0, len(self.instructions), 2):
+            lines.append("%d %s %d" % (pc, OPCODE_NAMES[self.instructions[pc]], self.instructions[pc + 1]))
+
+        return "\n".join(lines)
+
+
+def compile_bytecode(ast):
+    """
+    Compile ast into a Code object to run at the top level.
+    E.g.: ["+", 1, 2] -> Code for CONST 0, CONST 1, BINARY 2, RETURN
+    :param ast: list or atom
+    :return:    Code
+    """
+    code = Code()
+    emit_expression(code, ast, None, False)
+    code.emit(RETURN)
+    return code
+
+
+def compile_function(params, body, scope):
+    """
+    Compile the body of a function into a Code object. The frame it runs in holds the
+    arguments, and the variables defined in the body.
+    :param params: list of symbols
+    :param body:   ast
+    :param scope:  Scope where the function is defined, or None
+    :return:       Code
+    """
+    function_scope = Scope(list(params) + definitions(body), scope)
+    code = Code(function_scope.names, params, body)
+    param_slots = [function_scope.names.index(param) for param in params]
+
+    if param_slots != list(range(len(function_scope.names)))[:len(params)]:
+        code.param_slots = param_slots
+
+    emit_expression(code, body, function_scope, True)
+    code.emit(RETURN)
+    return code
+
+
+def emit_expression(code, ast, scope, tail_position):
+    """
+    Append the instructions evaluating ast, and leaving its value on the stack, to code.
+    :param code:          Code
+    :param ast:           list or atom
+    :param scope:         Scope of the current frame, or None at the top level
+    :param tail_position: True if ast is in tail position of a function body
+    """
+    start = code.label()
+
+    try:
+        exptype = expression_type(ast)
+
+        if exptype == "symbol":
+            return emit_symbol(code, ast, scope)
+
+        if exptype != "list":
+            return code.emit(CONST, code.constant(ast))
+
+        if len(ast) == 0:
+            raise LispError('Calling statement without arguments is not allowed.')
+
+        form = ast[0]
+
+        if is_symbol(form) and form in EMITTERS:
+            return EMITTERS[form](code, ast, scope, tail_position)
+
+        return emit_call(code, ast, scope, tail_position)
+
+    except LispError as e:
+        del code.instructions[start:]
+        code.emit(RAISE, code.constant(e))
+
+
+def emit_symbol(code, symbol, scope):
+    address = scope.resolve(symbol) if scope is not None else None
+
+    if address is None:
+        depth = scope.depth if scope is not None else 0
+        code.emit(LOAD_GLOBAL, code.constant((symbol, depth, [(None, None, None)])))
+
+    elif address[0] == 0:
+        code.emit(LOAD_LOCAL, address[1])
+
+    else:
+        code.emit(LOAD_OUTER, code.constant((address[0], address[1], symbol)))
+
+
+def emit_quote(code, ast, scope, tail_position):
+    code.emit(CONST, code.constant(ConsList.from_python(ast[1])))
+
+
+def emit_unary(opcode):
+    """
+    Produce an emitter for a one argument form compiled into a single instruction.
+    """
+    def emit_form(code, ast, scope, tail_position):
+        check_arguments(ast, 1)
+        emit_expression(code, ast[1], scope, False)
+        code.emit(opcode)
+
+    return emit_form
+
+
+def emit_binary(opcode):
+    """
+    Produce an emitter for a two argument form compiled into a single instruction.
+    """
+    def emit_form(code, ast, scope, tail_position):
+        check_arguments(ast, 2)
+        emit_expression(code, ast[1], scope, False)
+        emit_expression(code, ast[2], scope, False)
+        code.emit(opcode)
+
+    return emit_form
+
+
+def emit_math(code, ast, scope, tail_position):
+    name = ast[0]
+    function, min_operands = MATH_OPERATORS[name]
+    count = len(ast) - 1
+
+    if count < min_operands:
+        raise LispError("Wrong number of arguments. {} expects at least {} of them and received {}.".format(
+            name, min_operands, count))
+
+    for exp in ast[1:]:
+        emit_expression(code, exp, scope, False)
+
+    if count == 2:
+        code.emit(BINARY, code.constant((name, function)))
+    else:
+        code.emit(MATH, code.constant((name, count)))
+
+
+def emit_if(code, ast, scope, tail_position):
+    check_arguments(ast, 3)
+    emit_expression(code, ast[1], scope, False)
+    to_alternative = code.emit(JUMP_IF_FALSE)
+    emit_expression(code, ast[2], scope, tail_position)
+    to_end = code.emit(JUMP)
+    code.patch(to_alternative, code.label())
+    emit_expression(code, ast[3], scope, tail_position)
+    code.patch(to_end, code.label())
+
+
+def emit_cond(code, ast, scope, tail_position):
+    check_clauses(ast)
+
+    to_end = []
+    for predicate, expression in ast[1]:
+        emit_expression(code, predicate, scope, False)
+        to_next = code.emit(JUMP_IF_FALSE)
+        emit_expression(code, expression, scope, tail_position)
+        to_end.append(code.emit(JUMP))
+        code.patch(to_next, code.label())
+
+    code.emit(CONST, code.constant(False))
+
+    for position in to_end:
+        code.patch(position, code.label())
+
+
+def emit_definition(code, name, scope):
+    if scope is None:
+        code.emit(DEFINE_GLOBAL, code.constant(name))
+    else:
+        code.emit(DEFINE_LOCAL, scope.names.index(name))
+
+
+def emit_define(code, ast, scope, tail_position):
+    if len(ast) != 3:
+        raise LispError('Wrong number of arguments. You must pass 2 of them (the variable name and its value).')
+
+    if not is_symbol(ast[1]):
+        raise LispError('The name of the variable is not a symbol.')
+
+    emit_expression(code, ast[2], scope, False)
+    emit_definition(code, ast[1], scope)
+
+
+def emit_defn(code, ast, scope, tail_position):
+    if not is_symbol(ast[1]):
+        raise LispError('The name of the function is not a symbol.')
+
+    emit_lambda(code, ast[1:], scope, False)
+    emit_definition(code, ast[1], scope)
+
+
+def emit_defmemo(code, ast, scope, tail_position):
+    emit_expression(code, expand_defmemo(ast), scope, tail_position)
+
+
+def emit_builtin_form(builtin):
+    """
+    Produce an emitter for a form calling builtin with its evaluated arguments.
+    """
+    def emit_form(code, ast, scope, tail_position):
+        code.emit(CONST, code.constant(builtin))
+        for exp in ast[1:]:
+            emit_expression(code, exp, scope, False)
+
+        code.emit(CALL, len(ast) - 1)
+
+    return emit_form
+
+
+def emit_lambda(code, ast, scope, tail_position):
+    if len(ast) != 3:
+        raise LispError("A lambda expression requires 3 arguments and received {}".format(len(ast)))
+
+    if not is_list(ast[1]):
+        raise LispError("Parameters should be a list, and you gave {}".format(ast[1]))
+
+    code.emit(MAKE_CLOSURE, code.constant(compile_function(ast[1], ast[2], scope)))
+
+
+def emit_let(code, ast, scope, tail_position):
+    check_bindings(ast)
+
+    if not shares_frame(ast[1], ast[2]):
+        emit_let_frames(code, ast[1], ast[2], scope, tail_position)
+        return
+
+    keys = [key for key, val in ast[1]]
+    let_scope = Scope(keys + definitions(ast[2]), scope)
+
+    code.emit(ENTER_LET, code.constant(let_scope.names))
+    for key, val in ast[1]:
+        emit_expression(code, val, let_scope, False)
+        code.emit(STORE_LOCAL, let_scope.names.index(key))
+
+    emit_expression(code, ast[2], let_scope, tail_position)
+    code.emit(LEAVE_LET)
+
+
+def emit_let_frames(code, bindings, body, scope, tail_position):
+    """
+    Emit a let with a frame for each binding, as `eval_let` extends the environment once
+    per binding. Each value is pushed before entering the frame it is stored in.
+    """
+    frames = 0
+    first = definitions(bindings[0][1])
+
+    if first:
+        scope = Scope(first, scope)
+        code.emit(ENTER_LET, code.constant(scope.names))
+        frames += 1
+
+    for n, (key, val) in enumerate(bindings):
+        emit_expression(code, val, scope, False)
+        scope = Scope([key] + definitions(bindings[n + 1][1] if n + 1 < len(bindings) else body), scope)
+        code.emit(ENTER_LET, code.constant(scope.names))
+        code.emit(STORE_LOCAL, 0)
+        frames += 1
+
+    emit_expression(code, body, scope, tail_position)
+
+    for _ in range(frames):
+        code.emit(LEAVE_LET)
+
+
+def emit_builtin(code, ast, scope, tail_position):
+    from .builtins import BUILTINS
+
+    if len(ast) != 3 or not is_symbol(ast[1]):
+        raise LispError('A builtin expression requires a name and a fallback expression.')
+
+    if ast[1] in BUILTINS:
+        code.emit(CONST, code.constant(BUILTINS[ast[1]]))
+    else:
+        emit_expression(code, ast[2], scope, tail_position)
+
+
+def emit_call(code, ast, scope, tail_position):
+    for exp in ast:
+        emit_expression(code, exp, scope, False)
+
+    code.emit(TAIL_CALL if tail_position else CALL, len(ast) - 1)
+
+
+EMITTERS = {
+    "quote": emit_quote,
+    "atom": emit_unary(ATOM),
+    "eq": emit_binary(EQ),
+    "if": emit_if,
+    "cond": emit_cond,
+    "define": emit_define,
+    "defn": emit_defn,
+    "lambda": emit_lambda,
+    "let": emit_let,
+    "defmemo": emit_defmemo,
+    "builtin": emit_builtin,
+    "cons": emit_binary(CONS),
+    "empty": emit_unary(EMPTY),
+    "head": emit_unary(HEAD),
+    "tail": emit_unary(TAIL),
+}
+
+EMITTERS.update(dict.fromkeys(MATH_OPERATORS, emit_math))
+EMITTERS.update((form, emit_builtin_form(builtin)) for form, builtin in MEMO_FORMS.items())
+EMITTERS = intern_keys(EMITTERS)
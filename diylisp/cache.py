@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+import sys
+import tempfile
+from os.path import basename, dirname, isdir, join
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from .parser import PARSER_VERSION, parse_stream
+
+"""
+The AST cache saves parsing a lisp file again when it has not changed, much
+like Python's `.pyc` files. The ASTs of a file are written to a `.diyc` file
+in the `__diycache__` directory next to it as it is parsed, and later read
+from there instead.
+
+A cache file starts with a header of PARSER_VERSION and the size, modification
+time and hash of the source, followed by the ASTs in lists of up to BATCH_SIZE,
+pickled one list at a time. Only a list at a time needs to be in memory, and
+the names of the symbols in it are written once. The cache is used when the parser version
+and size match, and either the modification time or the hash does. Anything
+else, including a cache file that can not be read, means parsing the source
+again and writing a new cache file.
+"""
+
+CACHE_DIRECTORY = "__diycache__"
+
+BATCH_SIZE = 64
+
+# The size of the pieces a source file is read in to hash it.
+CHUNK_SIZE = 64 * 1024
+
+
+def parse_file(filename):
+    """
+    Read the ASTs of a lisp file, yielding each one as it is read, like `parse_stream`.
+    They come from the cache file when it is valid, and otherwise from parsing the
+    file, while writing a new cache file.
+    """
+    path = cache_path(filename)
+    stat = os.stat(filename)
+    cached = open_cache(path, filename, stat)
+
+    if cached is not None:
+        with cached:
+            for ast in read_asts(cached):
+                yield ast
+
+        return
+
+    header = (PARSER_VERSION, stat.st_size, stat.st_mtime, digest(filename))
+
+    with open(filename, 'r') as sourcefile:
+        for ast in write_cache(path, header, parse_stream(sourcefile), stat.st_mode & 0o666):
+            yield ast
+
+
+def cache_path(filename):
+    """
+    The path of the cache file of a lisp file.
+    E.g.: "lib/stdlib.diy" -> "lib/__diycache__/stdlib.diy.py27.diyc"
+    """
+    tag = "py%d%d" % sys.version_info[:2]
+    return join(dirname(filename), CACHE_DIRECTORY, "%s.%s.diyc" % (basename(filename), tag))
+
+
+def digest(filename):
+    """The SHA-1 hash of a file, read a chunk at a time, so that it takes constant memory."""
+    sha1 = hashlib.sha1()
+
+    with open(filename, 'rb') as sourcefile:
+        for chunk in iter(lambda: sourcefile.read(CHUNK_SIZE), b''):
+            sha1.update(chunk)
+
+    return sha1.hexdigest()
+
+
+def open_cache(path, filename, stat):
+    """
+    Open the cache file at path, if it is valid for the file filename with the given stat.
+    :return: the cache file, positioned at the first AST, or None
+    """
+    try:
+        cached = open(path, 'rb')
+    except (IOError, OSError):
+        return None
+
+    try:
+        version, size, mtime, source_digest = pickle.load(cached)
+
+        if version == PARSER_VERSION and size == stat.st_size and (
+                mtime == stat.st_mtime or source_digest == digest(filename)):
+            return cached
+
+    except Exception:
+        # A broken cache file. It is only a cache, so start over.
+        pass
+
+    cached.close()
+    return None
+
+
+def read_asts(cached):
+    while True:
+        try:
+            batch = pickle.load(cached)
+        except EOFError:
+            return
+
+        for ast in batch:
+            yield ast
+
+
+def write_cache(path, header, asts, mode=0o644):
+    """
+    Yield the ASTs from asts, and write them to the cache file at path as they pass,
+    after the header. The file is written under a temporary name, and only renamed
+    once all of asts have been read, so a source that does not parse, or is not read
+    to the end, leaves no cache file behind. Like a `.pyc` file, it gets the
+    permissions of its source, given in mode.
+    """
+    directory = dirname(path)
+    cached = temporary = None
+
+    try:
+        if not isdir(directory):
+            os.makedirs(directory)
+
+        handle, temporary = tempfile.mkstemp(dir=directory)
+        cached = os.fdopen(handle, 'wb')
+        os.chmod(temporary, mode)
+        pickle.dump(header, cached, pickle.HIGHEST_PROTOCOL)
+
+    except Exception:
+        # Not being able to write the cache only makes the next run slower.
+        if cached is not None:
+            cached.close()
+            cached = None
+
+    batch = []
+
+    try:
+        for ast in asts:
+            batch.append(ast)
+
+            if len(batch) == BATCH_SIZE:
+                cached = write_batch(cached, batch)
+                batch = []
+
+            yield ast
+
+        cached = write_batch(cached, batch)
+
+        if cached is not None:
+            try:
+                cached.close()
+                os.rename(temporary, path)
+            except Exception:
+                pass
+
+    finally:
+        if cached is not None and not cached.closed:
+            cached.close()
+
+        if temporary is not None and os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def write_batch(cached, batch):
+    """
+    Write a list of ASTs to the open cache file cached, unless it is None.
+    :return: cached, or None if writing failed, and the cache file was closed
+    """
+    if cached is None or not batch:
+        return cached
+
+    try:
+        pickle.dump(batch, cached, pickle.HIGHEST_PROTOCOL)
+        return cached
+
+    except Exception:
+        cached.close()
+        return None
@@ -0,0 +1,776 @@
+# -*- coding: utf-8 -*-
+
+from .types import LispError, Builtin, Closure, ConsList, Environment, Frame, intern_keys
+from .ast import is_atom, is_symbol, is_list, is_closure, is_builtin
+from .parser import unparse
+from .memo import MEMO_FORMS, MISSING, expand_defmemo, memo_key
+from .evaluator import expression_type, eq, math_operation, named, apply_builtin, cons, empty, head, tail, \
+    check_arguments, check_bindings, check_clauses, MATH_OPERATORS, NUMBER_TYPES
+
+"""
+This is the Compiler module. Where `evaluate` inspects an AST every time it is
+evaluated, `compile_ast` looks at it only once, and turns it into a tree of
+Python closures. Each closure takes an Environment and returns the value of
+the expression it was compiled from.
+
+Special forms are resolved, arities checked and constants lifted at compile
+time. Calls in tail position do not call the closure themselves, but return a
+TailCall for `call_closure` to make, so tail recursion runs in constant Python
+stack depth. Errors found while compiling are not raised straight away, but when (and
+if) the offending expression is evaluated, just like `evaluate` would do.
+
+Variables are resolved at compile time too. Function calls and `let` forms get a
+Frame, where each local variable has a fixed slot. A Scope mirrors the chain of
+frames during compilation, so a local variable is compiled into a (depth, slot)
+address, and only global variables are looked up by name.
+"""
+
+# The active Profiler, if any. Set by `Profiler.__enter__`, see `profiler.py`.
+profiler = None
+
+
+class Scope(object):
+    """
+    The compile time view of a Frame: the names of its slots, and the enclosing Scope.
+    """
+    __slots__ = ('names', 'parent', 'depth')
+
+    def __init__(self, names, parent):
+        self.names = tuple(unique(names))
+        self.parent = parent
+        self.depth = parent.depth + 1 if parent is not None else 1
+
+    def resolve(self, symbol):
+        """
+        Find the frame depth and slot of a local variable.
+        :param symbol: string
+        :return:       tuple (depth, slot), or None for global variables
+        """
+        scope = self
+        depth = 0
+        while scope is not None:
+
+            if symbol in scope.names:
+                return depth, scope.names.index(symbol)
+
+            scope = scope.parent
+            depth += 1
+
+        return None
+
+
+def compile_ast(ast, scope=None, tail_position=False):
+    """
+    Compile ast (Abstract Syntax Tree) into a Python function.
+    E.g.: ["+", 1, 2] -> function(env) -> 3
+    :param ast:           list or atom
+    :param scope:         Scope of the innermost frame, or None at the top level
+    :param tail_position: True if ast is in tail position of a function body, in which
+                          case the compiled function may return a TailCall
+    :return:              function taking an Environment and returning the value of ast
+    """
+    try:
+        exptype = expression_type(ast)
+
+        if exptype == "symbol":
+            return compile_symbol(ast, scope)
+
+        if exptype != "list":
+            return compile_constant(ast)
+
+        if len(ast) == 0:
+            raise LispError('Calling statement without arguments is not allowed.')
+
+        form = ast[0]
+
+        if is_symbol(form) and form in SPECIAL_FORMS:
+            compiled = SPECIAL_FORMS[form](ast, scope, tail_position)
+            return compiled if profiler is None else profiler.counted(form, compiled)
+
+        return compile_call(ast, scope, tail_position)
+
+    except LispError as e:
+        return compile_error(e)
+
+
+def compile_error(error):
+    """
+    Produce a function raising error once it is evaluated.
+    :param error: LispError
+    :return:      function(env)
+    """
+    def raise_error(env):
+        raise error
+
+    return raise_error
+
+
+def compile_constant(value):
+    """
+    Produce a function always returning value.
+    :param value: any value
+    :return:      function(env)
+    """
+    return lambda env: value
+
+
+def compile_symbol(symbol, scope):
+    """
+    Produce a function looking up symbol. Local variables are read from their slot. If
+    the slot is not bound yet, or the variable is global, it is looked up by name.
+    :param symbol: string
+    :param scope:  Scope or None
+    :return:       function(env)
+    """
+    address = scope.resolve(symbol) if scope is not None else None
+
+    if address is None:
+        return compile_global(symbol, scope.depth if scope is not None else 0)
+
+    depth, slot = address
+
+    if depth == 0:
+        def lookup_local(env):
+            value = env.values[slot]
+            return value if value is not None else env.parent.lookup(symbol)
+
+        return lookup_local
+
+    if depth == 1:
+        def lookup_enclosing(env):
+            env = env.parent
+            value = env.values[slot]
+            return value if value is not None else env.parent.lookup(symbol)
+
+        return lookup_enclosing
+
+    def lookup_outer(env):
+        for _ in range(depth):
+            env = env.parent
+
+        value = env.values[slot]
+        return value if value is not None else env.parent.lookup(symbol)
+
+    return lookup_outer
+
+
+def compile_global(symbol, depth):
+    """
+    Produce a function looking up symbol by name, after skipping depth local frames.
+    """
+    if depth == 0:
+        return lambda env: env.lookup(symbol)
+
+    if depth == 1:
+        return lambda env: env.parent.lookup(symbol)
+
+    def lookup_global(env):
+        for _ in range(depth):
+            env = env.parent
+
+        return env.lookup(symbol)
+
+    return lookup_global
+
+
+def compile_cached_global(symbol, depth):
+    """
+    Like `compile_global`, but remembering the value found, for use at call sites. The
+    cached value is reused as long as the lookup starts in the same environment, and
+    no binding has been added anywhere since, as told by `Environment.version`.
+    """
+    cache = [(None, None, None)]
+
+    def lookup_cached(env):
+        for _ in range(depth):
+            env = env.parent
+
+        cached_env, version, value = cache[0]
+
+        if cached_env is env and version == Environment.version:
+            return value
+
+        version = Environment.version
+        value = env.lookup(symbol)
+        cache[0] = (env, version, value)
+        return value
+
+    return lookup_cached
+
+
+def compile_quote(ast, scope, tail_position):
+    """
+    ["quote", expr] -> function returning expr without evaluating it, with lists as ConsLists
+    """
+    return compile_constant(ConsList.from_python(ast[1]))
+
+
+def compile_atom(ast, scope, tail_position):
+    """
+    ["atom", expr] -> function returning True if expr evaluates to an atom
+    """
+    check_arguments(ast, 1)
+    expr = compile_ast(ast[1], scope)
+    return lambda env: is_atom(expr(env))
+
+
+def compile_eq(ast, scope, tail_position):
+    """
+    ["eq", expr1, expr2] -> function returning True if both expressions evaluate to the same atom
+    """
+    check_arguments(ast, 2)
+    expr1 = compile_ast(ast[1], scope)
+    expr2 = compile_ast(ast[2], scope)
+    return lambda env: eq(expr1(env), expr2(env))
+
+
+def compile_math(ast, scope, tail_position):
+    """
+    [math operator, expr1, ..., exprN] -> function returning the result of the operation
+
+    The common case of two operands gets its own function, calling the operator straight
+    from the MATH_OPERATORS table.
+    """
+    name = ast[0]
+    function, min_operands = MATH_OPERATORS[name]
+    operands = [compile_ast(exp, scope) for exp in ast[1:]]
+
+    if len(operands) < min_operands:
+        raise LispError("Wrong number of arguments. {} expects at least {} of them and received {}.".format(
+            name, min_operands, len(operands)))
+
+    if len(operands) != 2:
+        return lambda env: math_operation(name, [operand(env) for operand in operands])
+
+    expr1, expr2 = operands
+
+    def run_binary(env):
+        l_operand = expr1(env)
+        r_operand = expr2(env)
+
+        if type(l_operand) in NUMBER_TYPES and type(r_operand) in NUMBER_TYPES:
+            return function(l_operand, r_operand)
+
+        return math_operation(name, [l_operand, r_operand])
+
+    return run_binary
+
+
+def compile_if(ast, scope, tail_position):
+    """
+    ["if", condition, true expr, false expr] -> function evaluating only one of the branches
+    """
+    check_arguments(ast, 3)
+    condition = compile_ast(ast[1], scope)
+    consequence = compile_ast(ast[2], scope, tail_position)
+    alternative = compile_ast(ast[3], scope, tail_position)
+
+    def run_if(env):
+        return consequence(env) if condition(env) else alternative(env)
+
+    return run_if
+
+
+def compile_cond(ast, scope, tail_position):
+    """
+    ["cond", [[predicate, expr], ...]] -> function evaluating the expr of the first true predicate
+    """
+    check_clauses(ast)
+    clauses = list()
+
+    for cond_exp in ast[1]:
+        clauses.append((compile_ast(cond_exp[0], scope), compile_ast(cond_exp[1], scope, tail_position)))
+
+    def run_cond(env):
+        for predicate, expression in clauses:
+
+            if predicate(env):
+                return expression(env)
+
+        return False
+
+    return run_cond
+
+
+def compile_definition(name, value, scope):
+    """
+    Produce a function binding name to the result of the compiled function value. At
+    the top level the binding goes into the environment, otherwise into the slot the
+    name was given in the innermost frame.
+    """
+    if scope is None:
+        def define_global(env):
+            env.set(name, named(value(env), name))
+            return name
+
+        return define_global
+
+    slot = scope.names.index(name)
+
+    def define_local(env):
+        env.define_slot(slot, named(value(env), name))
+        return name
+
+    return define_local
+
+
+def compile_define(ast, scope, tail_position):
+    """
+    ["define", symbol, expr] -> function binding symbol to the value of expr
+    """
+    if len(ast) != 3:
+        raise LispError('Wrong number of arguments. You must pass 2 of them (the variable name and its value).')
+
+    name = ast[1]
+
+    if not is_symbol(name):
+        raise LispError('The name of the variable is not a symbol.')
+
+    return compile_definition(name, compile_ast(ast[2], scope), scope)
+
+
+def compile_defn(ast, scope, tail_position):
+    """
+    ["defn", symbol, [params], body] -> function binding symbol to a new Closure
+    """
+    name = ast[1]
+
+    if not is_symbol(name):
+        raise LispError('The name of the function is not a symbol.')
+
+    return compile_definition(name, compile_lambda(ast[1:], scope, False), scope)
+
+
+def compile_lambda(ast, scope, tail_position):
+    """
+    ["lambda", [params], body] -> function producing a Closure with a precompiled body
+    """
+    if len(ast) != 3:
+        raise LispError("A lambda expression requires 3 arguments and received {}".format(len(ast)))
+
+    if not is_list(ast[1]):
+        raise LispError("Parameters should be a list, and you gave {}".format(ast[1]))
+
+    params = ast[1]
+    body = ast[2]
+    code = compile_function(params, body, scope)
+
+    def run_lambda(env):
+        closure = Closure(env, params, body)
+        closure.code = code
+        return closure
+
+    return run_lambda
+
+
+def compile_function(params, body, scope):
+    """
+    Compile the body of a function. The result takes the environment of the closure
+    and the list of arguments, and runs the body in a new Frame holding the arguments
+    and the variables defined in the body.
+    :param params: list of symbols
+    :param body:   ast
+    :param scope:  Scope where the function is defined, or None
+    :return:       function(env, args)
+    """
+    function_scope = Scope(list(params) + definitions(body), scope)
+    names = function_scope.names
+    size = len(names)
+    run_body = compile_ast(body, function_scope, True)
+    param_slots = [names.index(param) for param in params]
+
+    if param_slots == list(range(size)):
+        return lambda env, args: run_body(Frame(names, args, env))
+
+    def enter(env, args):
+        values = [None] * size
+        for slot, arg in zip(param_slots, args):
+            values[slot] = arg
+
+        return run_body(Frame(names, values, env))
+
+    return enter
+
+
+def compile_let(ast, scope, tail_position):
+    """
+    ["let", [[symbol, expr], ...], body] -> function evaluating body with the local bindings
+    """
+    check_bindings(ast)
+
+    if not shares_frame(ast[1], ast[2]):
+        return compile_let_frames(ast[1], ast[2], scope, tail_position)
+
+    keys = [key for key, val in ast[1]]
+    let_scope = Scope(keys + definitions(ast[2]), scope)
+    names = let_scope.names
+    size = len(names)
+    bindings = [(names.index(key), compile_ast(val, let_scope)) for key, val in ast[1]]
+    body = compile_ast(ast[2], let_scope, tail_position)
+
+    def run_let(env):
+        let_env = Frame(names, [None] * size, env)
+        values = let_env.values
+        for slot, val in bindings:
+            values[slot] = val(let_env)
+
+        return body(let_env)
+
+    return run_let
+
+
+def compile_let_frames(bindings, body, scope, tail_position):
+    """
+    Compile a let with a frame for each binding, as `eval_let` extends the environment
+    once per binding. The first value gets a frame of its own only if it defines names.
+    """
+    first = definitions(bindings[0][1])
+
+    if not first:
+        return compile_bindings(bindings, body, scope, tail_position)
+
+    first_scope = Scope(first, scope)
+    names = first_scope.names
+    size = len(names)
+    run = compile_bindings(bindings, body, first_scope, tail_position)
+
+    def run_let_frames(env):
+        return run(Frame(names, [None] * size, env))
+
+    return run_let_frames
+
+
+def compile_bindings(bindings, body, scope, tail_position):
+    """
+    Produce a function evaluating the first of bindings, and the rest of the let in a
+    new frame holding it along with the names the next value, or the body, defines.
+    """
+    if not bindings:
+        return compile_ast(body, scope, tail_position)
+
+    (key, val), rest = bindings[0], bindings[1:]
+    value = compile_ast(val, scope)
+    next_scope = Scope([key] + definitions(rest[0][1] if rest else body), scope)
+    names = next_scope.names
+    size = len(names)
+    run_rest = compile_bindings(rest, body, next_scope, tail_position)
+
+    def run_binding(env):
+        values = [None] * size
+        values[0] = value(env)
+        return run_rest(Frame(names, values, env))
+
+    return run_binding
+
+
+def compile_builtin(ast, scope, tail_position):
+    """
+    ["builtin", symbol, fallback] -> function returning the builtin named symbol, or the
+    value of fallback if there is no such builtin
+    """
+    from .builtins import BUILTINS
+
+    if len(ast) != 3 or not is_symbol(ast[1]):
+        raise LispError('A builtin expression requires a name and a fallback expression.')
+
+    if ast[1] in BUILTINS:
+        return compile_constant(BUILTINS[ast[1]])
+
+    return compile_ast(ast[2], scope, tail_position)
+
+
+def compile_defmemo(ast, scope, tail_position):
+    """
+    ["defmemo", symbol, [params], body] -> function binding symbol to a new memoized Closure
+    """
+    return compile_ast(expand_defmemo(ast), scope, tail_position)
+
+
+def compile_builtin_form(builtin):
+    """
+    Produce a compiler for a form calling builtin with its evaluated arguments, such as
+    `memoize`.
+    :param builtin: Builtin
+    :return:        function(ast, scope, tail_position)
+    """
+    def compile_form(ast, scope, tail_position):
+        arguments = [compile_ast(arg, scope) for arg in ast[1:]]
+        return lambda env: apply_builtin(builtin, [argument(env) for argument in arguments])
+
+    return compile_form
+
+
+def compile_cons(ast, scope, tail_position):
+    """
+    ["cons", item, container] -> function prepending item to container
+    """
+    check_arguments(ast, 2)
+    item = compile_ast(ast[1], scope)
+    container = compile_ast(ast[2], scope)
+    return lambda env: cons(item(env), container(env))
+
+
+def compile_list_operation(operation):
+    """
+    Produce a compiler for a one argument list form, such as `head`, `tail` or `empty`.
+    :param operation: function applied to the evaluated argument
+    :return:          function(ast, scope, tail_position)
+    """
+    def compile_operation(ast, scope, tail_position):
+        check_arguments(ast, 1)
+        lst = compile_ast(ast[1], scope)
+        return lambda env: operation(lst(env))
+
+    return compile_operation
+
+
+def compile_call(ast, scope, tail_position):
+    """
+    [expr, arg1, ..., argN] -> function calling the closure expr evaluates to
+    """
+    if is_symbol(ast[0]) and (scope is None or scope.resolve(ast[0]) is None):
+        function = compile_cached_global(ast[0], scope.depth if scope is not None else 0)
+    else:
+        function = compile_ast(ast[0], scope)
+
+    arguments = [compile_ast(arg, scope) for arg in ast[1:]]
+    count = len(arguments)
+
+    def run_call(env):
+        closure = function(env)
+
+        if type(closure) is Builtin:
+            if profiler is not None:
+                return call_builtin_profiled(closure, [argument(env) for argument in arguments])
+
+            return apply_builtin(closure, [argument(env) for argument in arguments])
+
+        if not is_closure(closure):
+            if is_builtin(closure):
+                return apply_builtin(closure, [argument(env) for argument in arguments])
+
+            raise LispError('Not a function {}.'.format(closure))
+
+        if count != len(closure.params):
+            raise LispError('wrong number of arguments, expected %d got %d' % (len(closure.params), count))
+
+        args = [argument(env) for argument in arguments]
+
+        if tail_position:
+            return TailCall(closure, args)
+
+        return call_closure(closure, args)
+
+    return run_call
+
+
+class TailCall(object):
+    """
+    A call in tail position, returned by the compiled function body instead of being made
+    there. `call_closure` makes the call once the body has returned.
+    """
+    __slots__ = ('closure', 'args')
+
+    def __init__(self, closure, args):
+        self.closure = closure
+        self.args = args
+
+
+def call_closure(closure, args):
+    """
+    Call closure with a list of already evaluated arguments, looping for as long as the
+    body returns tail calls. Closures created by `evaluate` get their body compiled the
+    first time they are called.
+    :param closure: Closure
+    :param args:    list of values
+    :return:        the result of the function's body execution
+    """
+    if profiler is not None:
+        return call_closure_profiled(closure, args)
+
+    while True:
+        if closure.memo is not None:
+            return call_memoized(closure, args)
+
+        code = closure.code
+
+        if code is None:
+            code = closure.code = compile_function(closure.params, closure.body, None)
+
+        result = code(closure.env, args)
+
+        if type(result) is not TailCall:
+            return result
+
+        closure, args = result.closure, result.args
+
+
+def call_memoized(closure, args):
+    """
+    Call a memoized closure, looking the result up in its memo cache first. The body is
+    only run if the result is not there, and calls it makes in tail position are made
+    here, so that the result can be stored.
+    """
+    key = memo_key(args)
+    value = closure.memo.get(key)
+
+    if value is MISSING:
+        code = closure.code
+
+        if code is None:
+            code = closure.code = compile_function(closure.params, closure.body, None)
+
+        value = code(closure.env, args)
+
+        if type(value) is TailCall:
+            value = call_closure(value.closure, value.args)
+
+        closure.memo.put(key, value)
+
+    return value
+
+
+def call_closure_profiled(closure, args):
+    """
+    Like `call_closure`, but telling the profiler when each call starts and ends. A tail
+    call ends the call making it.
+    """
+    active = profiler
+
+    while True:
+        code = closure.code
+
+        if code is None:
+            code = closure.code = compile_function(closure.params, closure.body, None)
+
+        active.enter(closure.name or "<lambda>")
+        try:
+            if closure.memo is not None:
+                return call_memoized(closure, args)
+
+            result = code(closure.env, args)
+        finally:
+            active.exit()
+
+        if type(result) is not TailCall:
+            return result
+
+        closure, args = result.closure, result.args
+
+
+def call_builtin_profiled(builtin, args):
+    active = profiler
+    active.enter(builtin.name)
+    try:
+        return apply_builtin(builtin, args)
+    finally:
+        active.exit()
+
+
+def call_procedure(procedure, args):
+    """
+    Call a closure or a builtin with a list of already evaluated arguments. This is how
+    builtins call the functions they are given as arguments.
+    :param procedure: Closure or Builtin
+    :param args:      list of values
+    :return:          the result of the call
+    """
+    if is_builtin(procedure):
+        return apply_builtin(procedure, args)
+
+    if not is_closure(procedure):
+        raise LispError('Not a function {}.'.format(unparse(procedure)))
+
+    if len(args) != len(procedure.params):
+        raise LispError('wrong number of arguments, expected %d got %d' % (len(procedure.params), len(args)))
+
+    return call_closure(procedure, args)
+
+
+def definitions(ast):
+    """
+    Find the names defined by `define`, `defn` and `defmemo` forms in ast, which end up in the
+    frame ast is evaluated in. Forms with frames of their own, like `lambda` and `let`,
+    and quoted data are not searched.
+    E.g.: ["if", "x", ["define", "y", 1], ["defn", "f", [], 2]] -> ["y", "f"]
+    :param ast: list or atom
+    :return:    list of symbols
+    """
+    if not is_list(ast) or len(ast) == 0:
+        return []
+
+    form = ast[0]
+
+    if form in ("quote", "lambda", "let"):
+        return []
+
+    names = []
+
+    if form in ("define", "defn", "defmemo") and len(ast) > 1 and is_symbol(ast[1]):
+        names.append(ast[1])
+
+        if form in ("defn", "defmemo"):
+            return names
+
+    for exp in ast:
+        names += definitions(exp)
+
+    return names
+
+
+def shares_frame(bindings, body):
+    """
+    Tell if the bindings of a let can go into a single frame, since nothing could tell
+    it apart from the frame per binding of `eval_let`: no value makes a closure, which
+    would see the later bindings, or defines a name, and the body defines none of the
+    keys but the last one.
+    :param bindings: list of [symbol, expr] pairs
+    :param body:     list or atom
+    :return:         bool
+    """
+    if any(makes_closure(val) or definitions(val) for key, val in bindings):
+        return False
+
+    keys = [key for key, val in bindings]
+    return not set(definitions(body)) & set(keys[:-1])
+
+
+def makes_closure(ast):
+    """
+    Tell if ast may make a closure, keeping the environment it is evaluated in.
+    """
+    if not is_list(ast):
+        return False
+
+    return any(exp in ("lambda", "defn", "defmemo") or makes_closure(exp) for exp in ast)
+
+
+def unique(names):
+    """
+    Remove duplicates from a list, keeping the first occurrence of each element.
+    """
+    seen = set()
+    return [name for name in names if not (name in seen or seen.add(name))]
+
+
+SPECIAL_FORMS = {
+    "quote": compile_quote,
+    "atom": compile_atom,
+    "eq": compile_eq,
+    "if": compile_if,
+    "cond": compile_cond,
+    "define": compile_define,
+    "defn": compile_defn,
+    "lambda": compile_lambda,
+    "let": compile_let,
+    "defmemo": compile_defmemo,
+    "builtin": compile_builtin,
+    "cons": compile_cons,
+    "empty": compile_list_operation(empty),
+    "head": compile_list_operation(head),
+    "tail": compile_list_operation(tail),
+}
+
+SPECIAL_FORMS.update(dict.fromkeys(MATH_OPERATORS, compile_math))
+SPECIAL_FORMS.update((form, compile_builtin_form(builtin)) for form, builtin in MEMO_FORMS.items())
+SPECIAL_FORMS = intern_keys(SPECIAL_FORMS)
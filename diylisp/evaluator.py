@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
 
-from .types import Environment, LispError, Closure, String
-from .ast import is_boolean, is_atom, is_symbol, is_list, is_closure, is_integer, is_string
+import operator
+
+from .types import Environment, LispError, Closure, ConsList, String, Symbol, intern_keys
+from .ast import is_boolean, is_atom, is_symbol, is_list, is_cons_list, is_closure, is_builtin, is_integer, \
+    is_string
 from .parser import unparse
+from .memo import MEMO_FORMS, MISSING, expand_defmemo, memo_key
 
 """
 This is the Evaluator module. The `evaluate` function below is the heart
@@ -17,80 +21,68 @@ in a day, after all.)
 def evaluate(ast, env):
     """
     Evaluate ast (Abstract Syntax Tree) in the Environment provided by env.
+
+    Expressions in tail position (the branches of `if` and `cond`, the body of a
+    `let` and the body of a called closure) are not evaluated recursively. Instead
+    `evaluate` loops with the new expression and environment, so tail recursive
+    Lisp functions run in constant Python stack depth.
     :param ast: list or atom
     :param env: AST Environment
     :return:    the result of the evaluation
     """
 
-    exptype = expression_type(ast)
-
-    if exptype == "list":
-
-        form = ast[0]
-
-        if len(ast) == 0:
-            raise LispError('Calling statement without arguments is not allowed.')
-
-        if is_closure(form):
-            return eval_closure(ast, env)
-
-        if form == "quote":
-            return eval_quote(ast)
-
-        if form == "atom":
-            return eval_atom(ast, env)
+    while True:
 
-        if form == "eq":
-            return eval_eq(ast, env)
+        # Variables are the most common atoms. Parsed ones are told apart by type alone.
+        if type(ast) is Symbol:
+            return env.lookup(ast)
 
-        if form == "if":
-            return eval_if(ast, env)
+        exptype = expression_type(ast)
 
-        if form == "cond":
-            return eval_cond(ast, env)
+        if exptype != "list":
 
-        if form == "define":
-            return eval_define(ast, env)
+            if exptype == "number" or exptype == "boolean" or exptype == "string":
+                return ast
 
-        if form == "defn":
-            return eval_defn(ast, env)
+            else:
+                return env.lookup(ast)
 
-        if form == "lambda":
-            return eval_lambda(ast, env)
+        if len(ast) == 0:
+            raise LispError('Calling statement without arguments is not allowed.')
 
-        if form == "let":
-            return eval_let(ast, env)
+        form = ast[0]
 
-        if form == "cons":
-            return eval_cons(ast, env)
+        if is_closure(form):
+            if form.memo is not None:
+                return eval_memoized(form, ast, env)
 
-        if form == "empty":
-            return eval_empty(ast, env)
+            ast, env = eval_closure(form, ast, env)
+            continue
 
-        if form == "head":
-            return eval_head(ast, env)
+        if is_symbol(form):
+            special_form = SPECIAL_FORMS.get(form)
 
-        if form == "tail":
-            return eval_tail(ast, env)
+            if special_form is not None:
+                return special_form(ast, env)
 
-        if type(form) is str and form in ["+", "-", "/", "*", "mod", ">", "<", "<=", ">="]:
-            return eval_math(ast, env)
+            tail_form = TAIL_FORMS.get(form)
 
-        symbol = evaluate(ast[0], env)
+            if tail_form is not None:
+                ast, env = tail_form(ast, env)
+                continue
 
-        if is_closure(symbol):
-            ast[0] = symbol
-            return evaluate(ast, env)
+        closure = evaluate(form, env)
 
-        raise LispError('Not a function {}.'.format(symbol))
+        if is_builtin(closure):
+            return apply_builtin(closure, [evaluate(arg, env) for arg in ast[1:]])
 
-    else:
+        if not is_closure(closure):
+            raise LispError('Not a function {}.'.format(closure))
 
-        if exptype == "number" or exptype == "boolean" or exptype == "string":
-            return ast
+        if closure.memo is not None:
+            return eval_memoized(closure, ast, env)
 
-        else:
-            return env.lookup(ast)
+        ast, env = eval_closure(closure, ast, env)
 
 
 def expression_type(exp):
@@ -109,7 +101,7 @@ def expression_type(exp):
         if is_boolean(exp):
             return "boolean"
 
-        if is_closure(exp):
+        if is_closure(exp) or is_builtin(exp):
             return "closure"
 
         if is_symbol(exp):
@@ -143,9 +135,7 @@ def eval_eq(ast, env):
     :param env: AST Environment
     :return:    bool
     """
-    expr1 = evaluate(ast[1], env)
-    expr2 = evaluate(ast[2], env)
-    return False if is_list(expr1) or is_list(expr2) else expr1 == expr2
+    return eq(evaluate(ast[1], env), evaluate(ast[2], env))
 
 
 def eval_define(ast, env):
@@ -162,7 +152,7 @@ def eval_define(ast, env):
     name = ast[1]
 
     if is_symbol(name):
-        value = evaluate(ast[2], env)
+        value = named(evaluate(ast[2], env), name)
         env.set(name, value)
         return name
 
@@ -180,7 +170,7 @@ def eval_defn(ast, env):
     :return:    the name of the function
     """
     fname = ast[1]
-    closure = eval_lambda(ast[1:], env)
+    closure = named(eval_lambda(ast[1:], env), fname)
     env.set(fname, closure)
     return fname
 
@@ -208,53 +198,116 @@ def eval_let(ast, env):
     Consume a list with 3 elements. The first one is the string "let" and the rest must be lists. The
     first list contains the local binding definitions, and the second list the expression with access to
     those bindings.
-    E.g.: ["let", [["a", ["+", 100, 20]]], ["+", "a", 5]] -> 125
+    The expression is in tail position, so it is returned together with the extended
+    environment instead of being evaluated here.
+    E.g.: ["let", [["a", ["+", 100, 20]]], ["+", "a", 5]] -> ["+", "a", 5], {a: 120, ...}
     :param ast: ["let", [], []]
     :param env: AST Environment
-    :return:    result from the expression evaluation
+    :return:    tuple of the expression and the Environment to evaluate it in
     """
+    check_bindings(ast)
     bindings = ast[1]
 
     let_env = env.extend({})
     for key, val in bindings:
         let_env = let_env.extend({key: evaluate(val, let_env)})
 
-    return evaluate(ast[2], let_env)
+    return ast[2], let_env
 
 
-def eval_closure(ast, env):
+def eval_closure(closure, ast, env):
+    """
+    Consume a closure and the list with the call expression, and bind the evaluated
+    arguments to the closure's parameters. The function's body is in tail position, and
+    is returned together with the new environment instead of being evaluated here.
+    The call expression is left untouched, so the same AST can be evaluated again.
+    :param closure: Closure, the value of the first element of ast
+    :param ast:     [expr, param1, param2, ..., paramN]
+    :param env:     AST Environment
+    :return:        tuple of the function's body and the Environment to evaluate it in
     """
-    Consume a list with a closure expression.
-    :param ast: [Closure, param1, param2, ..., paramN]
+
+    params = closure.params
+
+    if len(ast) - 1 != len(params):
+        raise LispError('wrong number of arguments, expected %d got %d' % (len(params), len(ast) - 1))
+
+    args = {}
+    for idx, param in enumerate(params):
+        args[param] = evaluate(ast[idx + 1], env)
+
+    return closure.body, closure.env.extend(args)
+
+
+def eval_builtin(ast, env):
+    """
+    Consume a list with first element equal to "builtin", the name of a builtin and a fallback
+    expression, and return the builtin registered under that name. If there is none, the
+    fallback expression is evaluated instead.
+    E.g.: ["builtin", "length", ["lambda", ["lst"], ...]] -> <builtin/length>
+    :param ast: ["builtin", symbol, expr]
+    :param env: AST Environment
+    :return:    Builtin, or the value of the fallback expression
+    """
+    from .builtins import BUILTINS
+
+    if len(ast) != 3 or not is_symbol(ast[1]):
+        raise LispError('A builtin expression requires a name and a fallback expression.')
+
+    if ast[1] in BUILTINS:
+        return BUILTINS[ast[1]]
+
+    return evaluate(ast[2], env)
+
+
+def eval_defmemo(ast, env):
+    """
+    Consume a list with first element equal to "defmemo", and return the define
+    expression it is short for, to be evaluated in its place.
+    :param ast: ["defmemo", symbol, [params], body] or ["defmemo", symbol, [params], body, max-size]
     :param env: AST Environment
-    :return:    the result of the function's body execution
+    :return:    tuple of the define expression and env
     """
-    closure = ast[0]
+    return expand_defmemo(ast), env
 
-    if len(ast[1:]) != len(closure.params):
-        raise LispError('wrong number of arguments, expected %d got %d' % (len(closure.params), len(ast[1:])))
 
-    args = dict()
-    for idx, param in enumerate(ast[1:]):
-        args[closure.params[idx]] = evaluate(param, env)
+def eval_memo_form(ast, env):
+    """
+    Consume a list with first element equal to "memoize" or "memo-stats", and call
+    the builtin of that name with the evaluated arguments.
+    """
+    return apply_builtin(MEMO_FORMS[ast[0]], [evaluate(arg, env) for arg in ast[1:]])
 
-    call_env = closure.env.extend(args)
-    return evaluate(closure.body, call_env)
+
+def eval_memoized(closure, ast, env):
+    """
+    Like `eval_closure`, for a memoized closure. The result is looked up in the closure's
+    memo cache, and only if it is not there is the body evaluated, and the result stored.
+    :param closure: Closure with a MemoCache
+    :param ast:     [expr, param1, param2, ..., paramN]
+    :param env:     AST Environment
+    :return:        the result of the call
+    """
+    body, body_env = eval_closure(closure, ast, env)
+    key = memo_key([body_env.get(param) for param in closure.params])
+    value = closure.memo.get(key)
+
+    if value is MISSING:
+        value = evaluate(body, body_env)
+        closure.memo.put(key, value)
+
+    return value
 
 
 def eval_math(ast, env):
     """
     Consume a list with a mathematical expression and return its evaluation.
-    E.g.: ["+", 2, 10] ->
-    :param ast: [math operator, exp1, exp2]
+    E.g.: ["+", 2, 10, 5] -> 17
+    :param ast: [math operator, exp1, exp2, ..., expN]
     :param env: AST Environment
-    :return:    number
+    :return:    number or bool
     """
-    l_operand = evaluate(ast[1], env)
-    r_operand = evaluate(ast[2], env)
-    if type(l_operand) is str or type(r_operand) is str:
-        raise LispError("One of the arguments is not a number: {} or {}".format(l_operand, r_operand))
-    return eval(str(l_operand) + ast[0].replace("mod", "%") + str(r_operand))
+    return math_operation(ast[0], [evaluate(exp, env) for exp in ast[1:]])
 
 
 def eval_cons(ast, env):
@@ -266,24 +319,7 @@ def eval_cons(ast, env):
     :param env: AST Environment
     :return:    list
     """
-    item = evaluate(ast[1], env)
-    container = evaluate(ast[2], env)
-
-    if is_list(container):
-        lst = list()
-        lst.append(item)
-        lst += container
-        return lst
-
-    if is_string(container):
-
-        if is_string(item):
-            return String(item.val + container.val)
-
-        else:
-            return String(str(item) + container.val)
-
-    raise LispError("You can't use cons without a list or a string as a second argument: {}".format(ast))
+    return cons(evaluate(ast[1], env), evaluate(ast[2], env))
 
 
 def eval_empty(ast, env):
@@ -294,12 +330,7 @@ def eval_empty(ast, env):
     :param env: AST Environment
     :return:    bool
     """
-    lst = evaluate(ast[1], env)
-
-    if is_list(lst) or is_string(lst):
-        return True if len(lst) == 0 else False
-
-    raise LispError('can\'t apply empty on something different than a list or a string')
+    return empty(evaluate(ast[1], env))
 
 
 def eval_head(ast, env):
@@ -310,16 +341,7 @@ def eval_head(ast, env):
     :param env: AST Environment
     :return:    first element of the list (atom or list)
     """
-    lst = evaluate(ast[1], env)
-
-    if not (is_list(lst) or is_string(lst)):
-        raise LispError('can\'t apply head on something different than a list or a string')
-
-    if len(lst) == 0:
-        raise LispError('can\'t apply head on an empty list or string')
-
-    else:
-        return lst[0] if is_list(lst) else String(lst[0])
+    return head(evaluate(ast[1], env))
 
 
 def eval_tail(ast, env):
@@ -330,68 +352,335 @@ def eval_tail(ast, env):
     :param env: AST Environment
     :return:    list
     """
-    lst = evaluate(ast[1], env)
-
-    if not (is_list(lst) or is_string(lst)):
-        raise LispError('can\'t apply tail on something different than a list or a string')
-
-    if len(lst) == 0:
-        raise LispError('can\'t apply tail on an empty list or string')
-
-    else:
-        return lst[1:] if is_list(lst) else String(lst[1:])
+    return tail(evaluate(ast[1], env))
 
 
 def eval_quote(ast):
     """
     Consume a list with its first element equal to "quote" and return the second element (list)
-    without being evaluated.
-    ["quote", ["+", 1, 2]] -> ["+", 1, 2]
+    without being evaluated. Quoted lists become ConsLists.
+    ["quote", ["+", 1, 2]] -> ("+" 1 2)
     :param ast: ["quote", []]
     :return:    the second element without being evaluated
     """
-    return ast[1]
+    return ConsList.from_python(ast[1])
 
 
 def eval_if(ast, env):
     """
     Consume a list with the first element equal to "if" and 3 additional elements (a condition,
     an expression for the true case and an expression for the false case), and return the result
-    of the evaluation of one of the conditional expressions.
-    E.g.: ["if", (">" 10 5), 10, 5] -> 10
+    of one of the conditional expressions, which is in tail position and therefore not evaluated here.
+    E.g.: ["if", (">" 10 5), 10, 5] -> 10, env
     :param ast: ["if", expr condition, true expr, false expr]
     :param env: AST Environment
-    :return:    the result of the evaluation of true expr or false expr
+    :return:    tuple of true expr or false expr and env
     """
-    return evaluate(ast[2], env) if evaluate(ast[1], env) else evaluate(ast[3], env)
+    check_arguments(ast, 3)
+    return (ast[2] if evaluate(ast[1], env) else ast[3]), env
 
 
 def eval_cond(ast, env):
     """
     Consume a list with the first element equal to "cond" and N number of tuples (list with
-    two elements) and return the result of the execution of the condition that get evaluated
-    as true.
+    two elements) and return the expression of the condition that get evaluated as true. Like
+    with `if`, the expression is in tail position and therefore not evaluated here.
     E.g.: ["cond", [ ["empty", [1, 2, 3]], [1, 2, 3] ] (Example with one condition)
     :param ast: ["cond", [ [], [] ], [ [], [] ], ..., [ [], [] ]]
     :param env: AST Environment
-    :return:    the evaluation of the expression associated with a condition evaluated to true
+    :return:    tuple of the expression associated with a condition evaluated to true and env
     """
+    check_clauses(ast)
     predicates = list()
     expressions = list()
 
     conditions = ast[1]
 
     for cond_exp in conditions:
-
-        if not is_list(cond_exp):
-            raise LispError('Every condition must be a tuple (list) of a predicate and a expression.')
-
         predicates.append(cond_exp[0])
         expressions.append(cond_exp[1])
 
     for idx, p in enumerate(predicates):
 
         if evaluate(p, env):
-            return evaluate(expressions[idx], env)
+            return expressions[idx], env
+
+    return False, env
+
+
+#
+# The checks below are made on the forms by every engine, so that they all fail alike.
+#
+
+
+def check_arguments(ast, count):
+    """
+    Raise a LispError unless the form in ast has exactly count arguments.
+    :param ast:   [form, arg1, ..., argN]
+    :param count: integer
+    """
+    if len(ast) != count + 1:
+        raise LispError('Wrong number of arguments. {} expects {} of them and received {}.'.format(
+            ast[0], count, len(ast) - 1))
+
+
+def check_clauses(ast):
+    """
+    Raise a LispError unless ast is a cond form with a list of (predicate expr) pairs.
+    :param ast: ["cond", [[predicate, expr], ...]]
+    """
+    check_arguments(ast, 1)
+
+    for cond_exp in ast[1]:
+
+        if not (is_list(cond_exp) and len(cond_exp) == 2):
+            raise LispError('Every condition must be a tuple (list) of a predicate and a expression.')
+
+
+def check_bindings(ast):
+    """
+    Raise a LispError unless ast is a let form with a list of (symbol expr) pairs and a body.
+    :param ast: ["let", [[symbol, expr], ...], body]
+    """
+    check_arguments(ast, 2)
+
+    if not (is_list(ast[1]) and all(is_list(binding) and len(binding) == 2 for binding in ast[1])):
+        raise LispError('The bindings of a let must be a list of (symbol expr) pairs.')
+
+
+#
+# The functions below operate on already evaluated values. They are shared by
+# the `eval_*` functions above and by the compiler in `compiler.py`.
+#
+
+
+def eq(expr1, expr2):
+    """
+    Consume two values and return True if they are the same atom. Lists are never equal.
+    :param expr1: value
+    :param expr2: value
+    :return:      bool
+    """
+    if is_cons_list(expr1) or is_cons_list(expr2) or is_list(expr1) or is_list(expr2):
+        return False
+
+    return expr1 == expr2
+
+
+def named(value, name):
+    """
+    Give a closure the name it is first defined with, which is the name the profiler
+    knows it by. Other values are left alone.
+    :param value: any value
+    :param name:  symbol
+    :return:      value
+    """
+    if is_closure(value) and value.name is None:
+        value.name = name
+
+    return value
+
+
+def apply_builtin(builtin, args):
+    """
+    Call a builtin with a list of already evaluated arguments, after checking their number.
+    :param builtin: Builtin
+    :param args:    list of values
+    :return:        the result of the builtin
+    """
+    if not builtin.min_args <= len(args) <= builtin.max_args:
+        raise arity_error(builtin, len(args))
+
+    return builtin.function(*args)
+
+
+def arity_error(builtin, count):
+    """The error for calling builtin with count arguments, outside of the number it takes."""
+    expected = builtin.min_args if builtin.min_args == builtin.max_args else \
+        "%d to %d" % (builtin.min_args, builtin.max_args)
+    return LispError('wrong number of arguments, %s expected %s got %d' % (builtin.name, expected, count))
+
+
+def math_operation(name, operands):
+    """
+    Consume the name of a math operator and a list of values and return the result of
+    applying it. Arithmetic operators fold the operands from the left, comparisons are
+    chained, so that (< a b c) means (a < b) and (b < c).
+    E.g.: "+", [2, 10, 5] -> 17
+    :param name:     string
+    :param operands: list of numbers
+    :return:         number or bool
+    """
+    for operand in operands:
+
+        if type(operand) not in NUMBER_TYPES:
+            raise LispError("One of the arguments is not a number: {}".format(unparse(operand)))
+
+    function, min_operands = MATH_OPERATORS[name]
+
+    if len(operands) < min_operands:
+        raise LispError("Wrong number of arguments. {} expects at least {} of them and received {}.".format(
+            name, min_operands, len(operands)))
+
+    if name in COMPARISON_OPERATORS:
+        return all(function(operands[idx], operands[idx + 1]) for idx in range(len(operands) - 1))
+
+    if len(operands) == 1:
+        return -operands[0] if name == "-" else operands[0]
+
+    result = operands[0]
+    for operand in operands[1:]:
+        result = function(result, operand)
+
+    return result
+
+
+def divide(l_operand, r_operand):
+    """
+    Integer division, raising a LispError instead of ZeroDivisionError.
+    """
+    if r_operand == 0:
+        raise LispError("Division by zero: {} / {}".format(l_operand, r_operand))
+
+    return l_operand // r_operand
+
+
+def modulo(l_operand, r_operand):
+    """
+    Modulo, raising a LispError instead of ZeroDivisionError.
+    """
+    if r_operand == 0:
+        raise LispError("Division by zero: {} mod {}".format(l_operand, r_operand))
+
+    return l_operand % r_operand
+
+
+# Python 2 promotes big integers to `long`. Booleans are deliberately not numbers.
+try:
+    NUMBER_TYPES = frozenset([int, long])
+except NameError:
+    NUMBER_TYPES = frozenset([int])
+
+ARITHMETIC_OPERATORS = {
+    "+": (operator.add, 1),
+    "-": (operator.sub, 1),
+    "*": (operator.mul, 1),
+    "/": (divide, 2),
+    "mod": (modulo, 2),
+}
 
-    return False
+COMPARISON_OPERATORS = {
+    ">": (operator.gt, 2),
+    "<": (operator.lt, 2),
+    ">=": (operator.ge, 2),
+    "<=": (operator.le, 2),
+}
+
+MATH_OPERATORS = dict(ARITHMETIC_OPERATORS)
+MATH_OPERATORS.update(COMPARISON_OPERATORS)
+
+
+def cons(item, container):
+    """
+    Consume an item and a list or String and produce a new one with the item prepended.
+    Prepending to a ConsList shares the cells of the container, and takes O(1) time, and
+    so does prepending to a String, whose characters are only joined when needed.
+    E.g.: "ABC", (1 2 3) -> ("ABC" 1 2 3)
+    :param item:      value
+    :param container: ConsList, list or String
+    :return:          ConsList or String
+    """
+    if type(container) is ConsList:
+        return ConsList(item, container)
+
+    if is_list(container):
+        return ConsList(item, ConsList.from_python(container))
+
+    if is_string(container):
+        return (item if is_string(item) else String(str(item))) + container
+
+    raise LispError("You can't use cons without a list or a string as a second argument: {}".format(
+        unparse(container)))
+
+
+def empty(lst):
+    """
+    Consume a list or String and return true if it is empty.
+    :param lst: ConsList, list or String
+    :return:    bool
+    """
+    if type(lst) is ConsList:
+        return lst.length == 0
+
+    if is_list(lst) or is_string(lst):
+        return True if len(lst) == 0 else False
+
+    raise LispError('can\'t apply empty on something different than a list or a string')
+
+
+def head(lst):
+    """
+    Consume a list or String and return its first element.
+    :param lst: ConsList, list or String
+    :return:    first element of the list (atom or list)
+    """
+    if is_list(lst):
+        lst = ConsList.from_python(lst)
+
+    if not (is_cons_list(lst) or is_string(lst)):
+        raise LispError('can\'t apply head on something different than a list or a string')
+
+    if len(lst) == 0:
+        raise LispError('can\'t apply head on an empty list or string')
+
+    else:
+        return lst.head
+
+
+def tail(lst):
+    """
+    Consume a list or String and return all of its elements minus the first one. The tail
+    of a ConsList shares its cells, the tail of a String its characters, and takes O(1) time.
+    :param lst: ConsList, list or String
+    :return:    ConsList or String
+    """
+    if is_list(lst):
+        lst = ConsList.from_python(lst)
+
+    if not (is_cons_list(lst) or is_string(lst)):
+        raise LispError('can\'t apply tail on something different than a list or a string')
+
+    if len(lst) == 0:
+        raise LispError('can\'t apply tail on an empty list or string')
+
+    else:
+        return lst.tail
+
+
+# The special forms, by name. Those in TAIL_FORMS give the expression to evaluate
+# next, in tail position, instead of a value. Both are keyed on interned symbols,
+# so that looking up the form of a parsed expression takes an identity check.
+SPECIAL_FORMS = {
+    "quote": lambda ast, env: eval_quote(ast),
+    "atom": eval_atom,
+    "eq": eval_eq,
+    "define": eval_define,
+    "defn": eval_defn,
+    "lambda": eval_lambda,
+    "builtin": eval_builtin,
+    "cons": eval_cons,
+    "empty": eval_empty,
+    "head": eval_head,
+    "tail": eval_tail,
+}
+
+SPECIAL_FORMS.update(dict.fromkeys(MATH_OPERATORS, eval_math))
+SPECIAL_FORMS.update(dict.fromkeys(MEMO_FORMS, eval_memo_form))
+SPECIAL_FORMS = intern_keys(SPECIAL_FORMS)
+
+TAIL_FORMS = intern_keys({
+    "if": eval_if,
+    "cond": eval_cond,
+    "let": eval_let,
+    "defmemo": eval_defmemo,
+})
@@ -1,38 +1,221 @@
 # -*- coding: utf-8 -*-
 
+import atexit
+import threading
+from collections import namedtuple
+from functools import partial
+from multiprocessing.pool import ThreadPool
 from os.path import dirname, join
 
+from .bytecode import compile_bytecode
+from .cache import parse_file
+from .compiler import compile_ast
 from .evaluator import evaluate
-from .parser import parse, unparse, parse_multiple
-from .types import Environment
+from .memo import MISSING, MemoCache
+from .optimizer import optimize as optimize_ast
+from .parser import parse, unparse, parse_stream
+from .types import Environment, LispError
+from . import vm
 
+# The execution engines, each taking an AST and an Environment and returning
+# the value of the AST. The tree-walking evaluator is the reference the other
+# two are tested against.
+ENGINES = {
+    "compiler": lambda ast, env: compile_ast(ast)(env),
+    "vm": vm.run,
+    "evaluator": evaluate,
+}
 
-def interpret(source, env=None):
+# For each engine, a function preparing an AST to be run any number of times.
+# It returns a function taking the Environment to run the AST in.
+PREPARERS = {
+    "compiler": compile_ast,
+    "vm": lambda ast: partial(vm.execute, compile_bytecode(ast)),
+    "evaluator": lambda ast: partial(evaluate, ast),
+}
+
+# The result of a file with no statements.
+NOTHING = object()
+
+# The result of one source run by `interpret_batch`: the value as a string, or
+# None and the exception raised.
+Result = namedtuple("Result", ["value", "error"])
+
+# The programs prepared by `interpret_batch`, by source, engine and optimize.
+PROGRAMS = MemoCache(4096)
+
+# The thread pools of `interpret_many`, by number of workers, closed when the
+# interpreter exits.
+pools = {}
+pools_lock = threading.Lock()
+
+
+def interpret(source, env=None, engine="compiler", optimize=False):
     """
     Interpret a lisp program statement
 
-    Accepts a program statement as a string, interprets it, and then
-    returns the resulting lisp expression as string.
+    Accepts a program statement as a string, compiles and runs it, and then
+    returns the resulting lisp expression as string. The engine running it is
+    one of the names in ENGINES. With optimize, the program goes through the
+    optimizer first.
     """
     if env is None:
         env = Environment()
 
-    return unparse(evaluate(parse(source), env))
+    ast = parse(source)
+
+    if optimize:
+        ast = optimize_ast(ast)
 
+    return unparse(engine_named(engine)(ast, env))
 
-def interpret_file(filename, env=None):
+
+def interpret_file(filename, env=None, engine="compiler", profiler=None, optimize=False, cache=True):
     """
     Interpret a lisp file
 
     Accepts the name of a lisp file containing a series of statements. 
-    Returns the value of the last expression of the file.
+    Returns the value of the last expression of the file. If a Profiler is
+    given, it is active while the file runs. With cache, the parsed file is
+    read from and written to its AST cache file.
     """
+    if cache:
+        return interpret_asts(parse_file(filename), env, engine, profiler, optimize)
+
+    with open(filename, 'r') as sourcefile:
+        return interpret_stream(sourcefile, env, engine, profiler, optimize)
+
+
+def interpret_stream(stream, env=None, engine="compiler", profiler=None, optimize=False):
+    """
+    Interpret lisp source read from a file object
+
+    Like `interpret_file`, for an open file in text mode or a pipe like stdin.
+    Each statement is run as soon as it has been read, and only the value of
+    the last one is kept, so that the memory used does not grow with the
+    length of the source.
+    """
+    return interpret_asts(parse_stream(stream), env, engine, profiler, optimize)
+
+
+def interpret_asts(asts, env=None, engine="compiler", profiler=None, optimize=False):
+    """
+    Run each AST from the iterable asts in turn, and return the value of the last one.
+    """
+    if profiler is not None:
+        if engine != "compiler":
+            raise LispError("Only the compiler engine can be profiled.")
+
+        with profiler:
+            return interpret_asts(asts, env, engine, optimize=optimize)
+
     if env is None:
         env = Environment()
 
-    with open(filename, 'r') as sourcefile:
-        source = "".join(sourcefile.readlines())
+    run = engine_named(engine)
+    result = NOTHING
+
+    for ast in asts:
+
+        if optimize:
+            ast = optimize_ast(ast)
+
+        result = run(ast, env)
+
+    if result is NOTHING:
+        raise LispError("Incomplete expression: no expression found")
+
+    return unparse(result)
+
+
+def interpret_batch(sources, env=None, engine="compiler", optimize=False):
+    """
+    Interpret many independent lisp program statements
+
+    Each source is run in a new environment extending env, so it sees what env
+    defines, but what it defines itself is thrown away afterwards, and never
+    seen by the other sources. Sources that have been run before are not parsed
+    or compiled again.
+
+    Returns a list with a Result for each source, in order. An error in one
+    source is returned in its Result, and does not stop the others from running.
+    """
+    if env is None:
+        env = Environment()
+
+    engine_named(engine)
+    return [run_source(source, env, engine, optimize) for source in sources]
+
+
+def interpret_many(sources, env=None, engine="compiler", optimize=False, workers=None):
+    """
+    Interpret many independent lisp program statements on a pool of threads
+
+    Like `interpret_batch`, with the sources shared out between `workers` threads,
+    by default one per CPU. The threads only ever read env, as each source runs in
+    an environment of its own. Freeze env first, so that nothing else adds to it
+    while they do. Threads take turns running Python code, so this is for hosts
+    with other work to overlap with, such as waiting on the network.
+    """
+    if env is None:
+        env = Environment()
+
+    engine_named(engine)
+
+    if workers is not None and workers < 1:
+        raise LispError("interpret_many expects a positive number of workers")
+
+    return thread_pool(workers).map(partial(run_source, env=env, engine=engine, optimize=optimize), sources)
+
+
+def thread_pool(workers):
+    with pools_lock:
+        if workers not in pools:
+            pool = ThreadPool(workers)
+            atexit.register(close_pool, pool)
+            pools[workers] = pool
+
+        return pools[workers]
+
+
+def close_pool(pool):
+    pool.close()
+    pool.join()
+
+
+def run_source(source, env, engine, optimize):
+    """
+    Run source in a new environment extending env.
+    :return: Result
+    """
+    try:
+        program = prepared(source, engine, optimize)
+        return Result(unparse(program(env.extend())), None)
+    except Exception as error:
+        return Result(None, error)
+
+
+def prepared(source, engine, optimize):
+    """
+    The program for source prepared for engine, from PROGRAMS if it is there.
+    """
+    key = (source, engine, optimize)
+    program = PROGRAMS.get(key)
+
+    if program is MISSING:
+        ast = parse(source)
+
+        if optimize:
+            ast = optimize_ast(ast)
+
+        program = PREPARERS[engine](ast)
+        PROGRAMS.put(key, program)
+
+    return program
+
+
+def engine_named(name):
+    if name not in ENGINES:
+        raise LispError("Unknown engine %s, expected one of: %s." % (name, ", ".join(sorted(ENGINES))))
 
-    asts = parse_multiple(source)
-    results = [evaluate(ast, env) for ast in asts]
-    return unparse(results[-1])
+    return ENGINES[name]
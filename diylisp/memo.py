@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from collections import OrderedDict
+
+from .types import LispError, Builtin, Closure, ConsList, String
+from .ast import is_closure, is_cons_list, is_list, is_string
+
+"""
+Memoization of pure Lisp functions.
+
+    (defmemo fib (n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))
+    (define fast-f (memoize f 100))
+    (memo-stats fib) ; -> (hits misses size max-size)
+
+`memoize` makes a copy of a closure with a MemoCache attached, which maps the
+arguments of earlier calls to their results. Once the cache holds max-size
+results, the least recently used one is evicted. `defmemo` is `defn` for
+memoized functions. All engines check for the cache when calling a closure,
+so memoized functions are called like any other.
+"""
+
+DEFAULT_MAX_SIZE = 1024
+
+# Returned by MemoCache.get for arguments not in the cache.
+MISSING = object()
+
+
+class MemoCache(object):
+    """
+    A bounded map from arguments to results, evicting the least recently used entry.
+    It can be shared between threads.
+    """
+    __slots__ = ('entries', 'max_size', 'hits', 'misses', 'lock')
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        self.entries = OrderedDict()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return the result stored for key, or MISSING."""
+        with self.lock:
+            value = self.entries.pop(key, MISSING)
+
+            if value is MISSING:
+                self.misses += 1
+                return MISSING
+
+            self.hits += 1
+            self.entries[key] = value
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def __getstate__(self):
+        return self.entries, self.max_size, self.hits, self.misses
+
+    def __setstate__(self, state):
+        self.entries, self.max_size, self.hits, self.misses = state
+        self.lock = threading.Lock()
+
+
+def memo_key(args):
+    """
+    A hashable key for a list of arguments. Lists and Strings are keyed on their
+    contents, and booleans are told apart from the numbers 0 and 1.
+    :param args: list of values
+    :return:     tuple
+    """
+    return tuple(value_key(value) for value in args)
+
+
+def value_key(value):
+    if value is True or value is False:
+        return bool, value
+
+    if is_cons_list(value) or is_list(value):
+        return list, tuple(value_key(item) for item in value)
+
+    if is_string(value):
+        return String, value.val
+
+    return value
+
+
+def memoize(closure, max_size=DEFAULT_MAX_SIZE):
+    """
+    Produce a copy of closure with a new MemoCache of max_size entries.
+    :param closure:  Closure
+    :param max_size: positive integer
+    :return:         Closure
+    """
+    if not is_closure(closure):
+        raise LispError("Only closures can be memoized, not {}.".format(closure))
+
+    if type(max_size) is not int or max_size < 1:
+        raise LispError("The size of a memo cache must be a positive number, not {}.".format(max_size))
+
+    memoized = Closure(closure.env, closure.params, closure.body)
+    memoized.code = closure.code
+    memoized.bytecode = closure.bytecode
+    memoized.name = closure.name
+    memoized.memo = MemoCache(max_size)
+    return memoized
+
+
+def memo_stats(closure):
+    """
+    The statistics of a memoized closure, as the list (hits misses size max-size).
+    """
+    if not is_closure(closure) or closure.memo is None:
+        raise LispError("Not a memoized function {}.".format(closure))
+
+    memo = closure.memo
+    return ConsList.from_list([memo.hits, memo.misses, len(memo.entries), memo.max_size])
+
+
+def expand_defmemo(ast):
+    """
+    Rewrite a defmemo form into the define form it is short for.
+    E.g.: ["defmemo", "f", ["x"], "x"] -> ["define", "f", ["memoize", ["lambda", ["x"], "x"]]]
+    :param ast: ["defmemo", symbol, [params], body] or ["defmemo", symbol, [params], body, max-size]
+    :return:    ["define", symbol, ["memoize", ["lambda", [params], body], ...]]
+    """
+    if len(ast) not in (4, 5):
+        raise LispError("A defmemo expression requires a name, parameters, a body and optionally a cache size.")
+
+    return ["define", ast[1], ["memoize", ["lambda", ast[2], ast[3]]] + ast[4:]]
+
+
+# The forms calling a builtin with their evaluated arguments.
+MEMO_FORMS = {
+    "memoize": Builtin("memoize", memoize, 1, 2),
+    "memo-stats": Builtin("memo-stats", memo_stats, 1),
+}
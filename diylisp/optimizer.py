@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+from .types import LispError, ConsList, String, intern_keys
+from .ast import is_atom, is_boolean, is_integer, is_list, is_string, is_symbol, is_cons_list
+from .evaluator import eq, math_operation, cons, empty, head, tail, ARITHMETIC_OPERATORS, MATH_OPERATORS
+
+"""
+This is the Optimizer module. It runs between the parser and the engines, and
+rewrites an AST into one giving the same result with less work.
+
+    (+ 1 2)                 -> 3
+    (+ 1 2 x)               -> (+ 3 x)
+    (if (< 1 2) a b)        -> a
+    (head '(1 2 3))         -> 1
+    (cond (((eq 1 2) a) (#t b)))  -> b
+
+Constants are numbers, booleans, strings and quoted data. Math, `eq`, `atom`
+and the list operations on constants are evaluated here, and `if` and `cond`
+with constant predicates lose the branches that can never be taken. Quoted
+data is left untouched, and so is anything that would raise an error, such
+as a division by zero, so that the error is still raised when (and if) the
+expression is evaluated.
+
+The AST given is never modified. The parts that change are copied.
+"""
+
+
+def optimize(ast):
+    """
+    Produce an optimized version of ast.
+    E.g.: ["if", ["<", 1, 2], ["+", 1, 2], "x"] -> 3
+    :param ast: list or atom
+    :return:    list or atom
+    """
+    if not is_list(ast) or len(ast) == 0:
+        return ast
+
+    form = ast[0]
+
+    if form == "quote":
+        return ast
+
+    if is_symbol(form) and form in OPTIMIZERS:
+        return OPTIMIZERS[form](ast)
+
+    return [optimize(exp) for exp in ast]
+
+
+def is_constant(ast):
+    return (is_integer(ast) or is_boolean(ast) or is_string(ast) or
+            (is_list(ast) and len(ast) == 2 and ast[0] == "quote"))
+
+
+def constant_value(ast):
+    """The value of a constant AST."""
+    return ConsList.from_python(ast[1]) if is_list(ast) else ast
+
+
+def constant_ast(value):
+    """
+    An AST evaluating to value, or None if there is none.
+    E.g.: ConsList(1, 2) -> ["quote", [1, 2]]
+    """
+    if is_integer(value) or is_boolean(value) or isinstance(value, String):
+        return value
+
+    if is_cons_list(value):
+        return ["quote", value.to_python()]
+
+    if is_symbol(value):
+        return ["quote", value]
+
+    return None
+
+
+def fold(ast, function):
+    """
+    Optimize the arguments of ast, and if they are all constants, replace it by the
+    result of calling function with their values. Errors are left for runtime.
+    """
+    args = [optimize(exp) for exp in ast[1:]]
+
+    if all(is_constant(arg) for arg in args):
+        try:
+            result = constant_ast(function(*[constant_value(arg) for arg in args]))
+        except LispError:
+            result = None
+
+        if result is not None:
+            return result
+
+    return [ast[0]] + args
+
+
+def fold_form(function, arity):
+    """
+    Produce an optimizer for a form applying function to arity arguments.
+    """
+    def optimize_form(ast):
+        if len(ast) != arity + 1:
+            return [optimize(exp) for exp in ast]
+
+        return fold(ast, function)
+
+    return optimize_form
+
+
+def optimize_math(ast):
+    name = ast[0]
+    folded = fold(ast, lambda *operands: math_operation(name, list(operands)))
+
+    if not is_list(folded) or name not in ARITHMETIC_OPERATORS:
+        return folded
+
+    # The operators fold from the left, so a run of constants at the start can
+    # be folded even if other operands follow: (+ 1 2 x) -> (+ 3 x).
+    operands = folded[1:]
+    prefix = 0
+    while prefix < len(operands) and is_integer(operands[prefix]):
+        prefix += 1
+
+    if prefix < 2 or prefix == len(operands):
+        return folded
+
+    try:
+        value = math_operation(name, operands[:prefix])
+    except LispError:
+        return folded
+
+    return [name, value] + operands[prefix:]
+
+
+def optimize_if(ast):
+    if len(ast) != 4:
+        return [optimize(exp) for exp in ast]
+
+    condition = optimize(ast[1])
+
+    if is_integer(condition) or is_boolean(condition):
+        return optimize(ast[2] if condition else ast[3])
+
+    return ["if", condition, optimize(ast[2]), optimize(ast[3])]
+
+
+def optimize_cond(ast):
+    if len(ast) != 2 or not is_list(ast[1]) or not all(is_list(clause) and len(clause) == 2 for clause in ast[1]):
+        return [optimize(exp) for exp in ast]
+
+    clauses = []
+    for predicate, expression in ast[1]:
+        predicate = optimize(predicate)
+
+        if is_integer(predicate) or is_boolean(predicate):
+
+            if not predicate:
+                continue
+
+            if not clauses:
+                return optimize(expression)
+
+            clauses.append([predicate, optimize(expression)])
+            break
+
+        clauses.append([predicate, optimize(expression)])
+
+    if not clauses:
+        return False
+
+    return ["cond", clauses]
+
+
+def optimize_lambda(ast):
+    if len(ast) != 3:
+        return ast
+
+    return [ast[0], ast[1], optimize(ast[2])]
+
+
+def optimize_definition(ast):
+    """
+    Optimize everything but the name and parameters of `define`, `defn` and `defmemo`.
+    """
+    skip = 2 if ast[0] == "define" else 3
+    return ast[:skip] + [optimize(exp) for exp in ast[skip:]]
+
+
+def optimize_let(ast):
+    if len(ast) != 3 or not is_list(ast[1]) or not all(is_list(binding) and len(binding) == 2
+                                                       for binding in ast[1]):
+        return ast
+
+    return ["let", [[key, optimize(val)] for key, val in ast[1]], optimize(ast[2])]
+
+
+OPTIMIZERS = {
+    "atom": fold_form(is_atom, 1),
+    "eq": fold_form(eq, 2),
+    "if": optimize_if,
+    "cond": optimize_cond,
+    "define": optimize_definition,
+    "defn": optimize_definition,
+    "defmemo": optimize_definition,
+    "lambda": optimize_lambda,
+    "let": optimize_let,
+    "cons": fold_form(cons, 2),
+    "empty": fold_form(empty, 1),
+    "head": fold_form(head, 1),
+    "tail": fold_form(tail, 1),
+}
+
+OPTIMIZERS.update(dict.fromkeys(MATH_OPERATORS, optimize_math))
+OPTIMIZERS = intern_keys(OPTIMIZERS)
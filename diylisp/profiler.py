@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+# The clock timings are taken with, here and in `benchmark`.
+try:
+    from time import perf_counter as clock
+except ImportError:
+    # Python 2 has no perf_counter. timeit picks its best clock instead.
+    from timeit import default_timer as clock
+
+from . import compiler
+
+"""
+The profiler attributes the time spent running compiled code to Lisp functions.
+
+    profiler = Profiler()
+    with profiler:
+        interpret_file("script.diy", env)
+
+    print(profiler.report())
+    profiler.write_collapsed("script.folded")
+
+While a profiler is active, `call_closure` in the compiler tells it when each
+function call starts and ends. Closures are known by the name they were first
+defined with by `define` or `defn`, builtins by their own name. For each
+function the profiler counts the calls, and measures the inclusive time (with
+the calls it makes) and the exclusive time (without them). Recursive calls
+only count once towards the inclusive time.
+
+Special forms are counted each time they are evaluated, but only in code
+compiled while the profiler is active.
+
+The collapsed stacks, one line per distinct call stack with its exclusive
+time in microseconds, are the input format of flamegraph tools such as
+`flamegraph.pl`.
+"""
+
+
+class Profiler(object):
+    """
+    Call counts and times per function, and evaluation counts per special form.
+    Used as a context manager, which makes it the active profiler.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.inclusive = {}
+        self.exclusive = {}
+        self.forms = {}
+        self.stacks = {}
+        self.stack = []
+        self.active = {}
+        self.running = False
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = compiler.profiler
+        compiler.profiler = self
+        self.running = True
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        compiler.profiler = self.previous
+        self.running = False
+        return False
+
+    def enter(self, name):
+        """Start a call to the function name."""
+        self.stack.append([name, clock(), 0.0])
+        self.active[name] = self.active.get(name, 0) + 1
+
+    def exit(self):
+        """End the innermost call."""
+        name, start, children = self.stack.pop()
+        elapsed = clock() - start
+        self.active[name] -= 1
+
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self.exclusive[name] = self.exclusive.get(name, 0.0) + elapsed - children
+
+        if not self.active[name]:
+            self.inclusive[name] = self.inclusive.get(name, 0.0) + elapsed
+
+        path = tuple(entry[0] for entry in self.stack) + (name,)
+        self.stacks[path] = self.stacks.get(path, 0.0) + elapsed - children
+
+        if self.stack:
+            self.stack[-1][2] += elapsed
+
+    def counted(self, form, compiled):
+        """
+        Wrap the compiled function of a special form, counting its evaluations.
+        :param form:     the name of the special form
+        :param compiled: function(env)
+        :return:         function(env)
+        """
+        forms = self.forms
+        forms.setdefault(form, 0)
+
+        def run_counted(env):
+            if self.running:
+                forms[form] += 1
+
+            return compiled(env)
+
+        return run_counted
+
+    def report(self, limit=None):
+        """
+        A table of the functions by exclusive time, and of the special forms by count.
+        :param limit: maximum number of functions listed, or None for all of them
+        :return:      string
+        """
+        names = sorted(self.calls, key=lambda name: (-self.exclusive[name], name))[:limit]
+        lines = ["%-24s %10s %12s %12s" % ("function", "calls", "inclusive", "exclusive")]
+
+        for name in names:
+            lines.append("%-24s %10d %10.4f s %10.4f s" % (
+                name, self.calls[name], self.inclusive.get(name, 0.0), self.exclusive[name]))
+
+        lines.append("")
+        lines.append("%-24s %10s" % ("special form", "count"))
+
+        for form in sorted(self.forms, key=lambda form: (-self.forms[form], form)):
+
+            if self.forms[form]:
+                lines.append("%-24s %10d" % (form, self.forms[form]))
+
+        return "\n".join(lines)
+
+    def collapsed(self):
+        """
+        The collapsed stacks, as lines of function names separated by semicolons and
+        the exclusive time spent in that stack, in microseconds.
+        E.g.: ["main;fib 1200", "main;fib;fib 3400"]
+        """
+        return ["%s %d" % (";".join(path), round(seconds * 1000000))
+                for path, seconds in sorted(self.stacks.items())]
+
+    def write_collapsed(self, filename):
+        with open(filename, "w") as output:
+            for line in self.collapsed():
+                output.write(line + "\n")
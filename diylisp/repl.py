@@ -4,8 +4,8 @@ import os
 import sys
 
 from .types import LispError, Environment
-from .parser import remove_comments
-from .interpreter import interpret, interpret_file
+from .parser import Reader
+from .interpreter import interpret_asts, interpret_file
 
 # importing this gives readline goodness when running on systems
 # where it is supported (i.e. UNIX-y systems)
@@ -31,15 +31,20 @@ def repl(env=None):
     if env is None:
         env = Environment()
 
+    reader = Reader()
+
     while True:
+        expressions = read_expressions(reader)
+
         try:
-            source = read_expression()
-            print(interpret(source, env))
+            for ast in expressions:
+                print(interpret_asts([ast], env))
         except LispError as e:
             print(colored("!", "red"))
             print(faded(str(e.__class__.__name__) + ":"))
             print(str(e))
         except KeyboardInterrupt:
+            reader.reset()
             msg = "Interupted. " + faded("(Use ^D to exit)")
             print("\n" + colored("! ", "red") + msg)
         except EOFError:
@@ -49,29 +54,35 @@ def repl(env=None):
             print(colored("! ", "red") + faded("The Python is showing through…"))
             print(faded("  " + str(e.__class__.__name__) + ":"))
             print(str(e))
+        finally:
+            # After an error, the rest of the line is dropped.
+            expressions.close()
 
 
-def read_expression():
-    """Read from stdin until we have at least one s-expression"""
+def read_expressions(reader):
+    """Read lines from stdin until they complete at least one s-expression, and
+    yield the ASTs of the expressions completed, each as soon as it is read. An
+    error further on in the line is raised after the expressions before it.
+
+    The reader keeps the state of the expression being read between lines, so
+    each line is only scanned once, however many lines an expression spans."""
 
-    exp = ""
-    open_parens = 0
     while True:
-        line, parens = read_line("→  " if not exp.strip() else "…  ")
-        open_parens += parens
-        exp += line
-        if exp.strip() and open_parens <= 0:
-            break
+        line = read_line("…  " if reader.pending else "→  ")
+        completed = False
+
+        for ast in reader.expressions(line + "\n"):
+            completed = True
+            yield ast
 
-    return exp.strip()
+        if completed:
+            return
 
 
 def read_line(prompt):
-    """Return touple of user input line and number of unclosed parens"""
+    """Return a line of user input"""
 
-    line = input(colored(prompt, "reset", "dark"))
-    line = remove_comments(line + "\n")
-    return line, line.count("(") - line.count(")")
+    return input(colored(prompt, "reset", "dark"))
 
 
 def colored(text, color, attr=None):
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+import sys
+import tempfile
+from os.path import basename, dirname, isdir, join
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from .interpreter import interpret_file
+from .types import Environment
+
+"""
+Snapshots make loading a lisp file, like the standard library, cheap the second
+time around. The variables defined by the file are pickled into a snapshot in
+the `__diycache__` directory next to it, and loaded from there as long as the
+file is unchanged, instead of parsing and running it again.
+
+A snapshot is keyed on a hash of the source, SNAPSHOT_VERSION and the Python
+version. Whenever one of them does not match, or the snapshot can not be read,
+the file is interpreted as usual and the snapshot written again. Builtins are
+only saved by name, and looked up again when the snapshot is loaded, so that
+changes to them take effect without invalidating it. A builtin that has gone
+since makes the snapshot unreadable.
+"""
+
+# Bump when the pickled representation of the types changes.
+SNAPSHOT_VERSION = 5
+
+CACHE_DIRECTORY = "__diycache__"
+
+
+def interpret_snapshot(filename, env=None):
+    """
+    Interpret a lisp file like `interpret_file`, going through its snapshot.
+
+    Accepts the name of a lisp file and the Environment to define its variables in.
+    Returns the value of the last expression of the file.
+    """
+    if env is None:
+        env = Environment()
+
+    with open(filename, 'rb') as sourcefile:
+        digest = hashlib.sha1(sourcefile.read()).hexdigest()
+
+    path = snapshot_path(filename)
+    snapshot = read_snapshot(path, digest, env)
+
+    if snapshot is not None:
+        bindings, result = snapshot
+        for name, value in bindings.items():
+            env.set(name, value)
+
+        return result
+
+    existing = set(env.bindings)
+    result = interpret_file(filename, env)
+    bindings = dict((name, value) for name, value in env.bindings.items() if name not in existing)
+    write_snapshot(path, digest, env, (bindings, result))
+    return result
+
+
+def snapshot_path(filename):
+    """
+    The path of the snapshot of a lisp file.
+    E.g.: "lib/stdlib.diy" -> "lib/__diycache__/stdlib.diy.py27.snapshot"
+    """
+    tag = "py%d%d" % sys.version_info[:2]
+    return join(dirname(filename), CACHE_DIRECTORY, "%s.%s.snapshot" % (basename(filename), tag))
+
+
+def read_snapshot(path, digest, env):
+    """
+    Load the snapshot at path, if it was taken of a source with the given digest.
+    References to the global environment in the snapshot are resolved to env.
+    :return: tuple (bindings, result), or None if there is no valid snapshot
+    """
+    try:
+        with open(path, 'rb') as snapshot:
+            unpickler = pickle.Unpickler(snapshot)
+            unpickler.persistent_load = lambda pid: env
+
+            if unpickler.load() != (SNAPSHOT_VERSION, digest):
+                return None
+
+            return unpickler.load()
+
+    except Exception:
+        # A missing, stale or broken snapshot. It is only a cache, so start over.
+        return None
+
+
+def write_snapshot(path, digest, env, payload):
+    """
+    Save payload to the snapshot at path. The global environment env itself is not
+    saved, only referred to. The file is written under a temporary name and renamed,
+    so that concurrent readers never see a partial snapshot.
+    """
+    directory = dirname(path)
+    temporary = None
+
+    try:
+        if not isdir(directory):
+            os.makedirs(directory)
+
+        handle, temporary = tempfile.mkstemp(dir=directory)
+        with os.fdopen(handle, 'wb') as snapshot:
+            pickler = pickle.Pickler(snapshot, 2)
+            pickler.persistent_id = lambda obj: "env" if obj is env else None
+            pickler.dump((SNAPSHOT_VERSION, digest))
+            pickler.dump(payload)
+
+        os.rename(temporary, path)
+
+    except Exception:
+        # Not being able to save a snapshot only makes the next start slower.
+        if temporary is not None and os.path.exists(temporary):
+            os.remove(temporary)
@@ -7,78 +7,502 @@ It's your job to implement the Closure and Environment types.
 The LispError class you can have for free :)
 """
 
+import itertools
+import threading
+import weakref
+
+# Source of Environment.version numbers.
+_versions = itertools.count(1)
+
 
 class LispError(Exception):
     """General lisp error class."""
     pass
 
 
-class Closure:
+class Symbol(str):
+    """
+    A Lisp symbol. Symbols are strings, equal to plain strings of the same name, and
+    interned by `symbol`: the parser gives every occurrence of a name as the same
+    object. Comparing interned symbols, and looking them up in dicts keyed on them,
+    such as the bindings of an Environment, mostly takes an identity check.
+
+    There are no `__slots__`, since a str subclass can not declare `__weakref__`
+    in them, and the intern table holds its symbols weakly where it can.
+    """
+
+    def __reduce__(self):
+        # Interned again when unpickled.
+        return symbol, (str(self),)
+
+
+# The interned symbols, by name. A symbol nothing else refers to any more is
+# dropped, so reading programs with ever new names does not grow the table.
+# Python 2 has no weak references to str subclasses, so there the table keeps
+# every symbol, up to MAX_SYMBOLS of them.
+try:
+    weakref.ref(Symbol("symbol"))
+    SYMBOLS = weakref.WeakValueDictionary()
+except TypeError:
+    SYMBOLS = {}
+
+symbols_lock = threading.Lock()
+
+# Symbols made once the table is this large are not interned. They still work,
+# as they are equal to the interned ones, but are compared by value.
+MAX_SYMBOLS = 100000
+
+
+def symbol(name):
+    """Return the interned Symbol with the given name."""
+    interned = SYMBOLS.get(name)
+
+    if interned is None:
+        # Under the lock, so that threads interning the same name at once agree on the Symbol.
+        with symbols_lock:
+            interned = SYMBOLS.get(name)
+
+            if interned is None:
+                interned = Symbol(name)
+
+                if len(SYMBOLS) < MAX_SYMBOLS:
+                    SYMBOLS[name] = interned
+
+    return interned
+
+
+def intern_keys(table):
+    """Return a copy of a dict keyed on names, keyed on the interned symbols instead."""
+    return dict((symbol(name), value) for name, value in table.items())
+
+
+class Closure(object):
+    """
+    A function: the parameters and body of a lambda, and the environment it was
+    created in. The engines fill in code or bytecode with the compiled body on the
+    first call, define gives it a name, and memoize a memo cache.
+    """
+    __slots__ = ('env', 'params', 'body', 'code', 'bytecode', 'name', 'memo')
 
     def __init__(self, env, params, body):
-        self.env = env if env else Environment()
-        self.params = params if params else []
-        self.body = body if body else []
+        self.env = env
+        self.params = params
+        self.body = body
+        self.code = None
+        self.bytecode = None
+        self.name = None
+        self.memo = None
+
+    def __getstate__(self):
+        # Compiled code is not picklable, and is compiled again on the first call.
+        return self.env, self.params, self.body, self.name, self.memo
+
+    def __setstate__(self, state):
+        self.env, self.params, self.body, self.name, self.memo = state
+        self.code = None
+        self.bytecode = None
 
     def __repr__(self):
         return "<closure/%s>" % self.params
 
 
-class Environment:
+class Builtin(object):
+    """
+    A procedure implemented in Python. Builtins are called just like closures, with
+    already evaluated arguments, between min_args and max_args of them.
+    """
+
+    def __init__(self, name, function, min_args, max_args=None):
+        self.name = name
+        self.function = function
+        self.min_args = min_args
+        self.max_args = max_args if max_args is not None else min_args
+
+    def __repr__(self):
+        return "<builtin/%s>" % self.name
+
+    def __reduce_ex__(self, protocol):
+        # A registered builtin is pickled by name, and looked up again when unpickled,
+        # so that a snapshot always gets the implementation of the running version.
+        from .builtins import BUILTINS
+
+        if BUILTINS.get(self.name) is self:
+            return registered_builtin, (self.name,)
+
+        return object.__reduce_ex__(self, protocol)
 
-    def __init__(self, variables=None):
-        self.bindings = variables if variables else {}
+
+def registered_builtin(name):
+    """Return the builtin registered under name, for unpickling."""
+    from .builtins import BUILTINS
+
+    if name not in BUILTINS:
+        raise LispError("There is no builtin named %s." % name)
+
+    return BUILTINS[name]
+
+
+class AsyncBuiltin(Builtin):
+    """
+    A builtin implemented by a Python coroutine function. Only the virtual machine run by
+    `aio` can await the result, so calling it from anywhere else is an error.
+    """
+
+    def __init__(self, name, coroutine_function, min_args, max_args=None):
+        Builtin.__init__(self, name, self.call_synchronously, min_args, max_args)
+        self.coroutine_function = coroutine_function
+
+    def call_synchronously(self, *args):
+        raise LispError("%s is asynchronous, and can only be called from interpret_async." % self.name)
+
+
+class Environment(object):
+    """
+    A frame of variable bindings, linked to the frame it extends.
+
+    Extending an environment does not copy its bindings. Lookup walks the chain
+    of frames instead, from the innermost one and outwards.
+
+    `Environment.version` changes every time a binding is added to any environment.
+    Anything caching the result of a lookup can compare it to tell whether the
+    result might be stale.
+
+    A frozen environment can not be added to any more. It is only read, so it can
+    be shared between threads, each defining things in environments extending it.
+    """
+    __slots__ = ('bindings', 'parent', 'frozen')
+
+    version = 0
+
+    def __init__(self, variables=None, parent=None):
+        self.bindings = variables if variables is not None else {}
+        self.parent = parent
+        self.frozen = False
+
+    def get(self, symbol):
+        """Return the value bound to symbol in this frame only, or None."""
+        return self.bindings.get(symbol, None)
 
     def lookup(self, symbol):
-        var = self.bindings.get(symbol, None)
+        env = self
+        while env is not None:
+            var = env.get(symbol)
+
+            if var is not None:
+                return var
 
-        if var is not None:
-            return var
+            env = env.parent
 
         raise LispError('Variable %s is not defined.' % symbol)
 
     def extend(self, variables=None):
-        extended = self.bindings.copy()
-        extended.update(variables) if variables else extended.update({})
-        return Environment(extended)
+        return Environment(variables, self)
 
     def set(self, symbol, value):
+        if self.frozen:
+            raise LispError('Variable %s can not be defined in a frozen environment.' % symbol)
+
         if symbol in self.bindings:
             raise LispError('Variable %s already defined.' % symbol)
 
         self.bindings[symbol] = value
+        Environment.version = next(_versions)
+
+    def freeze(self):
+        """Make this environment, and the ones it extends, read-only. Returns self."""
+        env = self
+        while env is not None:
+            env.frozen = True
+            env = env.parent
+
+        return self
+
+    def __getstate__(self):
+        return self.bindings, self.parent, self.frozen
+
+    def __setstate__(self, state):
+        self.bindings, self.parent, self.frozen = state
 
     def __repr__(self):
         return "<environment: %s>" % self.bindings
 
 
-class String:
+class Frame(Environment):
+    """
+    A frame whose variables are stored in a list, at slots decided by the compiler.
+
+    Compiled code reads the values by index. The names are kept so that the frame
+    can still be searched by symbol, like any other Environment. A slot holding
+    None is not bound yet.
+    """
+    __slots__ = ('names', 'values')
+
+    def __init__(self, names, values, parent=None):
+        self.names = names
+        self.values = values
+        self.parent = parent
+        self.frozen = False
+
+    @property
+    def bindings(self):
+        return dict((name, value) for name, value in zip(self.names, self.values) if value is not None)
+
+    def get(self, symbol):
+        if symbol in self.names:
+            return self.values[self.names.index(symbol)]
+
+        return None
+
+    def set(self, symbol, value):
+        if self.frozen:
+            raise LispError('Variable %s can not be defined in a frozen environment.' % symbol)
+
+        if symbol not in self.names:
+            raise LispError('Variable %s can not be defined in this scope.' % symbol)
+
+        self.define_slot(self.names.index(symbol), value)
+
+    def define_slot(self, slot, value):
+        """
+        Bind the variable at slot, which must not be bound yet.
+
+        Like `set`, this moves on the version, so that no cached lookup keeps
+        finding a binding further out that the new one hides.
+        """
+        if self.values[slot] is not None:
+            raise LispError('Variable %s already defined.' % self.names[slot])
+
+        self.values[slot] = value
+        Environment.version = next(_versions)
+
+    def __getstate__(self):
+        return self.names, self.values, self.parent, self.frozen
+
+    def __setstate__(self, state):
+        self.names, self.values, self.parent, self.frozen = state
+
+
+class ConsList(object):
+    """
+    Immutable list built from cons cells, used for list values at runtime.
+
+    Prepending (`cons`) and taking the tail share the existing cells instead of
+    copying them, so both are O(1). Each cell also knows the length of the list
+    it starts. The empty list is the single instance NIL. ASTs are still plain
+    Python lists, and ConsLists compare equal to Python lists with equal elements.
+    """
+    __slots__ = ('head', 'tail', 'length')
+
+    def __init__(self, head=None, tail=None):
+        self.head = head
+        self.tail = tail
+        self.length = tail.length + 1 if tail is not None else 0
+
+    @staticmethod
+    def from_list(items):
+        """Build a ConsList with the elements of a Python list (or any sequence)."""
+        lst = NIL
+        for item in reversed(items):
+            lst = ConsList(item, lst)
+
+        return lst
+
+    @staticmethod
+    def from_python(value):
+        """Convert a Python list, and any lists nested in it, to ConsLists."""
+        if isinstance(value, list):
+            return ConsList.from_list([ConsList.from_python(item) for item in value])
+
+        return value
+
+    def to_python(self):
+        """Convert to a Python list, also converting any ConsLists nested in it."""
+        return [item.to_python() if isinstance(item, ConsList) else item for item in self]
+
+    def __iter__(self):
+        lst = self
+        while lst.length:
+            yield lst.head
+            lst = lst.tail
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.length:
+            raise IndexError("ConsList index out of range")
+
+        lst = self
+        for _ in range(index):
+            lst = lst.tail
+
+        return lst.head
+
+    def __eq__(self, other):
+        if not isinstance(other, (ConsList, list)) or len(other) != self.length:
+            return False
+
+        return all(mine == theirs for mine, theirs in zip(self, other))
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __reduce__(self):
+        # Pickled as a flat list of elements, rather than a chain of nested cells.
+        if self.length == 0:
+            return "NIL"
+
+        return ConsList, (), list(self)
+
+    def __setstate__(self, items):
+        tail = ConsList.from_list(items[1:])
+        self.head = items[0]
+        self.tail = tail
+        self.length = tail.length + 1
+
+    def __repr__(self):
+        return "ConsList(%r)" % list(self)
+
+
+NIL = ConsList()
+
+
+class String(object):
     """
     Simple data object for representing Lisp strings.
 
     Ignore this until you start working on part 8.
+
+    A String is a view of `length` characters of `text`, from `start`. Its tail is
+    another view of the same text, and is taken without copying. Concatenating
+    two Strings, as `cons` does, keeps them as `parts` until the characters are
+    needed, and then joins them all at once. Walking a string one character at a
+    time, or building one, so takes linear time instead of quadratic.
     """
+    __slots__ = ('text', 'start', 'length', 'parts')
 
     def __init__(self, val=""):
-        self.val = val
+        self.text = val
+        self.start = 0
+        self.length = len(val)
+        self.parts = None
+
+    @classmethod
+    def view(cls, text, start, length):
+        """A String of length characters of text, from start, sharing text."""
+        string = cls.__new__(cls)
+        string.text = text
+        string.start = start
+        string.length = length
+        string.parts = None
+        return string
+
+    @classmethod
+    def concat(cls, left, right):
+        """The String of left followed by right, joined only when its characters are needed."""
+        if left.length == 0:
+            return right
+
+        if right.length == 0:
+            return left
+
+        string = cls.__new__(cls)
+        string.text = None
+        string.start = 0
+        string.length = left.length + right.length
+        string.parts = (left, right)
+        return string
+
+    @property
+    def val(self):
+        """The characters of the string, as a Python string."""
+        if self.parts is not None:
+            self.flatten()
+
+        if self.start == 0 and self.length == len(self.text):
+            return self.text
+
+        return self.text[self.start:self.start + self.length]
+
+    @property
+    def head(self):
+        """The first character, as a String. The string must not be empty."""
+        parts = self.parts
+
+        if parts is not None and parts[0].parts is None:
+            return String(parts[0].text[parts[0].start])
+
+        if parts is not None:
+            self.flatten()
+
+        return String(self.text[self.start])
+
+    @property
+    def tail(self):
+        """All but the first character, as a String. The string must not be empty."""
+        parts = self.parts
+
+        if parts is not None:
+            left, right = parts
+
+            if left.parts is None:
+                return String.concat(String.view(left.text, left.start + 1, left.length - 1), right)
+
+            self.flatten()
+
+        return String.view(self.text, self.start + 1, self.length - 1)
+
+    def flatten(self):
+        """
+        Join the parts of a concatenation into a single text. The parts are walked with an
+        explicit stack, as a string built by prepending one character at a time nests
+        as deep as it is long.
+        """
+        pieces = []
+        stack = [self]
+
+        while stack:
+            string = stack.pop()
+
+            if string.parts is None:
+                pieces.append(string.text[string.start:string.start + string.length])
+            else:
+                stack.append(string.parts[1])
+                stack.append(string.parts[0])
+
+        # Set the text before dropping the parts: the string reads the same throughout.
+        self.text = "".join(pieces)
+        self.parts = None
+
+    def __reduce__(self):
+        # Pickled as its characters only, not the text it is a view of.
+        return String, (self.val,)
 
     def __str__(self):
         return '"{}"'.format(self.val)
 
     def __eq__(self, other):
-        return isinstance(other, String) and other.val == self.val
+        return other.__class__ is String and other.length == self.length and other.val == self.val
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.val)
 
     def __len__(self):
-        return len(self.val)
+        return self.length
 
     def __getitem__(self, item):
         return self.val[item]
 
     def __add__(self, other):
         if type(other) == str:
-            return String(self.val + other)
+            return String.concat(self, String(other))
 
         if type(other) == String:
-            return String(self.val + str(other))
+            return String.concat(self, other)
 
         raise TypeError("unsupported operand type(s) for +: 'String' and '{}'".format(type(other)))
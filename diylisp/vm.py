@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+
+from .types import LispError, AsyncBuiltin, Builtin, Closure, Environment, Frame
+from .ast import is_atom
+from .memo import MISSING, memo_key
+from .evaluator import eq, math_operation, named, apply_builtin, arity_error, cons, empty, head, tail, NUMBER_TYPES
+from .bytecode import compile_bytecode, compile_function, \
+    CONST, LOAD_LOCAL, LOAD_OUTER, LOAD_GLOBAL, DEFINE_GLOBAL, DEFINE_LOCAL, STORE_LOCAL, ENTER_LET, \
+    LEAVE_LET, JUMP, JUMP_IF_FALSE, MAKE_CLOSURE, CALL, TAIL_CALL, RETURN, BINARY, MATH, ATOM, EQ, \
+    CONS, EMPTY, HEAD, TAIL, RAISE
+
+"""
+This is the virtual machine, executing the Code objects made in `bytecode.py`.
+
+The machine is a single loop over the instructions. Values are passed on one
+stack shared by all functions. Calls do not recurse in Python: the caller's
+code, position and frame are pushed on a call stack instead, and popped again
+by RETURN. Tail calls replace the running function without pushing anything,
+so tail recursion runs in constant space, and any other recursion is only
+limited by memory.
+
+Closures made by the other engines have no bytecode. It is compiled the first
+time the machine calls them, and kept in `closure.bytecode`.
+
+Since all of the state of the machine is in a Machine object, and none in the
+Python stack, it can be stopped between any two instructions, and go on later.
+Given a budget, `Machine.run` stops after that many calls, which is how `aio`
+gives the event loop a turn during long computations.
+
+This is paid for in speed: dispatching every instruction in Python makes the
+machine slower than the closures of `compiler.py`, which stays the default
+engine. Use the machine for deep recursion, or for code that must be paused.
+"""
+
+# Returned by Machine.run when it stops before the code has returned.
+PAUSED = object()
+
+
+def run(ast, env):
+    """
+    Compile ast to bytecode and execute it in env.
+    :param ast: list or atom
+    :param env: Environment
+    :return:    the value of ast
+    """
+    return execute(compile_bytecode(ast), env)
+
+
+def execute(code, env):
+    """
+    Execute top level code in env.
+    :param code: Code
+    :param env:  Environment
+    :return:     the value on top of the stack once the code returns
+    """
+    return Machine(code, env).run()
+
+
+class Machine(object):
+    """
+    An execution of top level code: the code running and the position in it, its frame,
+    and the value and call stacks.
+
+    Made asynchronous, the machine stops at calls to an AsyncBuiltin, leaving the awaitable
+    it returned in `awaiting`. Whoever runs the machine awaits it, and passes the result to
+    `resume` before running the machine again.
+    """
+    __slots__ = ('code', 'pc', 'env', 'stack', 'calls', 'asynchronous', 'awaiting')
+
+    def __init__(self, code, env, asynchronous=False):
+        self.code = code
+        self.pc = 0
+        self.env = env
+        self.stack = []
+        self.calls = []
+        self.asynchronous = asynchronous
+        self.awaiting = None
+
+    def resume(self, value):
+        """Go on with value as the result of the call to the AsyncBuiltin that was awaited."""
+        self.awaiting = None
+        self.stack.append(value)
+
+    def run(self, budget=None):
+        """
+        Execute the code until it returns, or budget more calls are about to be made, or an
+        asynchronous machine calls an AsyncBuiltin. Without budget, calls are not counted.
+        :param budget: positive integer, or None
+        :return:       the value on top of the stack once the code returns, or PAUSED
+        """
+        stack = self.stack
+        calls = self.calls
+        code = self.code
+        env = self.env
+        instructions = code.instructions
+        constants = code.constants
+        pc = self.pc
+
+        while True:
+            op = instructions[pc]
+            arg = instructions[pc + 1]
+            pc += 2
+
+            if op == LOAD_LOCAL:
+                value = env.values[arg]
+                stack.append(value if value is not None else env.parent.lookup(env.names[arg]))
+
+            elif op == CONST:
+                stack.append(constants[arg])
+
+            elif op == LOAD_GLOBAL:
+                name, depth, cache = constants[arg]
+
+                if depth == 1:
+                    target = env.parent
+                else:
+                    target = env
+                    for _ in range(depth):
+                        target = target.parent
+
+                cached_env, version, value = cache[0]
+
+                if cached_env is not target or version != Environment.version:
+                    # Replaced in one go, so that other threads see either all of it or none.
+                    version = Environment.version
+                    value = target.lookup(name)
+                    cache[0] = (target, version, value)
+
+                stack.append(value)
+
+            elif op == BINARY:
+                r_operand = stack.pop()
+                l_operand = stack[-1]
+                name, function = constants[arg]
+
+                if type(l_operand) in NUMBER_TYPES and type(r_operand) in NUMBER_TYPES:
+                    stack[-1] = function(l_operand, r_operand)
+                else:
+                    stack[-1] = math_operation(name, [l_operand, r_operand])
+
+            elif op == JUMP_IF_FALSE:
+                if not stack.pop():
+                    pc = arg
+
+            elif op == JUMP:
+                pc = arg
+
+            elif op == CALL or op == TAIL_CALL:
+                if budget is not None:
+                    budget -= 1
+
+                    if budget < 0:
+                        self.code, self.pc, self.env = code, pc - 2, env
+                        return PAUSED
+
+                if arg:
+                    args = stack[-arg:]
+                    del stack[-arg:]
+                else:
+                    args = []
+
+                closure = stack.pop()
+
+                if type(closure) is Builtin:
+                    stack.append(apply_builtin(closure, args))
+                    continue
+
+                if not isinstance(closure, Closure):
+                    if type(closure) is AsyncBuiltin and self.asynchronous:
+                        if not closure.min_args <= arg <= closure.max_args:
+                            raise arity_error(closure, arg)
+
+                        self.awaiting = closure.coroutine_function(*args)
+                        self.code, self.pc, self.env = code, pc, env
+                        return PAUSED
+
+                    if isinstance(closure, Builtin):
+                        stack.append(apply_builtin(closure, args))
+                        continue
+
+                    raise LispError('Not a function {}.'.format(closure))
+
+                if arg != len(closure.params):
+                    raise LispError('wrong number of arguments, expected %d got %d' % (len(closure.params), arg))
+
+                memo = None
+
+                if closure.memo is not None:
+                    key = memo_key(args)
+                    value = closure.memo.get(key)
+
+                    if value is not MISSING:
+                        stack.append(value)
+                        continue
+
+                    # The RETURN of this call stores the result. Tail calls do not return
+                    # here, so they are made as ordinary calls.
+                    memo = (closure.memo, key)
+                    op = CALL
+
+                if op == CALL:
+                    calls.append((code, pc, env, memo))
+
+                code = closure.bytecode
+                if code is None:
+                    code = closure.bytecode = compile_function(closure.params, closure.body, None)
+
+                instructions = code.instructions
+                constants = code.constants
+                pc = 0
+
+                if code.param_slots is None and arg == len(code.names):
+                    env = Frame(code.names, args, closure.env)
+                else:
+                    env = Frame(code.names, enter(code, args), closure.env)
+
+            elif op == RETURN:
+                if not calls:
+                    return stack.pop()
+
+                code, pc, env, memo = calls.pop()
+                instructions = code.instructions
+                constants = code.constants
+
+                if memo is not None:
+                    memo[0].put(memo[1], stack[-1])
+
+            elif op == LOAD_OUTER:
+                depth, slot, name = constants[arg]
+                target = env
+                for _ in range(depth):
+                    target = target.parent
+
+                value = target.values[slot]
+                stack.append(value if value is not None else target.parent.lookup(name))
+
+            elif op == EMPTY:
+                stack[-1] = empty(stack[-1])
+
+            elif op == HEAD:
+                stack[-1] = head(stack[-1])
+
+            elif op == TAIL:
+                stack[-1] = tail(stack[-1])
+
+            elif op == CONS:
+                container = stack.pop()
+                stack[-1] = cons(stack[-1], container)
+
+            elif op == EQ:
+                expr2 = stack.pop()
+                stack[-1] = eq(stack[-1], expr2)
+
+            elif op == ATOM:
+                stack[-1] = is_atom(stack[-1])
+
+            elif op == MATH:
+                name, count = constants[arg]
+                operands = stack[-count:]
+                del stack[-count:]
+                stack.append(math_operation(name, operands))
+
+            elif op == ENTER_LET:
+                env = Frame(constants[arg], [None] * len(constants[arg]), env)
+
+            elif op == STORE_LOCAL:
+                env.values[arg] = stack.pop()
+
+            elif op == LEAVE_LET:
+                env = env.parent
+
+            elif op == MAKE_CLOSURE:
+                function = constants[arg]
+                closure = Closure(env, function.params, function.body)
+                closure.bytecode = function
+                stack.append(closure)
+
+            elif op == DEFINE_LOCAL:
+                env.define_slot(arg, named(stack.pop(), env.names[arg]))
+                stack.append(env.names[arg])
+
+            elif op == DEFINE_GLOBAL:
+                env.set(constants[arg], named(stack.pop(), constants[arg]))
+                stack.append(constants[arg])
+
+            elif op == RAISE:
+                raise constants[arg]
+
+            else:
+                raise LispError("Unknown instruction %d at %d." % (op, pc - 2))
+
+
+def enter(code, args):
+    """
+    The slot values of a new frame for code, called with args.
+    """
+    values = args + [None] * (len(code.names) - len(args))
+
+    if code.param_slots is None:
+        return values
+
+    values = [None] * len(code.names)
+    for slot, arg in zip(code.param_slots, args):
+        values[slot] = arg
+
+    return values
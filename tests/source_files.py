@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+
+import shutil
+import tempfile
+
+from os.path import join
+
+"""
+Fixtures for the tests of files cached next to their source: each test gets a
+temporary directory, given to `with_setup`, and writes its sources in there.
+"""
+
+directory = None
+
+
+def make_directory():
+    global directory
+    directory = tempfile.mkdtemp()
+
+
+def remove_directory():
+    shutil.rmtree(directory)
+
+
+def write_source(source):
+    filename = join(directory, "program.diy")
+    with open(filename, "w") as sourcefile:
+        sourcefile.write(source)
+
+    return filename
@@ -2,8 +2,8 @@
 
 from nose.tools import assert_equals, assert_raises_regexp
 
-from diylisp.parser import parse, unparse
-from diylisp.types import LispError
+from diylisp.parser import parse, parse_multiple, unparse
+from diylisp.types import LispError, String
 
 
 def test_parse_single_symbol():
@@ -159,3 +159,31 @@ def test_expand_crazy_quote_combo():
 
     source = "'(this ''''(makes ''no) 'sense)"
     assert_equals(source, unparse(parse(source)))
+
+
+def test_parse_errors_report_position():
+    """Parse errors tell on which line and column the problem is."""
+
+    with assert_raises_regexp(LispError, 'Incomplete expression.*line 3, column 5'):
+        parse('(foo\n    (bar x y)\n    (baz')
+
+    with assert_raises_regexp(LispError, 'Expected EOF.*line 1, column 16'):
+        parse('(foo (bar x y)))')
+
+
+def test_parse_multiple_expressions():
+    source = """
+        (define x 1) ; comment at the end, without newline
+        'x "a string ; with no comment" (x)"""
+    expected = [['define', 'x', 1], ['quote', 'x'], String("a string ; with no comment"), ['x']]
+    assert_equals(expected, parse_multiple(source))
+
+
+def test_parse_deeply_nested_expression():
+    """Nesting is handled with an explicit stack, not by recursion."""
+
+    depth = 5000
+    ast = parse("(" * depth + "x" + ")" * depth)
+    for _ in range(depth):
+        ast = ast[0]
+    assert_equals("x", ast)
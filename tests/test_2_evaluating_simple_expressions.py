@@ -98,3 +98,26 @@ def test_math_operators_only_work_on_numbers():
         evaluate(parse("(/ 1 'foo)"), Environment())
     with assert_raises(LispError):
         evaluate(parse("(mod 1 'foo)"), Environment())
+
+
+def test_math_operators_take_any_number_of_arguments():
+    """Arithmetic folds from the left, and comparisons are chained."""
+
+    assert_equals(10, evaluate(parse("(+ 1 2 3 4)"), Environment()))
+    assert_equals(-5, evaluate(parse("(- 5)"), Environment()))
+    assert_equals(2, evaluate(parse("(/ 20 5 2)"), Environment()))
+    assert_equals(True, evaluate(parse("(< 1 2 3)"), Environment()))
+    assert_equals(False, evaluate(parse("(< 1 3 2)"), Environment()))
+    assert_equals(True, evaluate(parse("(>= 3 3 1)"), Environment()))
+
+
+def test_division_by_zero_raises_lisp_error():
+    with assert_raises(LispError):
+        evaluate(parse("(/ 1 0)"), Environment())
+    with assert_raises(LispError):
+        evaluate(parse("(mod 1 0)"), Environment())
+
+
+def test_math_on_booleans_raises_lisp_error():
+    with assert_raises(LispError):
+        evaluate(parse("(+ #t 1)"), Environment())
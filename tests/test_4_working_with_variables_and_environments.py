@@ -145,3 +145,25 @@ def test_variable_lookup_after_define():
     env = Environment()
     evaluate(parse("(define foo (+ 2 2))"), env)
     assert_equals(4, evaluate("foo", env))
+
+
+def test_extended_environment_shares_outer_bindings():
+    """Extending does not copy the outer bindings, so later definitions are visible."""
+
+    env = Environment({"foo": 1})
+    extended = env.extend({"bar": 2})
+    env.set("baz", 3)
+
+    assert_equals({"bar": 2}, extended.bindings)
+    assert_equals(3, extended.lookup("baz"))
+
+
+def test_set_only_checks_the_innermost_frame():
+    """Defining a variable in an extended environment shadows the outer one."""
+
+    env = Environment({"foo": 1})
+    extended = env.extend()
+    extended.set("foo", 2)
+
+    assert_equals(2, extended.lookup("foo"))
+    assert_equals(1, env.lookup("foo"))
@@ -261,3 +261,18 @@ def test_calling_function_recursively():
 
     assert_equals(42, evaluate(parse("(my-fn 0)"), env))
     assert_equals(42, evaluate(parse("(my-fn 10)"), env))
+
+
+def test_calling_function_leaves_ast_unchanged():
+    """Evaluating a call must not modify the AST, so that it can be evaluated again."""
+
+    env = Environment()
+    evaluate(parse("(define inc (lambda (x) (+ x 1)))"), env)
+    ast = parse("(inc 1)")
+
+    assert_equals(2, evaluate(ast, env))
+    assert_equals(["inc", 1], ast)
+
+    other_env = Environment()
+    evaluate(parse("(define inc (lambda (x) (+ x 100)))"), other_env)
+    assert_equals(101, evaluate(ast, other_env))
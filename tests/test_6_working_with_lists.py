@@ -1,11 +1,11 @@
 # -*- coding: utf-8 -*-
 
-from nose.tools import assert_equals, assert_raises, assert_raises_regexp, \
+from nose.tools import assert_equals, assert_raises, assert_raises_regexp, assert_true, \
     assert_false, assert_is_instance
 
 from diylisp.evaluator import evaluate
 from diylisp.parser import parse
-from diylisp.types import LispError, Environment
+from diylisp.types import LispError, Environment, ConsList
 
 
 def test_creating_lists_by_quoting():
@@ -96,3 +96,21 @@ def test_getting_empty_from_value():
 
     with assert_raises(LispError):
         evaluate(parse("(empty 321)"), Environment())
+
+
+def test_lists_are_cons_lists():
+    """List values are ConsLists, where `cons` and `tail` share cells instead of copying."""
+
+    env = Environment({"lst": evaluate(parse("'(1 2 3)"), Environment())})
+    assert_is_instance(env.lookup("lst"), ConsList)
+
+    assert_true(evaluate(parse("(tail lst)"), env) is env.lookup("lst").tail)
+    assert_true(evaluate(parse("(cons 0 lst)"), env).tail is env.lookup("lst"))
+    assert_equals([[1, 2], 3], evaluate(parse("'((1 2) 3)"), Environment()).to_python())
+
+
+def test_python_lists_are_accepted_as_values():
+    env = Environment({"lst": [1, 2, 3]})
+    assert_equals([0, 1, 2, 3], evaluate(parse("(cons 0 lst)"), env))
+    assert_equals(1, evaluate(parse("(head lst)"), env))
+    assert_equals([2, 3], evaluate(parse("(tail lst)"), env))
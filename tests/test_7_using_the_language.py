@@ -8,7 +8,7 @@ from diylisp.types import Environment
 
 env = Environment()
 path = join(dirname(relpath(__file__)), '..', 'stdlib.diy')
-interpret_file(path, env)
+interpret_file(path, env, cache=False)
 
 """
 Consider these tests as suggestions for what a standard library for
@@ -16,7 +16,7 @@ def prepare_env():
     global env
     env = Environment()
     path = join(dirname(relpath(__file__)), '..', 'stdlib.diy')
-    interpret_file(path, env)
+    interpret_file(path, env, cache=False)
 
 """
 In this last part, we provide tests for some suggestions on how to improve
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+import sys
+
+from nose import SkipTest
+from nose.tools import assert_equals, assert_raises, assert_raises_regexp, assert_true
+
+if sys.version_info < (3, 5):
+    raise SkipTest("asyncio is only used on Python 3")
+
+import asyncio
+
+from diylisp.aio import async_builtin, interpret_async
+from diylisp.builtins import BUILTINS
+from diylisp.interpreter import interpret, ENGINES
+from diylisp.types import AsyncBuiltin, Environment, LispError
+
+"""
+Lisp programs run in an asyncio event loop give the other tasks a turn while
+they run, and can await Python coroutine functions registered as builtins.
+
+The tests are written without `async def`, so that Python 2 can still read
+this file, and skip it.
+"""
+
+LOOP = "(define loop (lambda (n) (if (eq n 0) 'done (loop (- n 1)))))"
+
+
+def run(coroutine, loop=None):
+    loop = loop or asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def later(value):
+    """An awaitable giving value once the event loop has had a turn"""
+    future = asyncio.get_event_loop().create_future()
+    future.get_loop().call_soon(future.set_result, value)
+    return future
+
+
+def test_same_results_as_interpret():
+    env = Environment()
+    run(interpret_async("(define fact (lambda (n) (if (eq n 0) 1 (* n (fact (- n 1))))))", env))
+
+    assert_equals("3628800", run(interpret_async("(fact 10)", env)))
+    assert_equals("3628800", interpret("(fact 10)", env))
+
+
+def test_other_tasks_run_meanwhile():
+    env = Environment()
+    interpret(LOOP, env)
+    loop = asyncio.new_event_loop()
+    ticks = []
+
+    def tick():
+        ticks.append(len(ticks))
+        loop.call_soon(tick)
+
+    loop.call_soon(tick)
+
+    assert_equals("done", run(interpret_async("(loop 10000)", env, budget=100), loop))
+    assert_true(len(ticks) > 50)
+
+
+def test_timeout():
+    env = Environment()
+    interpret("(define forever (lambda (n) (forever (+ n 1))))", env)
+
+    with assert_raises(asyncio.TimeoutError):
+        run(interpret_async("(forever 0)", env, timeout=0.05))
+
+
+def test_cancellation():
+    env = Environment()
+    interpret("(define forever (lambda (n) (forever (+ n 1))))", env)
+
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(interpret_async("(forever 0)", env))
+    loop.call_later(0.01, task.cancel)
+
+    with assert_raises(asyncio.CancelledError):
+        run(task, loop)
+
+
+def test_budget_must_be_positive():
+    with assert_raises_regexp(LispError, "budget"):
+        run(interpret_async("1", budget=0))
+
+
+def test_awaiting_async_builtins():
+    @async_builtin("double-later", 1)
+    def double_later(x):
+        return later(2 * x)
+
+    try:
+        env = Environment()
+        run(interpret_async("(define double (builtin double-later (lambda (x) (* 2 x))))", env))
+        interpret("(define twice (lambda (f x) (f (f x))))", env)
+
+        assert_equals("44", run(interpret_async("(+ (double 20) (twice double 1))", env)))
+
+        with assert_raises_regexp(LispError, "wrong number of arguments"):
+            run(interpret_async("(double 1 2)", env))
+    finally:
+        del BUILTINS["double-later"]
+
+
+def check_async_builtins_need_interpret_async(engine):
+    env = Environment({"noop": AsyncBuiltin("noop", lambda: later(None), 0)})
+
+    with assert_raises_regexp(LispError, "noop is asynchronous"):
+        interpret("(noop)", env, engine)
+
+
+def test_async_builtins_need_interpret_async():
+    for engine in ENGINES:
+        yield check_async_builtins_need_interpret_async, engine
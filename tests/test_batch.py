@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+import pickle
+import threading
+
+from nose.tools import assert_equals, assert_true, assert_is_none, assert_raises_regexp
+
+from diylisp import interpreter
+from diylisp.interpreter import interpret, interpret_batch, interpret_file, interpret_many, ENGINES
+from diylisp.types import Environment, LispError
+
+"""
+A batch of independent sources is run against a shared environment, each in
+an environment of its own extending it, one after the other or on a pool of
+threads. The shared environment can be frozen, so that nothing adds to it.
+"""
+
+
+def base_environment(engine):
+    env = Environment()
+    interpret("(define square (lambda (x) (* x x)))", env, engine)
+    return env
+
+
+def check_batch(engine):
+    env = base_environment(engine)
+    results = interpret_batch(["(square 3)", "(define x 1)", "x", "(square 4)"], env, engine)
+
+    assert_equals(["9", "x", None, "16"], [result.value for result in results])
+    assert_is_none(results[0].error)
+    assert_true(isinstance(results[2].error, LispError))
+
+
+def test_batch_on_every_engine():
+    for engine in ENGINES:
+        yield check_batch, engine
+
+
+def test_definitions_do_not_leak_between_sources():
+    env = base_environment("compiler")
+    results = interpret_batch(["(define square 1)", "(define y 2)", "(define y 3)", "(square 5)"], env)
+
+    assert_equals(["square", "y", "y", "25"], [result.value for result in results])
+    assert_equals(["square"], list(env.bindings))
+
+
+def test_errors_do_not_stop_the_batch():
+    results = interpret_batch(["(+ 1", "(/ 1 0)", "(+ 1 1)"])
+
+    assert_equals([None, None, "2"], [result.value for result in results])
+    assert_true("unclosed list" in str(results[0].error))
+    assert_true("Division by zero" in str(results[1].error))
+
+
+def test_repeated_sources_are_prepared_once():
+    source = "(+ 40 2 0)"
+    interpret_batch([source] * 10, optimize=True)
+    misses = interpreter.PROGRAMS.misses
+    results = interpret_batch([source] * 10, optimize=True)
+
+    assert_equals(["42"] * 10, [result.value for result in results])
+    assert_equals(misses, interpreter.PROGRAMS.misses)
+
+
+def test_frozen_environments_are_read_only():
+    base = Environment({"x": 1})
+    env = base.extend().freeze()
+
+    assert_true(base.frozen)
+
+    with assert_raises_regexp(LispError, "frozen"):
+        interpret("(define y 2)", env)
+
+    with assert_raises_regexp(LispError, "frozen"):
+        interpret("(define y 2)", base, "vm")
+
+    child = env.extend()
+    interpret("(define y 2)", child)
+
+    assert_equals("3", interpret("(+ x y)", child))
+    assert_equals(["x"], list(base.bindings))
+
+
+def test_frozen_environments_stay_frozen_when_pickled():
+    env = pickle.loads(pickle.dumps(Environment({"x": 1}).freeze(), 2))
+
+    with assert_raises_regexp(LispError, "frozen"):
+        env.set("y", 2)
+
+
+def check_interpret_many(engine):
+    env = Environment()
+    interpret_file("stdlib.diy", env, engine, cache=False)
+    env.freeze()
+
+    sources = ["(sum (range 0 %d))" % n for n in range(50)] + ["(define sum 1)", "(head '())"]
+    results = interpret_many(sources, env, engine, workers=4)
+
+    assert_equals([str(n * (n + 1) // 2) for n in range(50)] + ["sum", None],
+                  [result.value for result in results])
+    assert_true(isinstance(results[-1].error, LispError))
+
+
+def test_interpret_many_on_every_engine():
+    for engine in ENGINES:
+        yield check_interpret_many, engine
+
+
+def test_interpret_many_expects_workers():
+    with assert_raises_regexp(LispError, "positive number of workers"):
+        interpret_many(["1"], workers=0)
+
+
+def test_thread_pools_are_closed():
+    """The pools interpret_many starts are shut down by close_pool, which runs at exit"""
+
+    threads = threading.active_count()
+    pool = interpreter.ThreadPool(2)
+    assert_true(threading.active_count() > threads)
+
+    interpreter.close_pool(pool)
+    assert_equals(threads, threading.active_count())
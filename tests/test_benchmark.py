@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import json
+import shutil
+import tempfile
+
+from nose import SkipTest
+from nose.tools import assert_equals, assert_true
+from os.path import join
+
+from diylisp import benchmark
+
+"""
+The benchmark suite is not run here, only the machinery around it: running
+selected workloads, saving the results and comparing them with a baseline.
+"""
+
+
+def test_workloads_are_registered():
+    names = [name for name, setup in benchmark.BENCHMARKS]
+
+    for name in ["fact", "fib", "sort-100", "map-5000", "reduce-1000", "let-nesting", "parse", "repl-startup",
+                 "closure-calls", "string-ops", "batch"]:
+        assert_true(name in names)
+
+
+def test_run_selected_workloads():
+    results = benchmark.run(["fact", "sort-100"], repeat=1)
+
+    assert_equals(["fact", "sort-100"], sorted(results))
+    assert_true(results["fact"]["time"] >= 0)
+
+
+def test_memory_per_operation():
+    if benchmark.tracemalloc is None:
+        raise SkipTest("No tracemalloc on this Python")
+
+    results = benchmark.run(["string-ops"], repeat=1)
+    assert_true(results["string-ops"]["peak_per_operation"] > 0)
+
+
+def test_run_on_another_engine():
+    results = benchmark.run(["let-nesting"], engine="vm", repeat=1)
+    assert_true(results["let-nesting"]["time"] >= 0)
+
+
+def test_compare_with_baseline():
+    baseline = {"fast": {"time": 1.0}, "slow": {"time": 1.0}, "removed": {"time": 1.0}}
+    results = {"fast": {"time": 1.05}, "slow": {"time": 1.5}, "added": {"time": 9.0}}
+
+    assert_equals([("slow", 1.0, 1.5)], benchmark.compare(results, baseline, 0.1))
+    assert_equals([], benchmark.compare(results, baseline, 0.6))
+
+
+def test_main_saves_and_compares_results():
+    directory = tempfile.mkdtemp()
+    try:
+        output = join(directory, "results.json")
+        assert_equals(0, benchmark.main(["fact", "--repeat", "1", "--output", output]))
+
+        with open(output) as results:
+            saved = json.load(results)
+
+        assert_equals(["fact"], list(saved["results"]))
+        assert_equals("compiler", saved["engine"])
+
+        # Pretend the baseline was a lot faster.
+        saved["results"]["fact"]["time"] /= 100.0
+        baseline = join(directory, "baseline.json")
+        with open(baseline, "w") as baselinefile:
+            json.dump(saved, baselinefile)
+
+        assert_equals(1, benchmark.main(["fact", "--repeat", "1", "--baseline", baseline]))
+    finally:
+        shutil.rmtree(directory)
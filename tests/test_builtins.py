@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+import random
+import threading
+import time
+
+from nose.tools import assert_equals, assert_raises_regexp, assert_true
+from os.path import dirname, relpath, join
+
+from diylisp import builtins
+from diylisp.builtins import BUILTINS
+from diylisp.evaluator import evaluate
+from diylisp.interpreter import interpret, interpret_file
+from diylisp.parser import parse
+from diylisp.types import Builtin, Closure, Environment, LispError
+
+"""
+The list functions of the standard library are bound to builtins, implemented in
+Python. These tests check them against the Lisp definitions in `stdlib.diy`,
+which are loaded into a separate environment with no builtins registered.
+"""
+
+path = join(dirname(relpath(__file__)), '..', 'stdlib.diy')
+
+env = Environment()
+interpret_file(path, env, cache=False)
+
+reference_env = Environment()
+registered = dict(BUILTINS)
+BUILTINS.clear()
+try:
+    interpret_file(path, reference_env, cache=False)
+finally:
+    BUILTINS.update(registered)
+
+
+def assert_same_as_reference(source):
+    assert_equals(interpret(source, reference_env), interpret(source, env))
+
+
+def assert_same_error_as_reference(source):
+    errors = []
+
+    for environment in [reference_env, env]:
+        try:
+            interpret(source, environment)
+        except LispError as e:
+            errors.append(str(e))
+
+    assert_equals(2, len(errors), "%s did not fail on both" % source)
+    assert_equals(errors[0], errors[1])
+
+
+def test_stdlib_binds_builtins():
+    """The list functions of the stdlib are builtins, the reference ones are closures"""
+
+    for name in ["length", "sum", "range", "append", "reverse", "map", "pmap", "filter",
+                 "reduce", "slice", "merge", "sort"]:
+        assert_true(isinstance(env.lookup(name), Builtin))
+        assert_true(isinstance(reference_env.lookup(name), Closure))
+
+    assert_equals("<builtin/length>", interpret("length", env))
+
+
+def test_builtins_match_reference_definitions():
+    interpret("(define inc (lambda (x) (+ x 1)))", env)
+    interpret("(define inc (lambda (x) (+ x 1)))", reference_env)
+
+    for source in ["(length '(1 2 3 4 5))",
+                   "(length '())",
+                   "(sum '(1 2 3 4))",
+                   "(sum '())",
+                   "(range 1 5)",
+                   "(range 2 1)",
+                   "(append '(1 2) '(3 4 5))",
+                   "(append '() '())",
+                   "(reverse '(1 2 3 4))",
+                   "(map inc '(1 2 3))",
+                   "(pmap inc '(1 2 3))",
+                   "(filter (lambda (x) (eq (mod x 2) 0)) '(1 2 3 4 5 6))",
+                   "(reduce (lambda (a b) (if (> a b) a b)) 0 '(1 6 3 2))",
+                   "(slice '(0 1 2 3 4 5) 1 3)",
+                   "(slice '(0 1 2 3 4 5) 0 0)",
+                   "(slice '(0 1 2 3 4 5) 3 2)",
+                   "(slice '(0 1 2 3 4 5) 4 1)",
+                   "(slice '(0 1 2 3 4 5) (- 2) 1)",
+                   "(slice '(0 1 2) 1 10)",
+                   "(slice '(0 1 2 3) 1 (- 5))",
+                   "(merge '(1 3 5) '(2 2 4 6))",
+                   "(sort '(6 3 7 2 4 1 5))",
+                   "(sort '(1 1 1))",
+                   "(sort '())",
+                   "(length \"abc\")",
+                   "(append '() 5)",
+                   "(append \"ab\" '(1))",
+                   "(append '(1) \"ab\")",
+                   "(append \"ab\" \"cd\")",
+                   "(reverse \"abc\")",
+                   "(reverse \"\")",
+                   "(map inc '())",
+                   "(map (lambda (c) (cons c c)) \"ab\")",
+                   "(filter (lambda (c) (eq c \"b\")) \"abc\")",
+                   "(reduce (lambda (acc c) (cons c acc)) '() \"abc\")",
+                   "(slice \"abcd\" 1 2)",
+                   "(slice '() 'a 'b)",
+                   "(merge \"ab\" \"\")",
+                   "(sort \"a\")"]:
+        yield assert_same_as_reference, source
+
+
+def test_builtins_fail_like_reference_definitions():
+    for source in ["(length 5)",
+                   "(sum 5)",
+                   "(sum '(1 a b))",
+                   "(sum \"ab\")",
+                   "(range 'a 2)",
+                   "(append '(1) 5)",
+                   "(append 5 '(1))",
+                   "(reverse 5)",
+                   "(map inc 5)",
+                   "(filter inc 5)",
+                   "(reduce inc 0 5)",
+                   "(slice 5 0 1)",
+                   "(slice '(1 2) 'a 1)",
+                   "(slice '(1 2) 0 'b)",
+                   "(merge '(1) 5)",
+                   "(merge \"ab\" \"cd\")",
+                   "(sort 5)",
+                   "(sort '(3 a))",
+                   "(sort '(3 1 b 2 a))",
+                   "(sort \"cab\")"]:
+        yield assert_same_error_as_reference, source
+
+
+def test_builtins_accept_builtins_as_arguments():
+    assert_equals("(3 0 2)", interpret("(map length '((1 2 3) () (4 5)))", env))
+    assert_equals("6", interpret("(reduce (lambda (acc lst) (+ acc (sum lst))) 0 '((1 2) (3)))", env))
+
+
+def test_pmap_in_worker_processes():
+    """pmap gives the results of map, in order, however the list is split among the workers"""
+
+    interpret("(defn fib (n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))", env)
+    expected = interpret("(map fib (range 0 15))", env)
+
+    for chunk_size, workers in [(1, 2), (4, 2), (7, 3), (100, 2)]:
+        assert_equals(expected, interpret("(pmap fib (range 0 15) %d %d)" % (chunk_size, workers), env))
+
+    assert_equals("((1 a) (2 a) (3 a))",
+                  interpret("(let ((tag 'a)) (pmap (lambda (x) (cons x (cons tag '()))) '(1 2 3) 1 2))", env))
+    assert_equals("(1 0 2)", interpret("(pmap length '((1) () (2 3)) 1 2)", env))
+
+
+def test_pmap_errors():
+    with assert_raises_regexp(LispError, "Division by zero"):
+        interpret("(pmap (lambda (x) (/ 10 x)) '(2 1 0 5) 1 2)", env)
+
+    with assert_raises_regexp(LispError, "positive chunk size"):
+        interpret("(pmap inc '(1 2) 0)", env)
+
+    with assert_raises_regexp(LispError, "positive chunk size"):
+        interpret("(pmap inc '(1 2) 1 #t)", env)
+
+
+def test_pmap_pool_is_shared_between_threads():
+    """Threads starting pmap at the same time get one pool between them"""
+
+    pools = []
+    threads = [threading.Thread(target=lambda: pools.append(builtins.worker_pool(3))) for _ in range(8)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert_equals(8, len(pools))
+    assert_true(all(pool is builtins.pools[3] for pool in pools))
+
+
+def test_sort_takes_one_argument_like_reference():
+    for environment in [reference_env, env]:
+        with assert_raises_regexp(LispError, "wrong number of arguments"):
+            interpret("(sort '(2 1) (lambda (a b) (< a b)))", environment)
+
+
+def test_sort_large_list():
+    """Sorting 2000 elements should be fast"""
+
+    values = [random.randint(0, 10000) for _ in range(2000)]
+    source = "(sort '(%s))" % " ".join(str(value) for value in values)
+
+    start = time.time()
+    result = interpret(source, env)
+    assert_true(time.time() - start < 1)
+    assert_equals("(%s)" % " ".join(str(value) for value in sorted(values)), result)
+
+
+def test_builtin_errors():
+    with assert_raises_regexp(LispError, "wrong number of arguments"):
+        interpret("(length '(1) '(2))", env)
+
+    with assert_raises_regexp(LispError, "not a number"):
+        interpret("(sort '(2 #t 1))", env)
+
+    with assert_raises_regexp(LispError, "can't apply empty"):
+        interpret("(reverse 1)", env)
+
+
+def test_builtin_form_in_evaluate():
+    """The tree-walking evaluator resolves builtins too, and calls them like closures"""
+
+    local_env = Environment()
+    evaluate(parse("(define length (builtin length (lambda (lst) 0)))"), local_env)
+    evaluate(parse("(define size (builtin no-such-builtin (lambda (lst) 42)))"), local_env)
+
+    assert_equals(BUILTINS["length"], local_env.lookup("length"))
+    assert_equals(3, evaluate(parse("(length '(1 2 3))"), local_env))
+    assert_equals(42, evaluate(parse("(size '(1 2 3))"), local_env))
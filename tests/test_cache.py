@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+import stat
+
+from nose.tools import assert_equals, assert_true, assert_false, assert_raises_regexp, with_setup
+from os.path import join, exists
+
+import source_files
+from source_files import make_directory, remove_directory, write_source
+
+from diylisp import cache
+from diylisp.cache import cache_path, parse_file
+from diylisp.interpreter import interpret_file
+from diylisp.parser import parse_multiple, parse_stream
+from diylisp.types import Environment, LispError, String, Symbol
+
+"""
+The AST cache stores the parsed ASTs of a lisp file, and they are read from
+there instead of parsing the file again as long as it has not changed.
+"""
+
+
+def fail(stream):
+    raise AssertionError("parsed the file again")
+
+
+SOURCE = """
+(define greet (lambda (name) (cons "hello " name)))
+(define xs '(1 #t "two" (three)))
+(greet "world")
+"""
+
+
+@with_setup(make_directory, remove_directory)
+def test_cache_is_written_and_used():
+    filename = write_source(SOURCE)
+
+    assert_equals(parse_multiple(SOURCE), list(parse_file(filename)))
+    assert_true(exists(cache_path(filename)))
+
+    cache.parse_stream = fail
+    try:
+        asts = list(parse_file(filename))
+        assert_equals('"hello world"', interpret_file(filename, Environment()))
+    finally:
+        cache.parse_stream = parse_stream
+
+    assert_equals(parse_multiple(SOURCE), asts)
+    assert_true(type(asts[0][0]) is Symbol)
+    assert_true(asts[0][0] is parse_multiple(SOURCE)[0][0])
+    assert_true(isinstance(asts[2][1], String))
+
+
+@with_setup(make_directory, remove_directory)
+def test_many_expressions():
+    source = "".join("(define x%d %d)\n" % (n, n) for n in range(cache.BATCH_SIZE * 3 + 5))
+    filename = write_source(source)
+
+    list(parse_file(filename))
+    assert_equals(parse_multiple(source), list(parse_file(filename)))
+
+
+@with_setup(make_directory, remove_directory)
+def test_cache_is_invalidated_when_the_source_changes():
+    filename = write_source("(define answer 42) answer")
+    assert_equals("42", interpret_file(filename, Environment()))
+
+    write_source("(define answer 43) answer")
+    assert_equals("43", interpret_file(filename, Environment()))
+
+
+@with_setup(make_directory, remove_directory)
+def test_cache_is_used_when_only_the_modification_time_changes():
+    filename = write_source(SOURCE)
+    list(parse_file(filename))
+    os.utime(filename, (0, 0))
+
+    cache.parse_stream = fail
+    try:
+        assert_equals(parse_multiple(SOURCE), list(parse_file(filename)))
+    finally:
+        cache.parse_stream = parse_stream
+
+
+@with_setup(make_directory, remove_directory)
+def test_broken_cache_is_ignored():
+    filename = write_source("(define answer 42) answer")
+    list(parse_file(filename))
+
+    with open(cache_path(filename), "wb") as cachefile:
+        cachefile.write(b"garbage")
+
+    assert_equals("42", interpret_file(filename, Environment()))
+
+
+@with_setup(make_directory, remove_directory)
+def test_no_cache_for_sources_that_do_not_parse():
+    filename = write_source("(define answer 42) (answer")
+
+    with assert_raises_regexp(LispError, "Incomplete expression"):
+        interpret_file(filename, Environment())
+
+    assert_false(exists(cache_path(filename)))
+    assert_equals([], os.listdir(join(source_files.directory, cache.CACHE_DIRECTORY)))
+
+
+@with_setup(make_directory, remove_directory)
+def test_cache_file_has_the_mode_of_the_source():
+    filename = write_source(SOURCE)
+    os.chmod(filename, 0o640)
+    list(parse_file(filename))
+
+    assert_equals(0o640, stat.S_IMODE(os.stat(cache_path(filename)).st_mode))
+
+
+@with_setup(make_directory, remove_directory)
+def test_digest_is_read_in_chunks():
+    source = "(define x 1)\n" * (cache.CHUNK_SIZE // 4)
+    filename = write_source(source)
+
+    assert_equals(hashlib.sha1(source.encode()).hexdigest(), cache.digest(filename))
+
+
+@with_setup(make_directory, remove_directory)
+def test_cache_can_be_turned_off():
+    filename = write_source("(define answer 42) answer")
+
+    assert_equals("42", interpret_file(filename, Environment(), cache=False))
+    assert_false(exists(cache_path(filename)))
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import assert_equals, assert_raises_regexp, assert_is_instance, assert_true
+
+from diylisp.compiler import compile_ast
+from diylisp.interpreter import interpret
+from diylisp.parser import parse
+from diylisp.types import Closure, LispError, Environment, Frame
+
+"""
+Tests for the compiler, which turns ASTs into Python functions before running them.
+Everything `evaluate` can do, a compiled AST should do the same way.
+"""
+
+
+def run(source, env=None):
+    return compile_ast(parse(source))(env if env is not None else Environment())
+
+
+def test_compiling_atoms():
+    assert_equals(42, run("42"))
+    assert_equals(True, run("#t"))
+    assert_equals(1, run("foo", Environment({"foo": 1})))
+
+
+def test_compiled_ast_can_be_run_many_times():
+    """The compiled function does not depend on the environment it is first run in."""
+
+    code = compile_ast(parse("(+ x 1)"))
+    assert_equals(2, code(Environment({"x": 1})))
+    assert_equals(11, code(Environment({"x": 10})))
+
+
+def test_compiling_special_forms():
+    assert_equals([1, 2], run("'(1 2)"))
+    assert_equals(False, run("(atom '(1 2))"))
+    assert_equals(True, run("(eq 'foo 'foo)"))
+    assert_equals(42, run("(if (> 3 2) 42 'nope)"))
+    assert_equals(2, run("(cond ((#f 1) (#t 2)))"))
+    assert_equals(15, run("(let ((foo 10) (bar (+ foo 5))) bar)"))
+    assert_equals([0, 1], run("(cons 0 '(1))"))
+    assert_equals(1, run("(head '(1 2))"))
+    assert_equals([2], run("(tail '(1 2))"))
+    assert_equals(True, run("(empty '())"))
+
+
+def test_compiled_lambda_is_a_closure():
+    closure = run("(lambda (x y) (+ x y))")
+    assert_is_instance(closure, Closure)
+    assert_equals(["x", "y"], closure.params)
+    assert_equals(["+", "x", "y"], closure.body)
+    assert_true(closure.code is not None)
+
+
+def test_errors_are_raised_when_evaluated():
+    """Malformed expressions only fail if they are actually evaluated."""
+
+    code = compile_ast(parse("(if #t 42 (lambda (x) (y) (z)))"))
+    assert_equals(42, code(Environment()))
+
+    with assert_raises_regexp(LispError, "requires 3 arguments"):
+        run("(lambda (foo) (bar) (baz))")
+
+    with assert_raises_regexp(LispError, "Wrong number of arguments"):
+        run("(define x)")
+
+
+def test_calling_closures():
+    env = Environment()
+    run("(define fact (lambda (n) (if (eq n 0) 1 (* n (fact (- n 1))))))", env)
+    assert_equals(120, run("(fact 5)", env))
+
+    closure = run("(lambda (a b) (+ a b))")
+    assert_equals(9, compile_ast([closure, 4, 5])(Environment()))
+
+    with assert_raises_regexp(LispError, "wrong number of arguments, expected 1 got 2"):
+        run("(fact 1 2)", env)
+
+    with assert_raises_regexp(LispError, "Not a function"):
+        run("(#t 'foo)")
+
+
+def test_calling_closures_created_by_evaluate():
+    """Closures not created by the compiler get their body compiled on the first call."""
+
+    from diylisp.evaluator import evaluate
+
+    env = Environment()
+    evaluate(parse("(define add (lambda (x y) (+ x y)))"), env)
+    assert_equals("3", interpret("(add 1 2)", env))
+    assert_true(env.lookup("add").code is not None)
+
+
+def test_compiled_math():
+    assert_equals(3, run("(/ 7 2)"))
+    assert_equals(-4, run("(/ (- 7) 2)"))
+    assert_equals(10, run("(+ 1 2 3 4)"))
+    assert_equals(True, run("(<= 1 1 2)"))
+
+    with assert_raises_regexp(LispError, "not a number"):
+        run("(+ 1 'foo)")
+
+    with assert_raises_regexp(LispError, "Division by zero"):
+        run("(mod 1 0)")
+
+
+def test_local_variables_are_stored_in_frames():
+    """Arguments and let bindings get fixed slots in a Frame, looked up by position."""
+
+    closure = run("((lambda (x) (lambda (y) (+ x y))) 1)")
+    assert_is_instance(closure.env, Frame)
+    assert_equals(("x",), closure.env.names)
+    assert_equals(1, closure.env.lookup("x"))
+    assert_equals(3, compile_ast([closure, 2])(Environment()))
+
+
+def test_let_and_shadowing():
+    env = Environment({"x": 1})
+    assert_equals(3, run("(let ((x 2) (y (+ x 1))) y)", env))
+    assert_equals(4, run("(let ((x 2) (x (+ x 2))) x)", env))
+    assert_equals(1, run("((lambda (y) x) 5)", env))
+    assert_equals(6, run("((lambda (x) (let ((y 1)) ((lambda (z) (+ x (+ y z))) 3))) 2)", env))
+
+
+def test_defining_variables_in_function_body():
+    env = Environment()
+    run("(define f (lambda (x) (if (define y (+ x 1)) y 0)))", env)
+    assert_equals(6, run("(f 5)", env))
+
+    with assert_raises_regexp(LispError, "already defined"):
+        run("((lambda (x) (define x 2)) 1)")
+
+
+def test_frames_work_with_evaluate():
+    """Closures created by compiled code can be called by `evaluate`, and the other way around."""
+
+    from diylisp.evaluator import evaluate
+
+    env = Environment()
+    run("(define adder (lambda (x) (lambda (y) (+ x y))))", env)
+    assert_equals(7, evaluate(parse("((adder 3) 4)"), env))
+
+    evaluate(parse("(define twice (lambda (f x) (f (f x))))"), env)
+    assert_equals(11, run("(twice (adder 4) 3)", env))
+
+
+def test_call_site_cache_follows_bindings():
+    """A compiled call remembers the closure it called, but not past a change of bindings."""
+
+    code = compile_ast(parse("(f 1)"))
+
+    env = Environment()
+    run("(define f (lambda (x) (+ x 1)))", env)
+    assert_equals(2, code(env))
+    assert_equals(2, code(env))
+
+    other_env = Environment()
+    run("(define f (lambda (x) (+ x 100)))", other_env)
+    assert_equals(101, code(other_env))
+
+    inner_env = env.extend()
+    assert_equals(2, code(inner_env))
+    run("(define f (lambda (x) (+ x 10)))", inner_env)
+    assert_equals(11, code(inner_env))
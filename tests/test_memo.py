@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import assert_equals, assert_raises_regexp, assert_true, assert_false
+
+from diylisp.interpreter import interpret, ENGINES
+from diylisp.memo import MemoCache, MISSING, memo_key
+from diylisp.types import Closure, ConsList, Environment, LispError, String
+
+"""
+Memoized functions remember the results of earlier calls, in a bounded cache
+evicting the least recently used results first.
+"""
+
+
+def check_memoized_fib(engine):
+    env = Environment()
+    interpret("(defmemo fib (n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))", env, engine)
+
+    assert_equals("354224848179261915075", interpret("(fib 100)", env, engine))
+    # Every n from 0 to 100 is computed once, and looked up once more.
+    assert_equals("(98 101 101 1024)", interpret("(memo-stats fib)", env, engine))
+
+    assert_equals("55", interpret("(fib 10)", env, engine))
+    assert_equals("(99 101 101 1024)", interpret("(memo-stats fib)", env, engine))
+
+
+def test_defmemo_on_every_engine():
+    for engine in ENGINES:
+        yield check_memoized_fib, engine
+
+
+def check_memoize_with_max_size(engine):
+    env = Environment()
+    interpret("(define square (memoize (lambda (x) (* x x)) 2))", env, engine)
+
+    for n in [1, 2, 1, 3, 2]:
+        interpret("(square %d)" % n, env, engine)
+
+    # 3 evicts 2, the least recently used, so 2 is computed again.
+    assert_equals("(1 4 2 2)", interpret("(memo-stats square)", env, engine))
+
+
+def test_memoize_on_every_engine():
+    for engine in ENGINES:
+        yield check_memoize_with_max_size, engine
+
+
+def check_tail_calls_are_memoized(engine):
+    env = Environment()
+    interpret("(defmemo loop (n acc) (if (eq n 0) acc (loop (- n 1) (+ acc 1))))", env, engine)
+    interpret("(define start (lambda (n) (loop n 0)))", env, engine)
+
+    assert_equals("5", interpret("(start 5)", env, engine))
+    assert_equals("(0 6 6 1024)", interpret("(memo-stats loop)", env, engine))
+    assert_equals("5", interpret("(start 5)", env, engine))
+    assert_equals("(1 6 6 1024)", interpret("(memo-stats loop)", env, engine))
+
+
+def test_tail_calls_on_every_engine():
+    for engine in ENGINES:
+        yield check_tail_calls_are_memoized, engine
+
+
+def test_memoize_copies_the_closure():
+    env = Environment()
+    interpret("(define f (lambda (x) x))", env)
+    interpret("(define g (memoize f))", env)
+
+    assert_true(isinstance(env.lookup("g"), Closure))
+    assert_equals(None, env.lookup("f").memo)
+    assert_equals("(memo-stats)", interpret("'(memo-stats)", env))
+
+    with assert_raises_regexp(LispError, "Not a memoized function"):
+        interpret("(memo-stats f)", env)
+
+
+def test_memoize_errors():
+    env = Environment()
+
+    with assert_raises_regexp(LispError, "Only closures can be memoized"):
+        interpret("(memoize 42)", env)
+
+    with assert_raises_regexp(LispError, "positive number"):
+        interpret("(memoize (lambda (x) x) 0)", env)
+
+    with assert_raises_regexp(LispError, "defmemo expression requires"):
+        interpret("(defmemo f (x))", env)
+
+
+def test_memo_keys():
+    """Lists and strings are keyed by value, and booleans are not numbers"""
+
+    assert_equals(memo_key([ConsList.from_list([1, 2])]), memo_key([[1, 2]]))
+    assert_equals(memo_key([String("abc")]), memo_key([String("abc")]))
+    assert_false(memo_key([True]) == memo_key([1]))
+    assert_false(memo_key([False]) == memo_key([0]))
+
+
+def test_memo_cache():
+    cache = MemoCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert_equals(1, cache.get("a"))
+    cache.put("c", 3)
+
+    assert_equals(MISSING, cache.get("b"))
+    assert_equals(1, cache.get("a"))
+    assert_equals(3, cache.get("c"))
+    assert_equals((3, 1), (cache.hits, cache.misses))
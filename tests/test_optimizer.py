@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import assert_equals, assert_raises_regexp
+
+from diylisp.interpreter import interpret, ENGINES
+from diylisp.optimizer import optimize
+from diylisp.parser import parse, unparse
+from diylisp.types import Environment, LispError
+
+"""
+The optimizer folds constant expressions and prunes branches that can never be
+taken, without changing what a program evaluates to.
+"""
+
+
+def optimized(source):
+    return unparse(optimize(parse(source)))
+
+
+def test_folding_math():
+    assert_equals("3", optimized("(+ 1 2)"))
+    assert_equals("#t", optimized("(< (* 2 3) (+ 4 5))"))
+    assert_equals("(+ 3 x)", optimized("(+ 1 2 x)"))
+    assert_equals("(+ x 1 2)", optimized("(+ x 1 2)"))
+    assert_equals("(f 6)", optimized("(f (* 2 3))"))
+
+
+def test_folding_list_operations():
+    assert_equals("1", optimized("(head '(1 2 3))"))
+    assert_equals("'(2 3)", optimized("(tail '(1 2 3))"))
+    assert_equals("'(1 2)", optimized("(cons 1 '(2))"))
+    assert_equals("#t", optimized("(empty '())"))
+    assert_equals("#t", optimized("(eq 'a 'a)"))
+    assert_equals("#f", optimized("(atom '(1))"))
+
+
+def test_pruning_branches():
+    assert_equals("a", optimized("(if (< 1 2) a b)"))
+    assert_equals("(if x 1 2)", optimized("(if x (+ 0 1) (- 3 1))"))
+    assert_equals("b", optimized("(cond (((eq 1 2) a) (#t b)))"))
+    assert_equals("(cond ((x a) (#t b)))", optimized("(cond ((x a) (#f c) (#t b) (y d)))"))
+    assert_equals("#f", optimized("(cond ((#f a)))"))
+
+
+def test_definitions_and_bindings():
+    assert_equals("(define x 3)", optimized("(define x (+ 1 2))"))
+    assert_equals("(lambda (x) (+ x 3))", optimized("(lambda (x) (+ x (+ 1 2)))"))
+    assert_equals("(let ((a 2)) (* a 5))", optimized("(let ((a (+ 1 1))) (* a (+ 2 3)))"))
+
+
+def test_quoted_data_is_left_alone():
+    assert_equals("'(+ 1 2)", optimized("'(+ 1 2)"))
+
+
+def test_errors_are_left_for_runtime():
+    assert_equals("(/ 1 0)", optimized("(/ 1 0)"))
+    assert_equals("(head '())", optimized("(head '())"))
+    assert_equals("(if x (/ 1 0) 2)", optimized("(if x (/ 1 0) 2)"))
+
+    with assert_raises_regexp(LispError, "zero"):
+        interpret("(/ 1 0)", Environment(), optimize=True)
+
+
+def test_ast_is_not_modified():
+    ast = parse("(if (< 1 2) (+ 1 2 x) (head '(1 2)))")
+    copy = parse("(if (< 1 2) (+ 1 2 x) (head '(1 2)))")
+    optimize(ast)
+
+    assert_equals(copy, ast)
+
+
+PROGRAMS = [
+    ("(define fact (lambda (n) (if (< n 2) 1 (* n (fact (- n 1))))))", "(fact (+ 5 5))", "3628800"),
+    ("(define f (lambda (x) (cond (((eq 1 2) 0) ((< x 10) (+ 1 2 x)) (#t (* 2 3))))))", "(f 1)", "4"),
+    ("(define g (lambda (x) (let ((y (* 2 2))) (cons (+ x y) (tail '(1 2))))))", "(g 1)", "(5 2)"),
+    ("(define h (lambda (x) (if (eq (head '(a)) 'a) x 0)))", "(h 7)", "7"),
+]
+
+
+def check_program(engine, definition, call, expected):
+    for optimize in (False, True):
+        env = Environment()
+        interpret(definition, env, engine, optimize=optimize)
+        assert_equals(expected, interpret(call, env, engine, optimize=optimize))
+
+
+def test_optimized_programs_on_every_engine():
+    for engine in ENGINES:
+        for definition, call, expected in PROGRAMS:
+            yield check_program, engine, definition, call, expected
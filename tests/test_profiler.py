@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+
+from nose.tools import assert_equals, assert_true, assert_raises_regexp
+
+from diylisp import compiler
+from diylisp.interpreter import interpret, interpret_file
+from diylisp.profiler import Profiler
+from diylisp.types import Environment, LispError
+
+"""
+The profiler counts calls and measures time per Lisp function, by the name it
+was defined with, and counts the evaluations of special forms.
+"""
+
+PROGRAM = """
+(defn fib (n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))
+(define loop (lambda (n) (if (eq n 0) 'done (loop (- n 1)))))
+(define apply-twice (lambda (f x) (f (f x))))
+(loop 10)
+(apply-twice (lambda (x) (* x 2)) 1)
+(fib 5)
+"""
+
+
+def profile(source):
+    handle, filename = tempfile.mkstemp(suffix=".diy")
+    os.write(handle, source.encode("utf-8"))
+    os.close(handle)
+
+    profiler = Profiler()
+    try:
+        interpret_file(filename, Environment(), profiler=profiler, cache=False)
+    finally:
+        os.remove(filename)
+
+    return profiler
+
+
+def test_call_counts_by_defined_name():
+    profiler = profile(PROGRAM)
+
+    assert_equals(15, profiler.calls["fib"])
+    assert_equals(11, profiler.calls["loop"])
+    assert_equals(1, profiler.calls["apply-twice"])
+    assert_equals(2, profiler.calls["<lambda>"])
+
+
+def test_special_form_counts():
+    profiler = profile(PROGRAM)
+
+    assert_equals(15 + 11, profiler.forms["if"])
+    assert_equals(2, profiler.forms["define"])
+    assert_equals(1, profiler.forms["defn"])
+
+
+def test_inclusive_and_exclusive_time():
+    profiler = profile(PROGRAM)
+
+    for name in profiler.calls:
+        assert_true(0 <= profiler.exclusive[name] <= profiler.inclusive[name] + 1e-9)
+
+    assert_true(profiler.inclusive["apply-twice"] >= profiler.inclusive["<lambda>"])
+
+
+def test_collapsed_stacks():
+    profiler = profile(PROGRAM)
+    paths = [line.rsplit(" ", 1)[0] for line in profiler.collapsed()]
+
+    assert_true("fib;fib;fib" in paths)
+    assert_true("apply-twice;<lambda>" in paths)
+    # Tail calls replace the calling function, so the loop never nests.
+    assert_true("loop" in paths)
+    assert_true("loop;loop" not in paths)
+
+
+def test_report():
+    report = profile(PROGRAM).report()
+
+    assert_true(report.startswith("function"))
+    assert_true("special form" in report)
+    assert_true("fib" in report)
+
+
+def test_profiler_is_only_active_inside_the_block():
+    profiler = Profiler()
+    with profiler:
+        assert_true(compiler.profiler is profiler)
+
+    assert_equals(None, compiler.profiler)
+    interpret("((lambda (x) x) 1)", Environment())
+    assert_equals({}, profiler.calls)
+
+
+def test_only_the_compiler_engine_is_profiled():
+    with assert_raises_regexp(LispError, "Only the compiler engine"):
+        interpret_file("stdlib.diy", Environment(), "vm", Profiler(), cache=False)
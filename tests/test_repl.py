@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from nose.tools import assert_equals, assert_raises, with_setup
+
+from diylisp import repl
+from diylisp.parser import Reader
+from diylisp.types import Environment
+
+"""
+The REPL reads a line at a time, and runs each expression as soon as a line
+completes it.
+"""
+
+prompts = []
+
+
+def typing(*lines):
+    """Stand in for `input`, returning lines one at a time, and then ^D"""
+
+    lines = iter(lines)
+
+    def fake_input(prompt):
+        prompts.append(prompt)
+        try:
+            return next(lines)
+        except StopIteration:
+            raise EOFError()
+
+    return fake_input
+
+
+def fake_terminal():
+    os.environ["ANSI_COLORS_DISABLED"] = "1"
+    del prompts[:]
+
+
+def restore_terminal():
+    del os.environ["ANSI_COLORS_DISABLED"]
+    repl.input = input if sys.version_info[0] >= 3 else raw_input
+
+
+@with_setup(fake_terminal, restore_terminal)
+def test_several_expressions_on_one_line():
+    repl.input = typing("(define x 1) (define y 2) x")
+
+    assert_equals([["define", "x", 1], ["define", "y", 2], "x"], list(repl.read_expressions(Reader())))
+
+
+@with_setup(fake_terminal, restore_terminal)
+def test_expression_spanning_lines():
+    repl.input = typing("(define x", "", "  ; a comment )))", "  (+ 1 2))", "y")
+    reader = Reader()
+
+    assert_equals([["define", "x", ["+", 1, 2]]], list(repl.read_expressions(reader)))
+    assert_equals(["→  ", "…  ", "…  ", "…  "], prompts)
+    assert_equals(["y"], list(repl.read_expressions(reader)))
+
+
+@with_setup(fake_terminal, restore_terminal)
+def test_parens_in_strings():
+    repl.input = typing('(define s "(((")', '(define t ")")')
+    reader = Reader()
+
+    assert_equals(1, len(list(repl.read_expressions(reader))))
+    assert_equals(1, len(list(repl.read_expressions(reader))))
+    assert_equals(["→  ", "→  "], prompts)
+
+
+@with_setup(fake_terminal, restore_terminal)
+def test_string_spanning_lines():
+    repl.input = typing('(define s "a', ')"', ' )')
+
+    ast = list(repl.read_expressions(Reader()))[0]
+    assert_equals('"a\n)"', str(ast[2]))
+    assert_equals(["→  ", "…  ", "…  "], prompts)
+
+
+@with_setup(fake_terminal, restore_terminal)
+def test_repl_session():
+    repl.input = typing("(define x 40) (+ x", "2)", "(head '())", "x")
+    env = Environment()
+    stdout = sys.stdout
+    sys.stdout = output = StringIO()
+
+    try:
+        assert_raises(SystemExit, repl.repl, env)
+    finally:
+        sys.stdout = stdout
+
+    lines = output.getvalue().splitlines()
+    assert_equals(["x", "42"], lines[8:10])
+    assert_equals(["!", "LispError:"], lines[10:12])
+    assert_equals(["40", "", "Bye! o/"], lines[-3:])
+
+
+@with_setup(fake_terminal, restore_terminal)
+def test_expressions_before_an_error_on_the_line_are_run():
+    repl.input = typing("(+ 1 2) )", "(head '()) 5", "(+ 2 2)")
+    stdout = sys.stdout
+    sys.stdout = output = StringIO()
+
+    try:
+        assert_raises(SystemExit, repl.repl, Environment())
+    finally:
+        sys.stdout = stdout
+
+    lines = output.getvalue().splitlines()[8:]
+    assert_equals(["3", "!", "LispError:", "Expected EOF, found ) at line 1, column 9"], lines[:4])
+    assert_equals(["!", "LispError:"], lines[4:6])
+    assert_equals(["4", "", "Bye! o/"], lines[7:])
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+import pickle
+
+from nose.tools import assert_equals, assert_true, assert_false, with_setup
+from os.path import join, exists
+
+from source_files import make_directory, remove_directory, write_source
+
+from diylisp import snapshot
+from diylisp.builtins import BUILTINS
+from diylisp.interpreter import interpret, interpret_file
+from diylisp.snapshot import interpret_snapshot, snapshot_path
+from diylisp.types import Builtin, Closure, ConsList, Environment, Frame, NIL
+
+"""
+Snapshots store the variables a lisp file defines, and are used instead of
+interpreting the file again as long as it has not changed.
+"""
+
+
+@with_setup(make_directory, remove_directory)
+def test_snapshot_is_written_and_used():
+    filename = write_source("(define double (lambda (x) (* 2 x)))\n(define xs '(1 2 3))")
+
+    env = Environment()
+    assert_equals("xs", interpret_snapshot(filename, env))
+    assert_true(exists(snapshot_path(filename)))
+
+    # The second time around the file must not be interpreted.
+    def fail(filename, env):
+        raise AssertionError("interpreted %s again" % filename)
+
+    env = Environment()
+    snapshot.interpret_file = fail
+    try:
+        assert_equals("xs", interpret_snapshot(filename, env))
+    finally:
+        snapshot.interpret_file = interpret_file
+
+    assert_equals("6", interpret("(double 3)", env))
+    assert_equals("(1 2 3)", interpret("xs", env))
+    assert_true(env.lookup("double").env is env)
+
+
+@with_setup(make_directory, remove_directory)
+def test_snapshot_is_invalidated_when_the_source_changes():
+    filename = write_source("(define answer 42)")
+    interpret_snapshot(filename, Environment())
+
+    write_source("(define answer 43)")
+    env = Environment()
+    interpret_snapshot(filename, env)
+    assert_equals(43, env.lookup("answer"))
+
+
+@with_setup(make_directory, remove_directory)
+def test_broken_snapshot_is_ignored():
+    filename = write_source("(define answer 42)")
+    interpret_snapshot(filename, Environment())
+
+    with open(snapshot_path(filename), "wb") as snapshotfile:
+        snapshotfile.write(b"garbage")
+
+    env = Environment()
+    interpret_snapshot(filename, env)
+    assert_equals(42, env.lookup("answer"))
+
+
+@with_setup(make_directory, remove_directory)
+def test_builtins_are_looked_up_when_the_snapshot_is_loaded():
+    filename = write_source("(define len (builtin length (lambda (lst) 0)))")
+    interpret_snapshot(filename, Environment())
+
+    length = BUILTINS["length"]
+    BUILTINS["length"] = Builtin("length", lambda lst: 42, 1)
+    try:
+        env = Environment()
+        interpret_snapshot(filename, env)
+        assert_true(env.lookup("len") is BUILTINS["length"])
+
+        # Without the builtin, the snapshot can not be used.
+        del BUILTINS["length"]
+        env = Environment()
+        interpret_snapshot(filename, env)
+        assert_equals("0", interpret("(len '(1 2))", env))
+    finally:
+        BUILTINS["length"] = length
+
+
+def test_unregistered_builtins_are_pickled_whole():
+    builtin = pickle.loads(pickle.dumps(Builtin("pow", pow, 2, 3), 2))
+
+    assert_equals(("pow", pow, 2, 3), (builtin.name, builtin.function, builtin.min_args, builtin.max_args))
+    assert_true(pickle.loads(pickle.dumps(BUILTINS["length"], 2)) is BUILTINS["length"])
+
+
+def test_pickling_runtime_values():
+    """ConsLists, frames and closures survive pickling, minus their compiled code"""
+
+    lst = ConsList.from_python([1, [2, 3], []])
+    copy = pickle.loads(pickle.dumps(lst, 2))
+    assert_equals(lst, copy)
+    assert_true(pickle.loads(pickle.dumps(NIL, 2)) is NIL)
+
+    env = Environment()
+    interpret("(define make-adder (lambda (n) (lambda (x) (+ x n))))", env)
+    interpret("(define add-two (make-adder 2))", env)
+    add_two = pickle.loads(pickle.dumps(env.lookup("add-two"), 2))
+
+    assert_true(isinstance(add_two, Closure))
+    assert_true(isinstance(add_two.env, Frame))
+    assert_equals(2, add_two.env.lookup("n"))
+    assert_equals(None, add_two.code)
+    assert_false(add_two.env.parent is env)
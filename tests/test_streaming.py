@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import time
+
+from nose.tools import assert_equals, assert_raises_regexp, assert_true, assert_false
+
+from diylisp.interpreter import interpret_stream, ENGINES
+from diylisp.parser import Reader, parse_multiple, parse_stream
+from diylisp.types import Environment, LispError
+
+"""
+Files and pipes are read a chunk at a time, and each expression is run as soon
+as it has been read.
+"""
+
+SOURCE = """
+(define fact ; the factorial
+    (lambda (n) (if (eq n 0) 1 (* n (fact (- n 1))))))
+(define greeting "hello (world) ; not a comment")
+'(a 'b "c d")
+(fact 10)
+"""
+
+
+def test_any_chunk_size_reads_the_same():
+    expected = parse_multiple(SOURCE)
+
+    for chunk_size in [1, 2, 3, 7, 64, 4096]:
+        assert_equals(expected, list(parse_stream(StringIO(SOURCE), chunk_size)))
+
+
+def test_expressions_are_read_as_soon_as_they_are_complete():
+    reader = Reader()
+
+    assert_equals([], reader.feed("(define x"))
+    assert_true(reader.pending)
+    assert_equals([["define", "x", 12]], reader.feed(" 12) foo"))
+    assert_equals(["foo", 1], reader.feed("\n1 "))
+    assert_false(reader.pending)
+    assert_equals([], reader.close())
+
+
+def test_atoms_split_between_chunks():
+    reader = Reader()
+
+    assert_equals([], reader.feed("12"))
+    assert_equals([], reader.feed("34"))
+    assert_equals([1234], reader.close())
+
+
+def test_only_the_source_not_read_yet_is_kept():
+    reader = Reader()
+
+    for _ in range(1000):
+        reader.feed("(define x 1)\n")
+
+    reader.feed("(foo (bar")
+    assert_equals("bar", reader.buffer)
+
+    for _ in range(1000):
+        reader.feed(" (baz)\n")
+
+    assert_equals("", reader.buffer.strip())
+    assert_equals([["foo", ["bar"] + [["baz"]] * 1000]], reader.feed("))"))
+
+
+def test_whitespace_and_comments_are_not_pending():
+    reader = Reader()
+
+    assert_equals([], reader.feed('; comment with " quote\n'))
+    assert_false(reader.pending)
+    assert_equals([], reader.feed("  \n\t"))
+    assert_false(reader.pending)
+    assert_equals([], reader.feed("; no newline yet"))
+    assert_false(reader.pending)
+    assert_equals([], reader.feed(" (still a comment\n(1"))
+    assert_true(reader.pending)
+    assert_equals([[1, 2]], reader.feed(" 2) "))
+    assert_false(reader.pending)
+
+    for unfinished in ["foo", '"abc', "(a ; b", "'"]:
+        reader = Reader()
+        reader.feed(unfinished)
+        assert_true(reader.pending)
+
+
+def test_strings_and_comments_split_between_chunks():
+    reader = Reader()
+
+    for chunk in ['(a "b\\', '"c', ' ; d)', '"', ' ; e)']:
+        assert_equals([], reader.feed(chunk))
+
+    assert_equals([["a", 'b\\"c ; d)']], [[ast[0], ast[1].val] for ast in reader.feed('\n)')])
+
+
+def time_feeding(source, chunk_size):
+    """The best of three times of reading source fed in chunks of chunk_size"""
+
+    times = []
+
+    for _ in range(3):
+        reader = Reader()
+        started = time.time()
+
+        for offset in range(0, len(source), chunk_size):
+            reader.feed(source[offset:offset + chunk_size])
+
+        reader.close()
+        times.append(time.time() - started)
+
+    return min(times)
+
+
+def test_long_tokens_are_read_in_linear_time():
+    """Doubling the length twice takes about four times as long, not sixteen"""
+
+    for make in [lambda n: '"' + "a" * n + '"', lambda n: "; " + "c" * n + "\n", lambda n: "x" * n + " "]:
+        short = time_feeding(make(20000), 16)
+        long = time_feeding(make(80000), 16)
+
+        assert_true(long < 8 * short + 0.01, "%f s for 20000 characters, %f s for 80000" % (short, long))
+
+
+def test_errors_report_the_position_in_the_whole_source():
+    with assert_raises_regexp(LispError, "unclosed list at line 4, column 5"):
+        list(parse_stream(StringIO("(a)\n(b)\n(c)\n    (d (e)"), 2))
+
+    with assert_raises_regexp(LispError, "Expected EOF, found \\) at line 2, column 4"):
+        list(parse_stream(StringIO("(a b c)\n(b))"), 3))
+
+    with assert_raises_regexp(LispError, "Unclosed string starting at line 1, column 5"):
+        list(parse_stream(StringIO("(a) \"abc"), 2))
+
+    with assert_raises_regexp(LispError, "unclosed list at line 2, column 3"):
+        list(parse_stream(StringIO("(a)\n  (b\n(c)\n(d)"), 1))
+
+
+def test_reader_starts_over_after_an_error():
+    reader = Reader()
+
+    with assert_raises_regexp(LispError, "Expected EOF"):
+        reader.feed("(a))")
+
+    assert_equals([["b"]], reader.feed("(b)"))
+
+
+def test_expressions_before_an_error_are_yielded_first():
+    reader = Reader()
+    read = []
+
+    with assert_raises_regexp(LispError, "Expected EOF"):
+        for ast in reader.expressions("(a) b ) (c)"):
+            read.append(ast)
+
+    assert_equals([["a"], "b"], read)
+    assert_equals([["d"]], reader.feed("(d)"))
+
+
+def test_stopping_early_drops_the_rest_of_the_chunk():
+    reader = Reader()
+    expressions = reader.expressions("(a) (b) (c")
+    next(expressions)
+    expressions.close()
+
+    assert_false(reader.pending)
+    assert_equals([["d"]], reader.feed("(d)"))
+
+
+def check_interpret_stream(engine):
+    env = Environment()
+    assert_equals("3628800", interpret_stream(StringIO(SOURCE), env, engine))
+    assert_equals('"hello (world) ; not a comment"', str(env.lookup("greeting")))
+
+
+def test_interpret_stream_on_every_engine():
+    for engine in ENGINES:
+        yield check_interpret_stream, engine
+
+
+def test_interpret_stream_runs_each_expression_as_it_is_read():
+    """An error comes only after the expressions before it have been run"""
+
+    env = Environment()
+
+    with assert_raises_regexp(LispError, "unclosed list"):
+        interpret_stream(StringIO("(define x 1) (define y"), env)
+
+    assert_equals(1, env.lookup("x"))
+
+    with assert_raises_regexp(LispError, "no expression found"):
+        interpret_stream(StringIO("; nothing but a comment"), env)
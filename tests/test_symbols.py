@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+import gc
+import pickle
+
+from nose import SkipTest
+from nose.tools import assert_equals, assert_true, assert_false
+
+from diylisp.evaluator import evaluate
+from diylisp.interpreter import interpret, ENGINES
+from diylisp.parser import parse, unparse
+from diylisp import types
+from diylisp.types import Environment, Symbol, symbol, SYMBOLS
+
+"""
+The parser interns symbols, so every occurrence of a name is the same object.
+"""
+
+
+def test_parser_interns_symbols():
+    ast = parse("(define foo (lambda (foo) (foo 'foo)))")
+
+    assert_true(type(ast[1]) is Symbol)
+    assert_true(ast[1] is ast[2][1][0])
+    assert_true(ast[1] is ast[2][2][0])
+    assert_true(ast[1] is ast[2][2][1][1])
+    assert_true(ast[0] is parse("(define)")[0])
+    assert_true(symbol("foo") is ast[1])
+
+
+def test_symbols_are_strings():
+    foo = symbol("foo")
+
+    assert_equals("foo", foo)
+    assert_equals(hash("foo"), hash(foo))
+    assert_equals({"foo": 1}[foo], 1)
+    assert_equals("foo", str(foo))
+    assert_equals("(foo 'bar)", unparse(parse("(foo 'bar)")))
+    assert_false(symbol("foo") is symbol("bar"))
+
+
+def test_symbols_are_interned_when_unpickled():
+    ast = pickle.loads(pickle.dumps(parse("(foo bar)"), 2))
+
+    assert_true(ast[0] is symbol("foo"))
+    assert_true(ast[1] is symbol("bar"))
+
+
+def test_unused_symbols_are_dropped():
+    """The intern table does not keep symbols alive, so it does not grow without bound"""
+
+    if isinstance(SYMBOLS, dict):
+        raise SkipTest("No weak references to symbols on this Python")
+
+    gc.collect()
+    before = len(SYMBOLS)
+    kept = parse("(kept-symbol)")
+
+    for n in range(10000):
+        parse("(unused-symbol-%d)" % n)
+
+    gc.collect()
+    assert_true(len(SYMBOLS) < before + 100)
+    assert_true(symbol("kept-symbol") is kept[0])
+
+
+def test_intern_table_is_bounded():
+    """Past MAX_SYMBOLS, new symbols are made but not interned"""
+
+    limit = types.MAX_SYMBOLS
+    types.MAX_SYMBOLS = len(SYMBOLS) + 10
+
+    try:
+        names = ["bounded-symbol-%d" % n for n in range(100)]
+        symbols = [symbol(name) for name in names]
+
+        assert_true(len(SYMBOLS) <= types.MAX_SYMBOLS)
+        assert_equals(names, symbols)
+        assert_true(all(type(s) is Symbol for s in symbols))
+        assert_true(symbols[0] is symbol(names[0]))
+        assert_false(symbols[-1] is symbol(names[-1]))
+    finally:
+        types.MAX_SYMBOLS = limit
+
+
+def test_plain_strings_still_work_as_symbols():
+    """ASTs built by hand, with plain strings, evaluate the same as parsed ones"""
+
+    env = Environment()
+    evaluate(["define", "x", ["+", 1, 2]], env)
+
+    assert_equals(3, evaluate("x", env))
+    assert_equals(3, evaluate(parse("x"), env))
+    assert_equals(4, evaluate(["if", ["eq", "x", 3], 4, 5], env))
+
+
+def check_quoted_symbols(engine):
+    env = Environment()
+    interpret("(define s 'foo)", env, engine)
+
+    assert_equals("#t", interpret("(eq s 'foo)", env, engine))
+    assert_equals("#f", interpret("(eq s 'bar)", env, engine))
+    assert_equals("(foo bar)", interpret("(cons s '(bar))", env, engine))
+
+
+def test_quoted_symbols_on_every_engine():
+    for engine in ENGINES:
+        yield check_quoted_symbols, engine
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import sys
+
+from nose.tools import assert_equals
+from os.path import dirname, relpath, join
+
+from diylisp.evaluator import evaluate
+from diylisp.interpreter import interpret, interpret_file
+from diylisp.parser import parse
+from diylisp.types import Environment
+
+"""
+Tail calls do not grow the Python stack, neither in `evaluate` nor in compiled code.
+The loops below would run way past the recursion limit otherwise.
+"""
+
+DEPTH = sys.getrecursionlimit() * 5
+
+LOOP = """
+    (define loop
+        (lambda (n acc)
+            (if (eq n 0)
+                acc
+                (let ((m (- n 1)))
+                    (cond ((#f 'never)
+                           (#t (loop m (+ acc 1)))))))))
+"""
+
+
+def test_tail_recursion_in_evaluate():
+    env = Environment()
+    evaluate(parse(LOOP), env)
+    assert_equals(DEPTH, evaluate(parse("(loop %d 0)" % DEPTH), env))
+
+
+def test_tail_recursion_in_compiled_code():
+    env = Environment()
+    interpret(LOOP, env)
+    assert_equals(str(DEPTH), interpret("(loop %d 0)" % DEPTH, env))
+
+
+def test_reduce_over_long_list():
+    env = Environment()
+    interpret_file(join(dirname(relpath(__file__)), '..', 'stdlib.diy'), env, cache=False)
+    interpret("""
+        (define build
+            (lambda (n acc)
+                (if (eq n 0)
+                    acc
+                    (build (- n 1) (cons n acc)))))
+    """, env)
+    interpret("(define add (lambda (a b) (+ a b)))", env)
+
+    assert_equals("12502500", interpret("(reduce add 0 (build 5000 '()))", env))
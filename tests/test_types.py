@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+import pickle
+
+from nose.tools import assert_equals, assert_true, assert_false
+
+from diylisp.builtins import append
+from diylisp.interpreter import interpret, ENGINES
+from diylisp.types import Closure, Environment, String
+
+"""
+The runtime types keep their fields in slots, with no per instance dict, since
+closures, environments and strings are created all the time. Strings share
+their characters between a string and its tail, and concatenate lazily.
+"""
+
+
+def test_no_instance_dicts():
+    for value in [Closure(Environment(), [], 1), Environment(), String("abc")]:
+        assert_false(hasattr(value, "__dict__"))
+
+
+def test_closures_keep_falsy_bodies():
+    """A body of 0 or #f is a body like any other"""
+
+    for engine in ENGINES:
+        env = Environment()
+        assert_equals("0", interpret("((lambda () 0))", env, engine))
+        assert_equals("#f", interpret("((lambda (x) #f) 1)", env, engine))
+        assert_equals("()", interpret("((lambda () '()))", env, engine))
+
+
+def test_pickled_closures_are_compiled_again():
+    env = Environment()
+    interpret("(define inc (lambda (x) (+ x 1)))", env)
+    interpret("(inc 1)", env)
+
+    closure = pickle.loads(pickle.dumps(env.lookup("inc"), 2))
+
+    assert_equals(None, closure.code)
+    assert_equals("inc", closure.name)
+    assert_equals(["x"], closure.params)
+
+
+def test_string_equality_and_hashing():
+    assert_equals(String("abc"), String("abc"))
+    assert_true(String("abc") != String("abd"))
+    assert_false(String("abc") != String("abc"))
+    assert_false(String("abc") == "abc")
+    assert_equals(1, len(set([String("abc"), String("abc")])))
+
+
+def test_appending_strings():
+    assert_equals(String("abcdef"), append(String("abc"), String("def")))
+    assert_equals(String("abcdef"), String("abc") + String("def"))
+
+
+def test_string_tails_share_the_text():
+    string = String("abcdef")
+    rest = string.tail.tail
+
+    assert_true(rest.text is string.text)
+    assert_equals(String("cdef"), rest)
+    assert_equals(String("c"), rest.head)
+    assert_equals(4, len(rest))
+
+
+def test_prepending_to_strings_joins_them_lazily():
+    string = String("c")
+    for char in "ba":
+        string = String(char) + string
+
+    assert_true(string.parts is not None)
+    assert_equals(String("a"), string.head)
+    assert_equals(String("bc"), string.tail)
+    assert_equals("abc", string.val)
+    assert_true(string.parts is None)
+
+
+def test_long_concatenations():
+    """Joining goes through the parts without recursion, and keeps them in order"""
+
+    string = String("")
+    for n in range(20000):
+        string = String.concat(String(str(n % 10)), string) if n % 2 else string + String(str(n % 10))
+
+    assert_equals(20000, len(string))
+    assert_equals(String("97531"), String.view(string.val, 0, 5))
+    assert_equals(string.val[-5:], "02468")
+
+
+def test_strings_built_and_walked_one_character_at_a_time():
+    for engine in ENGINES:
+        env = Environment()
+        interpret("(define rev (lambda (s acc) (if (empty s) acc (rev (tail s) (cons (head s) acc)))))", env, engine)
+        text = "abcdefghij" * 200
+
+        assert_equals('"%s"' % text[::-1], interpret('(rev "%s" "")' % text, env, engine))
+        assert_equals("#t", interpret('(eq (rev (rev "%s" "") "") "%s")' % (text, text), env, engine))
+
+
+def test_string_views_are_pickled_without_their_text():
+    view = String("abcdef").tail.tail.tail
+    copy = pickle.loads(pickle.dumps(view, 2))
+
+    assert_equals(String("def"), copy)
+    assert_equals("def", copy.text)
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+import types
+
+from functools import partial
+from nose.tools import assert_equals, assert_raises_regexp, assert_true
+from os.path import dirname, relpath, join
+
+from diylisp import interpreter
+from diylisp.bytecode import compile_bytecode
+from diylisp.interpreter import interpret, interpret_file, ENGINES
+from diylisp.parser import parse
+from diylisp.types import Environment, LispError
+from diylisp.vm import execute, Machine, PAUSED
+
+"""
+The bytecode compiler and virtual machine are tested against the tree-walking
+evaluator: the same programs must give the same results on every engine.
+"""
+
+path = join(dirname(relpath(__file__)), '..', 'stdlib.diy')
+
+# Test modules using `interpret`, which are run again on every engine.
+SUITES = ["test_7_using_the_language", "test_8_final_touches", "test_builtins"]
+
+PROGRAMS = [
+    "42",
+    "#t",
+    "'(1 (2 3) foo)",
+    "(+ 1 2 3 4)",
+    "(- 10)",
+    "(< 1 2 3)",
+    "(mod 7 3)",
+    "(atom '(1 2))",
+    "(eq 'foo 'foo)",
+    "(if (> 1 2) 'yes 'no)",
+    "(cond (((eq 1 2) 'first) ((eq 2 2) 'second)))",
+    "(cond (((eq 1 2) 'first)))",
+    "(let ((a 1) (b (+ a 1))) (* a b))",
+    "(let ((a 1)) (let ((a 2) (b a)) (+ a b)))",
+    "((lambda (x y) (- x y)) 10 3)",
+    "(((lambda (x) (lambda (y) (+ x y))) 3) 4)",
+    "(cons 1 (cons 2 '()))",
+    "(head (tail '(1 2 3)))",
+    "(empty '())",
+    "((lambda () (if (define x 3) (+ x 1) 0)))",
+    "((lambda (x) (let ((y 2)) (if (define z 5) (+ x (+ y z)) 0))) 1)",
+    "((lambda (x x) x) 1 2)",
+    "(define answer 42)",
+    "((lambda (f n) (f f n 0)) (lambda (self n acc) (if (eq n 0) acc (self self (- n 1) (+ acc n)))) 1000)",
+    "(sort (map (lambda (x) (- 0 x)) (range 1 10)))",
+    "(reduce (lambda (acc x) (+ acc x)) 0 (filter (lambda (x) (eq (mod x 2) 0)) (range 1 100)))",
+    "(length (append (reverse (range 1 50)) (range 1 50)))",
+    ("(define g (lambda (y) 'global))", "(let ((f (lambda (x) (g x))) (g (lambda (y) 'local))) (f 1))"),
+    ("(define x 'global)", "(let ((f (lambda () x)) (x 'local)) (f))"),
+    "(let ((a (define b 1)) (c (define b 2))) b)",
+    "(let ((x 1) (y 2)) (if (define x 3) (+ x y) 0))",
+    "(let ((x 1) (f (lambda () x)) (x 2)) (cons x (cons (f) '())))",
+]
+
+ERRORS = [
+    ("(1 2)", "Not a function"),
+    ("((lambda (x) x))", "wrong number of arguments"),
+    ("(+ 1 #t)", "not a number"),
+    ("(/ 1 0)", "Division by zero"),
+    ("(undefined-variable)", "not defined"),
+    ("(head '())", "empty list"),
+    ("(if #t 1)", "if expects 3"),
+    ("(cond ((#t)))", "Every condition must be a tuple"),
+    ("(cond ((#t 1 2)))", "Every condition must be a tuple"),
+    ("(let ((x)) x)", "bindings of a let"),
+]
+
+
+def new_environment(engine):
+    env = Environment()
+    interpret_file(path, env, engine, cache=False)
+    return env
+
+
+def run_statements(statements, engine):
+    """Interpret a program, or a tuple of statements one after the other, returning the last value"""
+    env = new_environment(engine)
+    statements = statements if isinstance(statements, tuple) else (statements,)
+    return [interpret(statement, env, engine) for statement in statements][-1]
+
+
+def assert_same_results(source):
+    results = [run_statements(source, engine) for engine in ["evaluator", "compiler", "vm"]]
+    assert_equals(results[0], results[1])
+    assert_equals(results[0], results[2])
+
+
+def assert_raises_on_every_engine(source, message):
+    for engine in ENGINES:
+        with assert_raises_regexp(LispError, message):
+            interpret(source, new_environment(engine), engine)
+
+
+def test_engines_agree():
+    for source in PROGRAMS:
+        yield assert_same_results, source
+
+
+def test_engines_agree_on_errors():
+    for source, message in ERRORS:
+        yield assert_raises_on_every_engine, source, message
+
+
+def load_suite(name, engine):
+    """
+    Load a new copy of the test module name, with `interpret` and `interpret_file` running
+    on engine, including in the code run as it is loaded.
+    """
+    filename = join(dirname(relpath(__file__)), name + ".py")
+    module = types.ModuleType("%s_on_%s" % (name, engine))
+    module.__file__ = filename
+
+    with open(filename) as source:
+        code = compile(source.read(), filename, "exec")
+
+    functions = interpreter.interpret, interpreter.interpret_file
+    interpreter.interpret = partial(interpret, engine=engine)
+    interpreter.interpret_file = partial(interpret_file, engine=engine)
+    try:
+        exec(code, module.__dict__)
+    finally:
+        interpreter.interpret, interpreter.interpret_file = functions
+
+    return module
+
+
+def run_suite_case(test):
+    setup = getattr(test, "setup", None)
+    if setup is not None:
+        setup()
+
+    cases = test()
+    for case in cases or []:
+        case[0](*case[1:])
+
+
+def test_suites_on_every_engine():
+    """The tests of the language and the stdlib pass the same on every engine"""
+
+    for engine in ENGINES:
+        for name in SUITES:
+            module = load_suite(name, engine)
+            tests = [test for test_name, test in vars(module).items()
+                     if test_name.startswith("test_") and getattr(test, "__module__", None) == module.__name__]
+
+            for test in sorted(tests, key=lambda test: test.__code__.co_firstlineno):
+                yield run_suite_case, test
+
+
+def test_errors_are_raised_at_runtime():
+    """Like the compiler, the bytecode compiler defers errors until they are evaluated"""
+
+    env = Environment()
+    assert_equals("1", interpret("(if #t 1 (if 2))", env, "vm"))
+
+    with assert_raises_regexp(LispError, "Wrong number of arguments"):
+        interpret("(if #f 1 (if 2))", env, "vm")
+
+
+def test_local_defines_change_the_version():
+    """A define inside a function invalidates cached lookups, like a global define does"""
+
+    for engine in ["compiler", "vm"]:
+        env = Environment()
+        interpret("(define f (lambda (x) (define y x)))", env, engine)
+        version = Environment.version
+        interpret("(f 1)", env, engine)
+        assert_true(Environment.version != version)
+
+
+def test_code_runs_again():
+    code = compile_bytecode(parse("((lambda (x) (* x x)) y)"))
+    env = Environment({"y": 3})
+    assert_equals(9, execute(code, env))
+    assert_equals(9, execute(code, env))
+
+
+def test_disassemble():
+    code = compile_bytecode(parse("(if (< x 1) 2 3)"))
+    assert_equals("\n".join(["0 LOAD_GLOBAL 0",
+                             "2 CONST 1",
+                             "4 BINARY 2",
+                             "6 JUMP_IF_FALSE 12",
+                             "8 CONST 3",
+                             "10 JUMP 14",
+                             "12 CONST 4",
+                             "14 RETURN 0"]), code.disassemble())
+
+
+def test_deep_recursion():
+    """The machine does not recurse in Python, even for calls not in tail position"""
+
+    env = new_environment("vm")
+    interpret("(define count (lambda (lst) (if (empty lst) 0 (+ 1 (count (tail lst))))))", env, "vm")
+    assert_equals("20000", interpret("(count (range 1 20000))", env, "vm"))
+
+
+def test_machine_runs_in_steps():
+    """Given a budget, the machine stops before that many calls, and goes on where it stopped"""
+
+    env = new_environment("vm")
+    interpret("(define count (lambda (lst) (if (empty lst) 0 (+ 1 (count (tail lst))))))", env, "vm")
+    machine = Machine(compile_bytecode(parse("(count (range 1 1000))")), env)
+
+    steps = 1
+    value = machine.run(100)
+    while value is PAUSED:
+        steps += 1
+        value = machine.run(100)
+
+    assert_equals(1000, value)
+    assert_true(steps > 10)
+
+
+def test_closures_are_shared_between_engines():
+    env = Environment()
+    interpret("(define square (lambda (x) (* x x)))", env, "compiler")
+    interpret("(define twice (lambda (f x) (f (f x))))", env, "vm")
+
+    assert_equals("16", interpret("(twice square 2)", env, "vm"))
+    assert_equals("16", interpret("(twice square 2)", env, "compiler"))
+    assert_equals("16", interpret("(twice square 2)", env, "evaluator"))
+
+
+def test_unknown_engine():
+    with assert_raises_regexp(LispError, "Unknown engine"):
+        interpret("1", Environment(), "jit")